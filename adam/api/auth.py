@@ -1,12 +1,12 @@
 from fastapi import APIRouter, Request, Depends, HTTPException
 from fastapi.responses import RedirectResponse
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from itsdangerous import URLSafeSerializer
-from oauthlib.oauth2.rfc6749.errors import InvalidGrantError
 
-from models.database import get_db
+from models.database import get_async_db
 from models.users import SSOUser
-from services.sso_service import sso
+from services.db_service import AsyncDBService
+from services.sso_service import get_sso, invalid_grant_error
 from config import config
 
 auth_router = APIRouter(prefix=config.api.auth, tags=["Auth"])
@@ -15,18 +15,21 @@ serializer = URLSafeSerializer(config.encryption.user_session_key.get_secret_val
 
 @auth_router.get("/login")
 async def auth_init():
+    sso = get_sso()
     async with sso:
         return await sso.get_login_redirect()
 
 
 @auth_router.get("/callback")
-async def auth_callback(request: Request, db: Session = Depends(get_db)):
+async def auth_callback(request: Request, db: AsyncSession = Depends(get_async_db)):
+    sso = get_sso()
     try:
         async with sso:
             # Get user data from SSO
             user = await sso.verify_and_process(request)
             # Check if the user exists in the database
-            existing_user = db.query(SSOUser).filter(SSOUser.sso_id == user.id).first()
+            db_service = AsyncDBService(db)
+            existing_user = await db_service.get_sso_user_by(sso_id=user.id)
             if not existing_user:
                 # If the user does not exist - add
                 sso_user = SSOUser(
@@ -37,10 +40,7 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
                     last_name=user.last_name,
                     picture=user.picture,
                 )
-                db.add(sso_user)
-                db.commit()
-                db.refresh(sso_user)
-                existing_user = sso_user
+                existing_user = await db_service.add_sso_user(sso_user)
 
             token = serializer.dumps(str(existing_user.id))
             # Set a cookie and redirects to the home page
@@ -53,7 +53,8 @@ async def auth_callback(request: Request, db: Session = Depends(get_db)):
             )
             return response
 
-    except InvalidGrantError:
+    # Evaluated only when something was raised, oauthlib is loaded by then
+    except invalid_grant_error():
         raise HTTPException(
             status_code=400,
             detail="SSO authorization code has expired. Please log in again.",
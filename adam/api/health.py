@@ -1,9 +1,21 @@
 from fastapi import APIRouter
+from fastapi.responses import ORJSONResponse
 
-health_router = APIRouter()
+from services.readiness import readiness
+
+health_router = APIRouter(default_response_class=ORJSONResponse)
 
 
 @health_router.get("/health", tags=["System"])
 async def healthcheck():
     status = {"status": "ok"}
     return status
+
+
+@health_router.get("/ready", tags=["System"])
+async def readiness_check():
+    # Results of the background probes, the request itself checks nothing
+    status = readiness()
+    return ORJSONResponse(
+        status_code=200 if status["status"] == "ready" else 503, content=status
+    )
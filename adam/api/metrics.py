@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Response
+
+from services.metrics import render_metrics
+
+metrics_router = APIRouter()
+
+
+@metrics_router.get("/metrics", tags=["System"], include_in_schema=False)
+async def metrics() -> Response:
+    return render_metrics()
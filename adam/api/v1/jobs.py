@@ -0,0 +1,63 @@
+import asyncio
+
+import orjson
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse, StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from models.database import AsyncSessionLocal, get_async_db
+from models.jobs import ProvisioningJob
+from schemas.jobs import JobResponse
+from services.db_service import AsyncDBService
+from services.serializers import serialize_job
+
+jobs_router = APIRouter(prefix=f"{config.api.v1.users}/{{user_id}}/jobs", tags=["Jobs"])
+
+
+async def _get_job(db: AsyncSession, user_id: str, job_id: str) -> ProvisioningJob:
+    """The job if it belongs to the user, the path is access checked by user"""
+    job = await AsyncDBService(db).get_job(job_id)
+    if job is None or job.sso_user_id != user_id:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+
+@jobs_router.get("/{job_id}", response_model=JobResponse)
+async def get_job(user_id: str, job_id: str, db: AsyncSession = Depends(get_async_db)):
+    job = await _get_job(db, user_id, job_id)
+    return ORJSONResponse(serialize_job(job))
+
+
+@jobs_router.get("/{job_id}/events")
+async def job_events(user_id: str, job_id: str, request: Request):
+    """Server-sent events with the job on every change, ends when it finishes"""
+    async with AsyncSessionLocal() as db:
+        await _get_job(db, user_id, job_id)
+
+    async def stream():
+        sent = None
+        while True:
+            # A session per check, so a long stream holds no connection
+            async with AsyncSessionLocal() as db:
+                job = await AsyncDBService(db).get_job(job_id)
+            if job is None:
+                # Removed while it was followed
+                yield b"event: error\ndata: " + orjson.dumps(
+                    {"detail": "Job not found"}
+                ) + b"\n\n"
+                return
+            data = orjson.dumps(serialize_job(job))
+            if data != sent:
+                yield b"data: " + data + b"\n\n"
+                sent = data
+            if job.finished or await request.is_disconnected():
+                return
+            await asyncio.sleep(config.jobs.poll_interval)
+
+    return StreamingResponse(
+        stream(),
+        media_type="text/event-stream",
+        # Proxies must pass events through as they come
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
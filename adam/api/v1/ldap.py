@@ -1,113 +1,137 @@
-from fastapi import APIRouter, Request, Depends, HTTPException
-from fastapi.responses import JSONResponse, RedirectResponse
-from sqlalchemy.orm import Session
+import orjson
+from fastapi import APIRouter, Request, Depends, HTTPException, Response
+from fastapi.responses import ORJSONResponse, RedirectResponse
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import config
-from models.database import get_db
-from models.ldap_accounts import LDAPAccount
-from services.ad_service import ADService
-from services.db_service import DBService
-from services.utils import generate_password
-from schemas.ldap import LDAPUserAttributes
+from models.database import get_async_db
+from schemas.jobs import JobQueuedResponse
+from schemas.ldap import (
+    LDAPAccountCreateResponse,
+    LDAPAccountResponse,
+    PasswordResetResponse,
+)
+from services.account_cache import (
+    AccountsVersion,
+    get_fragment,
+    reveal_passwords,
+    set_fragment,
+)
+from services.account_service import create_account, get_account, reset_password
+from services.db_service import AsyncDBService
+from services.identity import get_sso_user
+from services.jobs import enqueue, job_urls
+from services.provisioning import build_user_attributes
+from services.single_flight import single_flight
+from services.serializers import (
+    serialize_job,
+    serialize_ldap_account_display,
+    serialize_ldap_account_row,
+)
+from services.utils import username_from_email
 from services.logging_config import get_logger
 
-
 ldap_router = APIRouter(prefix=f"{config.api.v1.users}/{{user_id}}", tags=["LDAP"])
 logger = get_logger(__name__)
 
 
-@ldap_router.get("/ldap_account")
-async def get_ldap_accounts(user_id: str, db: Session = Depends(get_db)):
-    db_service = DBService(db)
-    sso_user = db_service.get_sso_user_by_id(user_id)
+@ldap_router.get("/ldap_account", response_model=list[LDAPAccountResponse])
+async def get_ldap_accounts(
+    user_id: str, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    db_service = AsyncDBService(db)
+    sso_user = await get_sso_user(request, user_id, db_service)
     if not sso_user:
         raise HTTPException(status_code=404, detail="User not found")
-    ldap_accounts = db_service.get_ldap_accounts_by_user_id(user_id)
-    return ldap_accounts
-
 
-@ldap_router.post("/ldap_account")
+    version = AccountsVersion(await db_service.get_ldap_account_versions(user_id))
+    if version.matches(request):
+        return version.not_modified()
+    rows = get_fragment("json", user_id, version)
+    if rows is None:
+        ldap_accounts = await db_service.get_ldap_accounts_by_user_id(user_id)
+        rows = [serialize_ldap_account_row(account) for account in ldap_accounts]
+        set_fragment("json", user_id, version, rows)
+    # Decrypted for this response only, the cache keeps them encrypted
+    body = orjson.dumps(reveal_passwords(rows))
+    return Response(body, media_type="application/json", headers=version.headers())
+
+
+@ldap_router.post(
+    "/ldap_account",
+    response_model=LDAPAccountCreateResponse,
+    responses={202: {"model": JobQueuedResponse}},
+)
 async def create_ldap_account(
-    user_id: str, request: Request, db: Session = Depends(get_db)
+    user_id: str, request: Request, db: AsyncSession = Depends(get_async_db)
 ):
-    db_service = DBService(db)
-    sso_user = db_service.get_sso_user_by_id(user_id)
+    db_service = AsyncDBService(db)
+    sso_user = await get_sso_user(request, user_id, db_service)
     if not sso_user:
         error_message = "User not found"
-        logger.error(f"{error_message}: {user_id}")
+        logger.error("%s: %s", error_message, user_id)
         if "application/json" in request.headers.get("Accept", ""):
-            return JSONResponse(status_code=404, content={"detail": error_message})
+            return ORJSONResponse(status_code=404, content={"detail": error_message})
         request.session["flash_message"] = error_message
         return RedirectResponse(url="/", status_code=303)
 
     try:
-        username = sso_user.email.split("@")[0].replace(".", "_")
+        username = username_from_email(sso_user.email)
     except IndexError:
         error_message = "Invalid email"
-        logger.error(f"{error_message}: {sso_user.email}")
+        logger.error("%s: %s", error_message, sso_user.email)
         if "application/json" in request.headers.get("Accept", ""):
-            return JSONResponse(status_code=400, content={"detail": error_message})
+            return ORJSONResponse(status_code=400, content={"detail": error_message})
         request.session["flash_message"] = error_message
         return RedirectResponse(url="/", status_code=303)
 
-    password = generate_password()
-
     try:
-        attributes = LDAPUserAttributes(
-            cn=username,
-            sAMAccountName=username,
-            userPrincipalName=f"{username}@{config.ldap.domain}",
-            mail=sso_user.email,
-            password=password,
-        )
+        attributes = build_user_attributes(username, sso_user.email)
     except ValueError as e:
         error_message = f"User attributes validation error: {str(e)}"
         logger.error(error_message)
         if "application/json" in request.headers.get("Accept", ""):
-            return JSONResponse(status_code=400, content={"detail": error_message})
+            return ORJSONResponse(status_code=400, content={"detail": error_message})
         request.session["flash_message"] = error_message
         return RedirectResponse(url="/", status_code=303)
 
-    ad_service = ADService()
+    if config.jobs.enabled:
+        job = await enqueue(db, "create", user_id)
+        if "application/json" in request.headers.get("Accept", ""):
+            urls = job_urls(job)
+            return ORJSONResponse(
+                status_code=202,
+                content={**serialize_job(job), **urls},
+                headers={"Location": urls["status_url"]},
+            )
+        # The home page follows the progress of the user's active job
+        return RedirectResponse(url="/", status_code=303)
+
     try:
-        ad_account, was_existing = ad_service.create_account(
-            user_id, db, username, attributes
-        )
-        logger.info(f"Account processed for {username}: {vars(ad_account)}")
-        success_message = (
-            "AD account already exist, password reset"
-            if was_existing
-            else "AD account successfully created"
+        success_message = await single_flight.run(
+            "create",
+            user_id,
+            lambda: create_account(user_id, username, attributes),
         )
     except HTTPException as e:
         error_message = e.detail
-        logger.error(f"Creation error: {error_message}")
+        logger.error("Creation error: %s", error_message)
         if "application/json" in request.headers.get("Accept", ""):
-            return JSONResponse(
-                status_code=e.status_code, content={"detail": error_message}
+            return ORJSONResponse(
+                status_code=e.status_code,
+                content={"detail": error_message},
+                headers=e.headers,
             )
         request.session["flash_message"] = error_message
         return RedirectResponse(url="/", status_code=303)
 
-    logger.info(f"Success: {success_message}")
+    logger.info("Success: %s", success_message)
     if "application/json" in request.headers.get("Accept", ""):
-        # Prepare JSON response with all fields displayed in web interface
-        columns = [
-            col.name
-            for col in LDAPAccount.__table__.columns
-            if col.name not in ["sso_user_id", "created_at"]
-        ]
-        account_dict = {col: getattr(ad_account, col) for col in columns}
-        # Decrypt password for display
-        account_dict["kadmin_password"] = db_service.encryptor.decrypt_password(
-            ad_account.kadmin_password
-        )
-        # Map column names to display names
-        display_account = {
-            LDAPAccount.display_names.get(col, col): value
-            for col, value in account_dict.items()
-        }
-        return JSONResponse(
+        # Read back, a duplicate request gets the account its leader created
+        ad_account = await get_account(db_service, user_id, username)
+        # All fields displayed in web interface, keyed by their display names
+        display_account = serialize_ldap_account_display(ad_account)
+        return ORJSONResponse(
             status_code=200,
             content={"message": success_message, "account": display_account},
         )
@@ -115,16 +139,14 @@ async def create_ldap_account(
     return RedirectResponse(url="/", status_code=303)
 
 
-@ldap_router.post("/ldap_account/reset_password")
+@ldap_router.post("/ldap_account/reset_password", response_model=PasswordResetResponse)
 async def reset_ldap_account_password(
-    user_id: str, request: Request, db: Session = Depends(get_db)
+    user_id: str, request: Request, db: AsyncSession = Depends(get_async_db)
 ):
-    db_service = DBService(db)
-    ad_service = ADService()
+    db_service = AsyncDBService(db)
 
     try:
-        ad_service.connect()
-        sso_user = db_service.get_sso_user_by_id(user_id)
+        sso_user = await get_sso_user(request, user_id, db_service)
         if not sso_user:
             error_message = "User not found"
             if "application/json" in request.headers.get("Accept", ""):
@@ -132,32 +154,18 @@ async def reset_ldap_account_password(
             request.session["flash_message"] = error_message
             return RedirectResponse(url="/", status_code=303)
 
-        ldap_username = sso_user.email.split("@")[0].replace(".", "_")
-        accounts = db_service.get_ldap_accounts_by_user_id(user_id)
-        account_found = None
-        for account in accounts:
-            if account.kadmin_principal == ldap_username:
-                account_found = account
-                break
-        if not account_found:
-            error_message = f"No record found in the database for '{ldap_username}'"
-            if "application/json" in request.headers.get("Accept", ""):
-                raise HTTPException(status_code=404, detail=error_message)
-            request.session["flash_message"] = error_message
-            return RedirectResponse(url="/", status_code=303)
-
-        user_dn = f"CN={ldap_username},{config.ldap.default_users_dn}"
-        new_password = ad_service.reset_password(ldap_username, user_dn)
-        encrypted_password = ad_service.encryptor.encrypt_password(new_password)
-
-        account_found.kadmin_password = encrypted_password
-        db.commit()
-        db.refresh(account_found)
-
-        success_message = f"Password successfully reset for '{ldap_username}'"
+        ldap_username = username_from_email(sso_user.email)
+        success_message = await single_flight.run(
+            "reset", user_id, lambda: reset_password(user_id, ldap_username)
+        )
         logger.info(success_message)
         if "application/json" in request.headers.get("Accept", ""):
-            return JSONResponse(
+            # Read back, a duplicate request gets the password its leader set
+            account = await get_account(db_service, user_id, ldap_username)
+            new_password = db_service.encryptor.decrypt_password(
+                account.kadmin_password
+            )
+            return ORJSONResponse(
                 status_code=200,
                 content={"message": success_message, "kadmin_password": new_password},
             )
@@ -165,17 +173,15 @@ async def reset_ldap_account_password(
         return RedirectResponse(url="/", status_code=303)
 
     except HTTPException as e:
-        logger.error(f"Reset password error: {e.detail}")
+        logger.error("Reset password error: %s", e.detail)
         if "application/json" in request.headers.get("Accept", ""):
             raise e
         request.session["flash_message"] = e.detail
         return RedirectResponse(url="/", status_code=303)
     except Exception as e:
         error_message = f"Password reset error: {str(e)}"
-        logger.error(f"Unexpected error: {error_message}")
+        logger.error("Unexpected error: %s", error_message)
         if "application/json" in request.headers.get("Accept", ""):
             raise HTTPException(status_code=500, detail=error_message)
         request.session["flash_message"] = error_message
         return RedirectResponse(url="/", status_code=303)
-    finally:
-        ad_service.disconnect()
@@ -0,0 +1,74 @@
+import secrets
+import threading
+from typing import Optional
+
+import orjson
+from fastapi import APIRouter, Depends, Header, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from models.database import SessionLocal, get_async_db
+from schemas.ldap import LDAPBatchRequest
+from schemas.reconciliation import DriftReportResponse
+from services.batch_service import BatchProvisioner
+from services.ldap_pool import run_ldap, submit_ldap
+from services.reconciliation import drift_report
+from services.logging_config import get_logger
+
+ldap_batch_router = APIRouter(prefix="/ldap_accounts", tags=["LDAP"])
+logger = get_logger(__name__)
+
+
+def verify_admin_token(authorization: Optional[str] = Header(None)) -> None:
+    """Allows the request only with the configured admin bearer token"""
+    if config.admin.token is None:
+        raise HTTPException(status_code=404, detail="Not Found")
+    expected = f"Bearer {config.admin.token.get_secret_value()}"
+    if not authorization or not secrets.compare_digest(authorization, expected):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+@ldap_batch_router.post("/batch", dependencies=[Depends(verify_admin_token)])
+async def provision_ldap_accounts(batch: LDAPBatchRequest) -> StreamingResponse:
+    """Provisions accounts for SSO user ids or emails, streams results as NDJSON"""
+    logger.info("Batch provisioning of %s users", len(batch.users))
+
+    # Steps of the generator run on the LDAP executor, so batches share its
+    # bound with other AD work
+    async def stream():
+        db = SessionLocal()
+        results = BatchProvisioner(db).provision(batch.users)
+        # Held by the step in progress, closing after a disconnect waits for it
+        lock = threading.Lock()
+
+        def step() -> Optional[dict]:
+            with lock:
+                return next(results, None)
+
+        def close() -> None:
+            with lock:
+                results.close()
+                db.close()
+
+        try:
+            while (result := await run_ldap(step)) is not None:
+                yield orjson.dumps(result) + b"\n"
+        finally:
+            # Not awaited, a stream cancelled by a disconnect can not wait
+            submit_ldap(close)
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+
+@ldap_batch_router.get(
+    "/drift",
+    dependencies=[Depends(verify_admin_token)],
+    response_model=DriftReportResponse,
+)
+async def get_account_drift(
+    limit: int = Query(1000, ge=1, le=10000),
+    db: AsyncSession = Depends(get_async_db),
+) -> dict:
+    """Accounts that differ from AD, as found by python cli.py reconcile"""
+    return await drift_report(db, limit)
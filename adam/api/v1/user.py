@@ -1,35 +1,43 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import ORJSONResponse
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import uuid4
 
-from models.database import get_db
+from models.database import get_async_db
 from models.users import SSOUser
 from schemas import SSOUserCreate
 from schemas import SSOUserResponse
+from services.identity import get_current_user, identity_cache
+from services.serializers import serialize_sso_user
 from config import config
 
 user_router = APIRouter(prefix=config.api.v1.users, tags=["User"])
 
 
 @user_router.get("/{username}", response_model=SSOUserResponse)
-def get_id_by_username(username: str, db: Session = Depends(get_db)):
-    # Search for a user by username
-    db_user = db.query(SSOUser).filter(SSOUser.username == username).first()
+async def get_id_by_username(
+    username: str, request: Request, db: AsyncSession = Depends(get_async_db)
+):
+    # The middleware has already resolved the user if it requests itself
+    db_user = await get_current_user(request)
+    if db_user is None or db_user.username != username:
+        # Search for a user by username
+        db_user = await db.scalar(select(SSOUser).where(SSOUser.username == username))
 
     # If the user is not found, returns 404
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
     # Return the user's data
-    db_user.id = db_user.id
-    return db_user
+    return ORJSONResponse(serialize_sso_user(db_user))
 
 
 @user_router.post("/", response_model=SSOUserCreate)
-def create_user(user: SSOUserCreate, db: Session = Depends(get_db)):
+async def create_user(user: SSOUserCreate, db: AsyncSession = Depends(get_async_db)):
     # Check if a user with this sso_id or username exists
-    db_user_sso = db.query(SSOUser).filter(SSOUser.sso_id == user.sso_id).first()
-    db_user_username = (
-        db.query(SSOUser).filter(SSOUser.username == user.username).first()
+    db_user_sso = await db.scalar(select(SSOUser).where(SSOUser.sso_id == user.sso_id))
+    db_user_username = await db.scalar(
+        select(SSOUser).where(SSOUser.username == user.username)
     )
 
     if db_user_sso:
@@ -54,8 +62,8 @@ def create_user(user: SSOUserCreate, db: Session = Depends(get_db)):
 
     # Add a user to the database
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
 
     return db_user
 
@@ -64,11 +72,11 @@ def create_user(user: SSOUserCreate, db: Session = Depends(get_db)):
 async def update_user(
     user_id: str,
     user_data: SSOUserCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
 
     # Search user by ID
-    db_user = db.query(SSOUser).filter(SSOUser.id == user_id).first()
+    db_user = await db.get(SSOUser, user_id)
 
     # If user is not found, returns 404
     if db_user is None:
@@ -79,23 +87,24 @@ async def update_user(
         setattr(db_user, key, value)
 
     # Save changes to database
-    db.commit()
-    db.refresh(db_user)
-    db_user.id = str(db_user.id)
+    await db.commit()
+    await db.refresh(db_user)
+    identity_cache.clear()
 
     # Return updated user data
-    return db_user
+    return ORJSONResponse(serialize_sso_user(db_user))
 
 
 @user_router.delete("/{user_id}")
 async def delete_user(
     user_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    db_user = db.query(SSOUser).filter(SSOUser.id == user_id).first()
+    db_user = await db.get(SSOUser, user_id)
     if db_user is None:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db.delete(db_user)
-    db.commit()
+    await db.delete(db_user)
+    await db.commit()
+    identity_cache.clear()
     return {"message": "User deleted successfully"}
@@ -0,0 +1,127 @@
+"""
+Command line entry point for maintenance tasks, run from the adam directory:
+
+    python cli.py provision user@domain.com 0ae7c98d-8f77-4727-9aee-4a8a3a1acdf0
+    python cli.py provision --file users.txt
+    python cli.py rotate-keys --batch-size 100
+    python cli.py reconcile --full
+    python cli.py migrate
+"""
+
+import argparse
+import json
+import sys
+
+from models.database import SessionLocal, database_revision, init_db
+from services.batch_service import DEFAULT_CHUNK_SIZE, BatchProvisioner
+from services.key_rotation import DEFAULT_BATCH_SIZE, DEFAULT_STATE_PATH, KeyRotation
+from services.logging_config import setup_logging
+from services.reconciliation import Reconciler
+
+
+def provision(args: argparse.Namespace) -> int:
+    """Provisions AD accounts and prints a JSON line per user"""
+    identifiers = list(args.users)
+    if args.file:
+        with open(args.file) if args.file != "-" else sys.stdin as f:
+            identifiers.extend(line.strip() for line in f)
+
+    db = SessionLocal()
+    failed = 0
+    try:
+        for result in BatchProvisioner(db, args.chunk_size).provision(identifiers):
+            failed += result["status"] in ("error", "not_found")
+            print(json.dumps(result), flush=True)
+    finally:
+        db.close()
+    return 1 if failed else 0
+
+
+def rotate_keys(args: argparse.Namespace) -> int:
+    """Re-encrypts stored passwords with the newest key, prints progress as JSON lines"""
+    db = SessionLocal()
+    progress = {"failed": 0}
+    try:
+        rotation = KeyRotation(db, args.batch_size, args.pause, args.state)
+        for progress in rotation.run(restart=args.restart):
+            print(json.dumps(progress), flush=True)
+    finally:
+        db.close()
+    return 1 if progress["failed"] else 0
+
+
+def reconcile(args: argparse.Namespace) -> int:
+    """Compares the accounts with AD, prints the run as JSON"""
+    db = SessionLocal()
+    try:
+        result = Reconciler(db, page_size=args.page_size).run(full=args.full)
+    finally:
+        db.close()
+    print(json.dumps(result, default=str))
+    return 0
+
+
+def migrate(args: argparse.Namespace) -> int:
+    """Applies pending migrations, which main does for every command"""
+    print(json.dumps({"revision": database_revision()}))
+    return 0
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="AD.AM maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    provision_parser = commands.add_parser(
+        "provision", help="Create AD accounts for SSO users by id or email"
+    )
+    provision_parser.add_argument("users", nargs="*", help="SSO user ids or emails")
+    provision_parser.add_argument(
+        "--file", help="File with a user id or email per line, '-' for stdin"
+    )
+    provision_parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    provision_parser.set_defaults(func=provision)
+
+    rotate_parser = commands.add_parser(
+        "rotate-keys",
+        help="Re-encrypt stored passwords with ENCRYPTION__SECRET_KEY, "
+        "the previous key must be in ENCRYPTION__OLD_KEYS",
+    )
+    rotate_parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    rotate_parser.add_argument(
+        "--pause", type=float, default=0.0, help="Seconds to sleep between batches"
+    )
+    rotate_parser.add_argument(
+        "--state", default=DEFAULT_STATE_PATH, help="Progress file for resuming"
+    )
+    rotate_parser.add_argument(
+        "--restart", action="store_true", help="Ignore saved progress"
+    )
+    rotate_parser.set_defaults(func=rotate_keys)
+
+    reconcile_parser = commands.add_parser(
+        "reconcile",
+        help="Record accounts deleted, disabled or moved in AD, "
+        "reading only the changes since the previous run",
+    )
+    reconcile_parser.add_argument(
+        "--full", action="store_true", help="Read every user object"
+    )
+    reconcile_parser.add_argument(
+        "--page-size", type=int, help="Entries per search page, RECONCILE__PAGE_SIZE"
+    )
+    reconcile_parser.set_defaults(func=reconcile)
+
+    migrate_parser = commands.add_parser(
+        "migrate",
+        help="Apply pending database migrations, for deploys with DB__MIGRATE=False",
+    )
+    migrate_parser.set_defaults(func=migrate)
+
+    args = parser.parse_args()
+    setup_logging()
+    init_db()
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
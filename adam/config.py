@@ -1,17 +1,22 @@
 import secrets
 from pydantic import BaseModel, SecretStr
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from typing import Dict, List, Optional
+from typing import Dict, List, Literal, Optional
 
 
 class EncryptionConfig(BaseModel):
+    # Newest key, new passwords are encrypted with it
     secret_key: SecretStr
+    # Previous keys, still accepted for decryption until rotate-keys has run
+    old_keys: List[SecretStr] = []
     user_session_key: SecretStr
 
 
 class RunConfig(BaseModel):
     host: str = "0.0.0.0"
     port: int = 8000
+    # Compiled Jinja templates kept across restarts, disabled if empty
+    template_cache: Optional[str] = "./data/cache/templates"
 
 
 class ApiV1Prefix(BaseModel):
@@ -32,6 +37,42 @@ class SSOConfig(BaseModel):
     allow_insecure_http: bool
 
 
+class LDAPPoolConfig(BaseModel):
+    min_size: int = 1
+    max_size: int = 8
+    idle_timeout: int = 300  # close connections idle for longer, seconds
+    check_interval: int = 30  # probe idle connections before reuse, seconds
+    acquire_timeout: float = 5.0
+    timeout: int = 2  # network and operation timeout, seconds
+
+
+class LDAPFailoverConfig(BaseModel):
+    probe_interval: float = 10.0  # bind latency checks of every DC, seconds
+    # Operations for a user follow the DC that took its last write for this long,
+    # until AD replicated the new password, seconds
+    sticky_ttl: float = 60.0
+    sticky_size: int = 4096
+
+
+class LDAPBreakerConfig(BaseModel):
+    enabled: bool = True
+    # Consecutive connection errors and timeouts of AD that open the circuit
+    failure_threshold: int = 5
+    # Requests fail at once for this long before one is let through, seconds
+    open_seconds: float = 30.0
+
+
+class LDAPAdaptiveTimeoutConfig(BaseModel):
+    # Operation timeout from recent latency instead of pool.timeout alone,
+    # which stays the upper limit
+    enabled: bool = True
+    percentile: float = 0.99
+    multiplier: float = 4.0
+    min: float = 0.5  # seconds
+    window: int = 500  # latest successful operations considered
+    min_samples: int = 50  # pool.timeout is used until this many were seen
+
+
 class LDAPConfig(BaseModel):
     domain: str
     base_dn: str
@@ -42,22 +83,123 @@ class LDAPConfig(BaseModel):
     default_users_dn: str
     host: Optional[str] = None
     realm: Optional[str] = None
-    nested_dn: Optional[str] = None
+    nested_dn: Optional[Dict[str, str]] = None
+    known_dn_ttl: int = 3600  # how long existing OUs are trusted, seconds
+    pool: LDAPPoolConfig = LDAPPoolConfig()
+    # Domain controllers the service connects to, fastest healthy first;
+    # url alone is used if empty. url is also what the accounts show
+    urls: List[str] = []
+    failover: LDAPFailoverConfig = LDAPFailoverConfig()
+    breaker: LDAPBreakerConfig = LDAPBreakerConfig()
+    adaptive_timeout: LDAPAdaptiveTimeoutConfig = LDAPAdaptiveTimeoutConfig()
+
+    @property
+    def dc_urls(self) -> List[str]:
+        return self.urls or [self.url]
+
+
+class SQLiteConfig(BaseModel):
+    # Opt-in profile for several workers sharing one SQLite file
+    tuned: bool = False
+    busy_timeout: int = 5000  # wait for a lock instead of failing, milliseconds
+    mmap_size: int = 268_435_456  # bytes of the file read through mmap
+    cache_size: int = -65_536  # page cache per connection, negative is KiB
+    maintenance_interval: int = 3600  # PRAGMA optimize and vacuum, seconds
+    vacuum_pages: int = 1000  # free pages returned to the OS per run
 
 
 class DatabaseConfig(BaseModel):
     path: str = "./data/db/database.sqlite"
     url: str = f"sqlite:///{path}"
+    # Connection pool of server databases such as PostgreSQL, per worker
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: int = 30
+    pool_recycle: int = 1800  # reconnect connections older than this, seconds
+    pool_pre_ping: bool = True
+    echo: bool = False
+    # Workers apply pending migrations at startup. With gunicorn the master has
+    # done it already; False if a deploy step runs python cli.py migrate instead
+    migrate: bool = True
+    sqlite: SQLiteConfig = SQLiteConfig()
+
+    @property
+    def is_sqlite(self) -> bool:
+        return self.url.startswith("sqlite")
 
 
 class UsersConfig(BaseModel):
     cookie_ttl: int = 10_368_000  # 120 days or ~1/3 year
+    # Users resolved from auth tokens, reused by later requests of the same user
+    identity_cache_size: int = 1024
+    identity_cache_ttl: int = 60  # seconds
+    # Account fragments per user, passwords stay encrypted in them
+    fragment_cache_size: int = 1024
+    fragment_cache_ttl: int = 300  # seconds
 
 
 class LogConfig(BaseModel):
     level: str = "INFO"
     file: Optional[bool] = False
     path: Optional[str] = "./data/logs/app.log"
+    # "text" or "json", one object per line
+    format: Literal["text", "json"] = "text"
+    # Format and write in a background thread instead of the caller
+    queue: bool = True
+    # Share of access log lines kept per path prefix, errors are always logged
+    access_sample: Dict[str, float] = {}
+
+
+class ReadinessConfig(BaseModel):
+    # Seconds between background probes of every worker, /ready serves the latest results
+    ldap_interval: float = 10.0
+    db_interval: float = 5.0
+    migrations_interval: float = 60.0
+    # Seconds a probe may take before it counts as failed
+    timeout: float = 3.0
+    # A result older than this many intervals no longer counts as ready
+    stale_intervals: int = 3
+
+
+class TimingConfig(BaseModel):
+    # Break requests down into phases (auth, db, ldap-*, fernet, render),
+    # written to the access log as the "timing" field of the JSON format
+    enabled: bool = False
+    # Also send the breakdown to clients in the Server-Timing header
+    header: bool = True
+
+
+class ProvisioningConfig(BaseModel):
+    # Concurrent creates or resets for one user run once, across workers
+    # Renewed while the leader runs; a leader that stopped renewing it, e.g.
+    # because its worker died, is replaced after this, seconds
+    lease_ttl: float = 60.0
+    poll_interval: float = 0.2  # how often callers in other workers check the lease
+
+
+class JobsConfig(BaseModel):
+    # POST of an LDAP account answers 202 with a job, created in the background
+    enabled: bool = False
+    workers: int = 2  # jobs run at once per worker process
+    poll_interval: float = 0.5  # progress checks of event streams, seconds
+    # Queue checks for jobs of other workers or interrupted ones, seconds;
+    # jobs queued by the same worker start at once
+    queue_interval: float = 5.0
+    lease_ttl: float = 60.0  # a job not reporting progress for longer is rerun, seconds
+    max_attempts: int = 3
+
+
+class ReconcileConfig(BaseModel):
+    # Entries per SimplePagedResults page of AD searches
+    page_size: int = 500
+    # Runs after the first read only what changed since the previous run on
+    # the same DC; a full sweep repeats when the last one is older, seconds
+    full_interval: int = 604_800
+
+
+class AdminConfig(BaseModel):
+    # Bearer token for admin endpoints such as batch provisioning, disabled if unset
+    token: Optional[SecretStr] = None
 
 
 class Settings(BaseSettings):
@@ -72,6 +214,12 @@ class Settings(BaseSettings):
     run: RunConfig = RunConfig()
     api: ApiPrefix = ApiPrefix()
     users: UsersConfig = UsersConfig()
+    admin: AdminConfig = AdminConfig()
+    provisioning: ProvisioningConfig = ProvisioningConfig()
+    jobs: JobsConfig = JobsConfig()
+    reconcile: ReconcileConfig = ReconcileConfig()
+    timing: TimingConfig = TimingConfig()
+    ready: ReadinessConfig = ReadinessConfig()
     log: LogConfig
     sso: SSOConfig
     ldap: LDAPConfig
@@ -1,8 +1,17 @@
+import asyncio
+import gc
+import os
+import shutil
+
+# Workers write metrics to files here, /metrics sums them up. Set before the
+# application is imported, prometheus_client reads it at import
+metrics_dir = os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/adam-metrics")
+os.makedirs(metrics_dir, exist_ok=True)
 
 bind = "0.0.0.0:8000"
 workers = 4
 worker_class = "uvicorn.workers.UvicornWorker"
-preload = True
+preload_app = True
 
 # Disable Gunicorn logs
 accesslog = None
@@ -15,3 +24,51 @@ disable_redirect_access_to_syslog = True
 # errorlog = "-"         # Output to console
 # loglevel = "debug"
 # disable_redirect_access_to_syslog = False
+
+
+def on_starting(server):
+    # Counters of a previous run would be added to the new ones
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir)
+
+    # Migrate once, before the workers start; their startup then only
+    # compares the revision of the database with the scripts
+    from models.database import engine, init_db
+
+    init_db()
+    # Workers must not share the connections of the master
+    engine.dispose()
+
+
+def when_ready(server):
+    # Gauges set while the app was preloaded belong to no worker
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(os.getpid())
+    # What the preloaded app allocated stays as it is. Frozen objects are left
+    # out of garbage collections, which would otherwise write to their pages
+    # in every worker and end copy-on-write sharing with the master
+    gc.collect()
+    gc.freeze()
+
+
+def post_fork(server, worker):
+    # Pools and clients inherited from the master are replaced before the
+    # worker serves anything
+    from services.lifecycle import resources
+
+    resources.after_fork()
+
+
+def worker_exit(server, worker):
+    # Closed by the lifespan shutdown already, unless the app failed to start
+    from services.lifecycle import resources
+
+    asyncio.run(resources.close())
+
+
+def child_exit(server, worker):
+    # Live gauges such as requests in progress drop the files of the worker
+    from prometheus_client import multiprocess
+
+    multiprocess.mark_process_dead(worker.pid)
@@ -1,3 +1,4 @@
+import asyncio
 import uvicorn
 from fastapi import FastAPI
 from fastapi.staticfiles import StaticFiles
@@ -7,10 +8,18 @@ from services.restrict_access import restrict_access_middleware
 
 import api
 import web
-from models.database import init_db
+from models.database import init_db, run_sqlite_maintenance, sqlite_tuned
+from services.ad_service import ADService
+from services.domain_controllers import domain_controllers
+from services.jobs import job_runner
+from services.lifecycle import resources
+from services.ldap_pool import ldap_pool, run_ldap
+from services.readiness import start_probes
 from config import config
 from services.logging_config import setup_logging, log_requests_middleware, get_logger
-
+from services.metrics import metrics_middleware
+from services.timing import server_timing_middleware
+from web.home import precompile_templates
 
 setup_logging()
 logger = get_logger(__name__)
@@ -19,9 +28,21 @@ logger = get_logger(__name__)
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting application")
-    init_db()
+    init_db(migrate=config.db.migrate)
+    maintenance = (
+        asyncio.create_task(run_sqlite_maintenance()) if sqlite_tuned else None
+    )
+    await run_ldap(ldap_pool.warmup)
+    await run_ldap(ADService().validate_groups)
+    probes = start_probes() + domain_controllers.start()
+    runners = job_runner.start() if config.jobs.enabled else []
     yield
     logger.info("Shutting down application")
+    if maintenance:
+        maintenance.cancel()
+    for task in probes + runners:
+        task.cancel()
+    await resources.close()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -37,10 +58,19 @@ app.add_middleware(
 # Middleware restrict access
 app.middleware("http")(restrict_access_middleware)
 
+# Middleware breaking requests down into phases, around the access check
+if config.timing.enabled:
+    app.middleware("http")(server_timing_middleware)
+
+# Middleware for latency and status metrics, outermost so rejected requests count
+app.middleware("http")(metrics_middleware)
+
 app.include_router(api.api_router)
 app.include_router(api.health_router)
+app.include_router(api.metrics_router)
 app.include_router(web.home_router)
 app.mount("/static", StaticFiles(directory="static"), name="static")
+precompile_templates()
 
 if __name__ == "__main__":
     uvicorn.run(
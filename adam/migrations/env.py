@@ -1,21 +1,25 @@
 from logging.config import fileConfig
 from sqlalchemy import engine_from_config
 from sqlalchemy import pool
+from sqlalchemy import text
 from alembic import context
 
 from models.database import Base
+from models.jobs import ProvisioningJob  # noqa
 from models.ldap_accounts import LDAPAccount  # noqa
+from models.leases import OperationLease  # noqa
+from models.reconciliation import AccountDrift, ReconciliationRun  # noqa
 from models.users import SSOUser  # noqa
 from config import config as conf
 
-
 # this is the Alembic Config object, which provides
 # access to the values within the .ini file in use.
 config = context.config
 # Interpret the config file for Python logging.
 # This line sets up loggers basically.
+# Keep the application loggers enabled, migrations run inside the app
 if config.config_file_name is not None:
-    fileConfig(config.config_file_name)
+    fileConfig(config.config_file_name, disable_existing_loggers=False)
 
 target_metadata = Base.metadata
 config.set_main_option("sqlalchemy.url", conf.db.url)
@@ -62,6 +66,9 @@ def run_migrations_online() -> None:
         context.configure(connection=connection, target_metadata=target_metadata)
 
         with context.begin_transaction():
+            if connection.dialect.name == "postgresql":
+                # Workers starting together must not migrate concurrently
+                connection.execute(text("SELECT pg_advisory_xact_lock(645158)"))
             context.run_migrations()
 
 
@@ -0,0 +1,36 @@
+"""Add row version to ldap accounts
+
+Revision ID: f6ce7802d6eb
+Revises: 645de8d15833
+Create Date: 2026-10-18 03:20:11.668689
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "f6ce7802d6eb"
+down_revision: Union[str, None] = "645de8d15833"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column(
+        "ldap_accounts",
+        sa.Column("version", sa.Integer(), server_default="1", nullable=False),
+    )
+    op.add_column(
+        "ldap_accounts", sa.Column("updated_at", sa.DateTime(), nullable=True)
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.batch_alter_table("ldap_accounts") as batch_op:
+        batch_op.drop_column("updated_at")
+        batch_op.drop_column("version")
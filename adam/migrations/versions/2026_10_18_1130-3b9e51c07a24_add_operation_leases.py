@@ -0,0 +1,35 @@
+"""Add operation leases
+
+Revision ID: 3b9e51c07a24
+Revises: f6ce7802d6eb
+Create Date: 2026-10-18 11:30:42.215307
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "3b9e51c07a24"
+down_revision: Union[str, None] = "f6ce7802d6eb"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "operation_leases",
+        sa.Column("key", sa.String(length=255), nullable=False),
+        sa.Column("owner", sa.String(length=32), nullable=False),
+        sa.Column("expires_at", sa.Float(), nullable=False),
+        sa.Column("outcome", sa.JSON(), nullable=True),
+        sa.PrimaryKeyConstraint("key"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table("operation_leases")
@@ -0,0 +1,63 @@
+"""Add reconciliation
+
+Revision ID: c51e0a9d3f27
+Revises: 8d27c4f0a6b1
+Create Date: 2026-10-18 15:30:41.207316
+
+"""
+
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+# revision identifiers, used by Alembic.
+revision: str = "c51e0a9d3f27"
+down_revision: Union[str, None] = "8d27c4f0a6b1"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table(
+        "reconciliation_runs",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("mode", sa.String(length=16), nullable=False),
+        sa.Column("dc_url", sa.String(length=255), nullable=False),
+        sa.Column("usn", sa.BigInteger(), nullable=False),
+        sa.Column("started_at", sa.DateTime(), nullable=False),
+        sa.Column("finished_at", sa.DateTime(), nullable=True),
+        sa.Column("entries", sa.Integer(), nullable=False),
+        sa.Column("pages", sa.Integer(), nullable=False),
+        sa.Column("found", sa.Integer(), nullable=False),
+        sa.Column("resolved", sa.Integer(), nullable=False),
+        sa.Column("error", sa.Text(), nullable=True),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index("ix_reconciliation_runs_dc_url", "reconciliation_runs", ["dc_url"])
+    op.create_table(
+        "account_drift",
+        sa.Column("id", sa.Integer(), autoincrement=True, nullable=False),
+        sa.Column("kadmin_principal", sa.String(length=255), nullable=False),
+        sa.Column("kind", sa.String(length=16), nullable=False),
+        sa.Column("ad_dn", sa.String(length=1024), nullable=True),
+        sa.Column("run_id", sa.Integer(), nullable=False),
+        sa.Column("detected_at", sa.DateTime(), nullable=False),
+        sa.Column("resolved_at", sa.DateTime(), nullable=True),
+        sa.ForeignKeyConstraint(["run_id"], ["reconciliation_runs.id"]),
+        sa.PrimaryKeyConstraint("id"),
+    )
+    op.create_index(
+        "ix_account_drift_kadmin_principal", "account_drift", ["kadmin_principal"]
+    )
+    op.create_index("ix_account_drift_resolved_at", "account_drift", ["resolved_at"])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index("ix_account_drift_resolved_at", table_name="account_drift")
+    op.drop_index("ix_account_drift_kadmin_principal", table_name="account_drift")
+    op.drop_table("account_drift")
+    op.drop_index("ix_reconciliation_runs_dc_url", table_name="reconciliation_runs")
+    op.drop_table("reconciliation_runs")
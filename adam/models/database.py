@@ -1,35 +1,213 @@
+import asyncio
+import functools
+import glob
 import os
-from sqlalchemy import create_engine
+import re
+from typing import Optional
+from sqlalchemy import create_engine, event, inspect, make_url, text
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from alembic.config import Config
-from alembic.command import upgrade
 
 from config import config
+from services.lifecycle import resources
 from services.logging_config import get_logger
+from services.metrics import instrument_engine
 
 logger = get_logger(__name__)
 
+# Revision that matches the schema created before migrations were introduced
+INITIAL_REVISION = "645de8d15833"
+ALEMBIC_CONFIG = "alembic.ini"
+MIGRATIONS_DIR = "migrations/versions"
+_REVISION_LINE = re.compile(
+    r"^(revision|down_revision)\b[^=]*=\s*['\"](\w+)['\"]", re.MULTILINE
+)
+
+
+def _engine_options() -> dict:
+    """Engine options for the configured backend"""
+    if config.db.is_sqlite:
+        return {"connect_args": {"check_same_thread": False}, "echo": config.db.echo}
+    return {
+        "pool_size": config.db.pool_size,
+        "max_overflow": config.db.max_overflow,
+        "pool_timeout": config.db.pool_timeout,
+        "pool_recycle": config.db.pool_recycle,
+        "pool_pre_ping": config.db.pool_pre_ping,
+        "echo": config.db.echo,
+    }
+
+
+def _async_url(url: str) -> str:
+    """Database URL with a driver usable by the async engine"""
+    url = make_url(url)
+    if url.get_backend_name() == "sqlite":
+        return url.set(drivername="sqlite+aiosqlite").render_as_string(False)
+    # psycopg 3 serves both engines, asyncpg could be set explicitly
+    if url.drivername == "postgresql":
+        return url.set(drivername="postgresql+psycopg").render_as_string(False)
+    return url.render_as_string(False)
+
+
 # SQLAlchemy settings
-engine = create_engine(config.db.url, connect_args={"check_same_thread": False})
+# The synchronous engine is used by Alembic, batch provisioning and the CLI
+engine = create_engine(config.db.url, **_engine_options())
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Request handlers use the async engine, so queries do not block the event loop
+async_engine = create_async_engine(_async_url(config.db.url), **_engine_options())
+AsyncSessionLocal = async_sessionmaker(
+    async_engine, autoflush=False, expire_on_commit=False
+)
 Base = declarative_base()
+instrument_engine(engine, "sync")
+instrument_engine(async_engine.sync_engine, "async")
+
+
+def _forget_inherited_connections():
+    """
+    New pools for a forked worker. The pooled connections are the parent's
+    sockets and files, so they are dropped without being closed
+    """
+    engine.dispose(close=False)
+    async_engine.sync_engine.dispose(close=False)
+
+
+async def _close_engines():
+    await async_engine.dispose()
+    engine.dispose()
+
+
+resources.register(
+    "database", after_fork=_forget_inherited_connections, close=_close_engines
+)
+
+
+def _tune_sqlite_connection(dbapi_connection, connection_record):
+    """Applies the SQLite tuning profile to every new connection"""
+    settings = config.db.sqlite
+    cursor = dbapi_connection.cursor()
+    # Only takes effect before the first table is created, see enable_incremental_vacuum
+    cursor.execute("PRAGMA auto_vacuum=INCREMENTAL")
+    # Readers no longer wait for writers, and commits skip the fsync of the database file
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute(f"PRAGMA busy_timeout={settings.busy_timeout}")
+    cursor.execute(f"PRAGMA mmap_size={settings.mmap_size}")
+    cursor.execute(f"PRAGMA cache_size={settings.cache_size}")
+    cursor.close()
+
+
+sqlite_tuned = config.db.is_sqlite and config.db.sqlite.tuned
+if sqlite_tuned:
+    event.listen(engine, "connect", _tune_sqlite_connection)
+    event.listen(async_engine.sync_engine, "connect", _tune_sqlite_connection)
+
+
+def enable_incremental_vacuum():
+    """Rebuilds a database created without auto_vacuum, once"""
+    with engine.connect() as connection:
+        if connection.exec_driver_sql("PRAGMA auto_vacuum").scalar() == 2:
+            return
+        logger.info("Enabling incremental vacuum, rebuilding the SQLite database")
+        connection.connection.dbapi_connection.executescript(
+            "PRAGMA auto_vacuum=INCREMENTAL; VACUUM;"
+        )
 
 
-def init_db():
-    """Initialization of the database with application of migrations if necessary"""
-    alembic_cfg_path = "alembic.ini"
+def sqlite_maintenance():
+    """Refreshes query planner statistics and returns free pages to the OS"""
+    with engine.connect() as connection:
+        # executescript steps the statements to completion, execute would
+        # free a single page of incremental_vacuum
+        connection.connection.dbapi_connection.executescript(
+            f"PRAGMA optimize; PRAGMA incremental_vacuum({config.db.sqlite.vacuum_pages});"
+        )
 
-    # Check the existence of the database file
-    if not os.path.exists(config.db.path):
-        # Alembic Migrations
+
+async def run_sqlite_maintenance():
+    """Runs sqlite_maintenance every maintenance_interval seconds"""
+    while True:
+        await asyncio.sleep(config.db.sqlite.maintenance_interval)
         try:
-            alembic_cfg = Config(alembic_cfg_path)
-            alembic_cfg.set_main_option("sqlalchemy.url", config.db.url)
-            upgrade(alembic_cfg, "head")
-            logger.info("Alembic migrations applied successfully")
+            await asyncio.to_thread(sqlite_maintenance)
+            logger.debug("SQLite maintenance completed")
         except Exception as e:
-            logger.error(f"Failed to apply Alembic migrations: {e}")
-            raise
+            logger.error("SQLite maintenance failed: %s", e)
+
+
+@functools.cache
+def head_revision() -> str:
+    """
+    Newest revision of the migration scripts. Read from the files without
+    importing Alembic, which takes longer than the rest of a worker's start;
+    Alembic decides only if the history has branches
+    """
+    revisions, parents = set(), set()
+    for path in glob.glob(os.path.join(MIGRATIONS_DIR, "*.py")):
+        with open(path) as f:
+            for name, value in _REVISION_LINE.findall(f.read()):
+                (revisions if name == "revision" else parents).add(value)
+    heads = revisions - parents
+    if len(heads) == 1:
+        return heads.pop()
+    from alembic.config import Config
+    from alembic.script import ScriptDirectory
+
+    return ScriptDirectory.from_config(Config(ALEMBIC_CONFIG)).get_current_head()
+
+
+def database_revision() -> Optional[str]:
+    """Revision the database was migrated to, None before the first migration"""
+    with engine.connect() as connection:
+        if not inspect(connection).has_table("alembic_version"):
+            return None
+        return connection.scalar(text("SELECT version_num FROM alembic_version"))
+
+
+def migrate_db():
+    """Applies pending Alembic migrations"""
+    from alembic.command import stamp, upgrade
+    from alembic.config import Config
+
+    try:
+        alembic_cfg = Config(ALEMBIC_CONFIG)
+        alembic_cfg.set_main_option("sqlalchemy.url", config.db.url)
+        tables = inspect(engine).get_table_names()
+        if "users" in tables and "alembic_version" not in tables:
+            # Database created before migrations were used
+            stamp(alembic_cfg, INITIAL_REVISION)
+        upgrade(alembic_cfg, "head")
+        logger.info("Alembic migrations applied successfully")
+    except Exception as e:
+        logger.error("Failed to apply Alembic migrations: %s", e)
+        raise
+
+
+def init_db(migrate: bool = True):
+    """
+    Initialization of the database. Migrations run only if the database is
+    behind the scripts, so workers starting after the gunicorn master or
+    python cli.py migrate did it skip Alembic entirely
+    """
+    if config.db.is_sqlite:
+        os.makedirs(os.path.dirname(os.path.abspath(config.db.path)), exist_ok=True)
+
+    revision = database_revision()
+    if revision == head_revision():
+        logger.info("Database is at revision %s, no migrations to apply", revision)
+    elif migrate:
+        migrate_db()
+    else:
+        logger.warning(
+            "Database is at revision %s, expected %s; "
+            "apply migrations with python cli.py migrate",
+            revision,
+            head_revision(),
+        )
+
+    if sqlite_tuned:
+        enable_incremental_vacuum()
+        sqlite_maintenance()
 
 
 def get_db():
@@ -38,3 +216,8 @@ def get_db():
         yield db
     finally:
         db.close()
+
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,49 @@
+from sqlalchemy import Column, String, ForeignKey, DateTime, Integer, Float, Text
+from datetime import datetime
+from uuid import uuid4
+
+from models.database import Base
+
+# Steps of account creation in order, with the percent done when each starts
+JOB_STEPS = {
+    "queued": 0,
+    "connect": 10,
+    "ous": 25,
+    "user": 45,
+    "groups": 65,
+    "record": 85,
+    "done": 100,
+}
+FINISHED_STATUSES = ("succeeded", "failed")
+
+
+class ProvisioningJob(Base):
+    """Provisioning operation run in the background, polled by the client"""
+
+    __tablename__ = "jobs"
+
+    id = Column(String(36), primary_key=True, default=lambda: str(uuid4()))
+    operation = Column(String(32), nullable=False)
+    sso_user_id = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
+    # queued, running, succeeded or failed
+    status = Column(String(16), default="queued", nullable=False, index=True)
+    # Step being run, one of JOB_STEPS
+    step = Column(String(16), default="queued", nullable=False)
+    # Outcome of a finished job, as the synchronous endpoint would answer
+    status_code = Column(Integer, nullable=True)
+    message = Column(Text, nullable=True)
+    attempts = Column(Integer, default=0, nullable=False)
+    # Runner holding a running job; a job whose lease expired, e.g. because
+    # its worker was restarted, is run again
+    owner = Column(String(32), nullable=True)
+    lease_expires_at = Column(Float, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, nullable=False)
+    updated_at = Column(DateTime, default=datetime.now, onupdate=datetime.now)
+
+    @property
+    def progress(self) -> int:
+        return JOB_STEPS.get(self.step, 0)
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATUSES
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, LargeBinary, ForeignKey, DateTime
+from sqlalchemy import Column, String, LargeBinary, ForeignKey, DateTime, Integer
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -18,6 +18,9 @@ class LDAPAccount(Base):
     container_dn = Column(String(255), nullable=True)
 
     created_at = Column(DateTime, default=datetime.now, nullable=False)
+    # Bumped on every change of the shown data, part of the HTTP validators
+    version = Column(Integer, default=1, server_default="1", nullable=False)
+    updated_at = Column(DateTime, onupdate=datetime.now, nullable=True)
     sso_user_id = Column(String(36), ForeignKey("users.id"), nullable=False)
     sso_user = relationship("SSOUser", back_populates="ldap_accounts")
 
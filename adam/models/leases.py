@@ -0,0 +1,18 @@
+from sqlalchemy import Column, String, Float, JSON
+
+from models.database import Base
+
+
+class OperationLease(Base):
+    """Claim of a running provisioning operation, shared by all workers"""
+
+    __tablename__ = "operation_leases"
+
+    # Operation and user, e.g. "create:<user_id>"
+    key = Column(String(255), primary_key=True)
+    owner = Column(String(32), nullable=False)
+    # Unix time, a lease not released by then may be taken over
+    expires_at = Column(Float, nullable=False)
+    # Status code and message of the finished operation for the callers that
+    # waited on it, None while it runs
+    outcome = Column(JSON, nullable=True)
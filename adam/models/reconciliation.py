@@ -0,0 +1,52 @@
+from sqlalchemy import BigInteger, Column, DateTime, ForeignKey, Integer, String, Text
+from datetime import datetime
+
+from models.database import Base
+
+# Kinds of difference between an account record and AD
+DRIFT_KINDS = {
+    "missing": "Not found in the users DN by a full sweep",
+    "deleted": "Deleted in AD",
+    "moved": "Moved or renamed out of the users DN",
+    "disabled": "Disabled in AD",
+}
+
+
+class ReconciliationRun(Base):
+    """A comparison of the account records with AD, full or incremental"""
+
+    __tablename__ = "reconciliation_runs"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    # full or incremental
+    mode = Column(String(16), nullable=False)
+    # USNs are local to a DC, every DC has its own watermark
+    dc_url = Column(String(255), nullable=False, index=True)
+    # highestCommittedUSN of the DC when the run started; the next incremental
+    # run on the DC reads the changes above it
+    usn = Column(BigInteger, nullable=False)
+    started_at = Column(DateTime, default=datetime.now, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+    # AD entries read, search pages, drift found and drift resolved
+    entries = Column(Integer, default=0, nullable=False)
+    pages = Column(Integer, default=0, nullable=False)
+    found = Column(Integer, default=0, nullable=False)
+    resolved = Column(Integer, default=0, nullable=False)
+    # Set if the run failed, its watermark is not used then
+    error = Column(Text, nullable=True)
+
+
+class AccountDrift(Base):
+    """Difference between an account record and AD, open until they match again"""
+
+    __tablename__ = "account_drift"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    kadmin_principal = Column(String(255), nullable=False, index=True)
+    # One of DRIFT_KINDS
+    kind = Column(String(16), nullable=False)
+    # Where AD has the account, if it still has it
+    ad_dn = Column(String(1024), nullable=True)
+    run_id = Column(Integer, ForeignKey("reconciliation_runs.id"), nullable=False)
+    detected_at = Column(DateTime, default=datetime.now, nullable=False)
+    resolved_at = Column(DateTime, nullable=True, index=True)
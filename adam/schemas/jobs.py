@@ -0,0 +1,26 @@
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel
+
+
+class JobResponse(BaseModel):
+    id: str
+    operation: str
+    # queued, running, succeeded or failed
+    status: str
+    step: str
+    # Percent of the steps done
+    progress: int
+    # Status code and message the synchronous request would have answered
+    status_code: Optional[int] = None
+    message: Optional[str] = None
+    attempts: int
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+
+
+class JobQueuedResponse(JobResponse):
+    status_url: str
+    # Server-sent events with the job on every change
+    events_url: str
@@ -1,4 +1,7 @@
-from pydantic import BaseModel, EmailStr
+from datetime import datetime
+from typing import Optional
+
+from pydantic import BaseModel, EmailStr, Field
 
 
 class LDAPUserAttributes(BaseModel):
@@ -12,3 +15,45 @@ class LDAPUserAttributes(BaseModel):
 
     class Config:
         str_strip_whitespace = True
+
+
+class LDAPBatchRequest(BaseModel):
+    # SSO user ids or emails
+    users: list[str] = Field(min_length=1)
+
+
+class LDAPAccountResponse(BaseModel):
+    kdc_hosts: Optional[str] = None
+    realm: Optional[str] = None
+    kadmin_server: Optional[str] = None
+    kadmin_principal: str
+    kadmin_password: str
+    admin_dn: Optional[str] = None
+    ldap_url: Optional[str] = None
+    container_dn: Optional[str] = None
+    created_at: datetime
+    version: int
+    updated_at: Optional[datetime] = None
+    sso_user_id: str
+
+
+class LDAPAccountDisplay(BaseModel):
+    # Keys are the display names shown in the web interface
+    kdc_hosts: Optional[str] = Field(None, alias="KDC hosts")
+    realm: Optional[str] = Field(None, alias="Realm")
+    kadmin_server: Optional[str] = Field(None, alias="Kadmin server")
+    kadmin_principal: str = Field(alias="Kadmin principal")
+    kadmin_password: str = Field(alias="Kadmin password")
+    admin_dn: Optional[str] = Field(None, alias="Admin DN")
+    ldap_url: Optional[str] = Field(None, alias="LDAP URL")
+    container_dn: Optional[str] = Field(None, alias="Container DN")
+
+
+class LDAPAccountCreateResponse(BaseModel):
+    message: str
+    account: LDAPAccountDisplay
+
+
+class PasswordResetResponse(BaseModel):
+    message: str
+    kadmin_password: str
@@ -0,0 +1,36 @@
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from pydantic import BaseModel
+
+
+class ReconciliationRunResponse(BaseModel):
+    id: int
+    # full or incremental
+    mode: str
+    dc_url: str
+    usn: int
+    started_at: datetime
+    finished_at: Optional[datetime] = None
+    entries: int
+    pages: int
+    found: int
+    resolved: int
+    error: Optional[str] = None
+
+
+class AccountDriftResponse(BaseModel):
+    kadmin_principal: str
+    # missing, deleted, moved or disabled
+    kind: str
+    ad_dn: Optional[str] = None
+    run_id: int
+    detected_at: datetime
+
+
+class DriftReportResponse(BaseModel):
+    # Open drift per kind
+    counts: Dict[str, int]
+    drift: List[AccountDriftResponse]
+    # Latest run of every DC
+    runs: List[ReconciliationRunResponse]
@@ -0,0 +1,116 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from pathlib import Path
+from typing import Any, Iterable, List, Optional
+
+from fastapi import Request, Response
+from markupsafe import Markup, escape
+
+from config import config
+from services.cache import TTLCache
+from services.encryption import encryptor
+
+# Account fragments by (kind, user id), stored with the ETag they were built
+# for. Passwords in them stay encrypted and are decrypted for each response.
+# Other workers do not see the invalidation, the ETag check against the
+# database keeps them from serving stale entries.
+fragment_cache = TTLCache(
+    maxsize=config.users.fragment_cache_size, ttl=config.users.fragment_cache_ttl
+)
+
+# Rendered in place of each password of the accounts fragment
+PASSWORD_SLOT = Markup("<!--kadmin_password-->")
+
+
+def _templates_version() -> str:
+    """Changes when a deployment changes the templates, so do the ETags"""
+    digest = hashlib.sha256()
+    for path in sorted(Path("templates").glob("*.html")):
+        digest.update(path.read_bytes())
+    return digest.hexdigest()[:12]
+
+
+TEMPLATES_VERSION = _templates_version()
+
+
+class AccountsVersion:
+    """HTTP validators of a user's accounts, built from row versions without decrypting"""
+
+    def __init__(self, rows: Iterable[Any], *parts: str):
+        digest = hashlib.sha256("\0".join(parts).encode())
+        self.last_modified: Optional[datetime] = None
+        for principal, version, created_at, updated_at in rows:
+            digest.update(f"\0{principal}:{version}:{created_at}:{updated_at}".encode())
+            changed_at = (updated_at or created_at).astimezone(timezone.utc)
+            if self.last_modified is None or changed_at > self.last_modified:
+                self.last_modified = changed_at
+        self.etag = f'W/"{digest.hexdigest()[:32]}"'
+
+    def headers(self) -> dict:
+        # Browsers revalidate every time, shared caches never store the passwords
+        headers = {"ETag": self.etag, "Cache-Control": "private, no-cache"}
+        if self.last_modified is not None:
+            headers["Last-Modified"] = format_datetime(self.last_modified, usegmt=True)
+        return headers
+
+    def matches(self, request: Request) -> bool:
+        """Whether the client already has this version"""
+        if_none_match = request.headers.get("if-none-match")
+        if if_none_match is not None:
+            tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+            return "*" in tags or self.etag.removeprefix("W/") in tags
+
+        if_modified_since = request.headers.get("if-modified-since")
+        if if_modified_since and self.last_modified is not None:
+            try:
+                since = parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+            return self.last_modified.replace(microsecond=0) <= since
+        return False
+
+    def not_modified(self) -> Response:
+        return Response(status_code=304, headers=self.headers())
+
+
+class AccountsHTML:
+    """Rendered accounts fragment, its passwords filled in when it is shown"""
+
+    def __init__(self, html: str, passwords: List[Optional[bytes]]):
+        self._parts = html.split(PASSWORD_SLOT)
+        # Encrypted, in the order of their slots
+        self._passwords = passwords
+
+    def fill(self) -> Markup:
+        parts = [self._parts[0]]
+        for password, part in zip(self._passwords, self._parts[1:]):
+            parts.append(escape(encryptor.reveal_password(password)))
+            parts.append(part)
+        return Markup("".join(parts))
+
+
+def reveal_passwords(rows: List[dict]) -> List[dict]:
+    """Account rows of a response, with their passwords decrypted"""
+    return [
+        {**row, "kadmin_password": encryptor.reveal_password(row["kadmin_password"])}
+        for row in rows
+    ]
+
+
+def get_fragment(kind: str, user_id: str, version: AccountsVersion) -> Optional[Any]:
+    """Cached fragment of the user if it was built for this version"""
+    entry = fragment_cache.get((kind, user_id))
+    if entry is not None and entry[0] == version.etag:
+        return entry[1]
+    return None
+
+
+def set_fragment(kind: str, user_id: str, version: AccountsVersion, value: Any) -> None:
+    fragment_cache.set((kind, user_id), (version.etag, value))
+
+
+def invalidate_accounts(user_id: str) -> None:
+    """Drops the cached fragments of the user after its accounts change"""
+    for kind in ("html", "json"):
+        fragment_cache.pop((kind, user_id))
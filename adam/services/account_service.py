@@ -0,0 +1,81 @@
+from typing import Callable, Optional
+
+from fastapi import HTTPException
+
+from config import config
+from models.database import AsyncSessionLocal
+from models.ldap_accounts import LDAPAccount
+from schemas.ldap import LDAPUserAttributes
+from services.account_cache import invalidate_accounts
+from services.ad_service import ADService, no_progress
+from services.db_service import AsyncDBService
+from services.ldap_pool import run_ldap
+from services.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Outcomes of account creation, also stored for callers waiting on a batch
+CREATED = "AD account successfully created"
+RESET = "AD account already exist, password reset"
+EXISTS = "An account already exists in the database"
+
+
+async def get_account(
+    db_service: AsyncDBService, user_id: str, username: str
+) -> Optional[LDAPAccount]:
+    """The user's account record with the given principal"""
+    for account in await db_service.get_ldap_accounts_by_user_id(user_id):
+        if account.kadmin_principal == username:
+            return account
+    return None
+
+
+async def create_account(
+    user_id: str,
+    username: str,
+    attributes: LDAPUserAttributes,
+    progress: Callable[[str], None] = no_progress,
+) -> str:
+    """
+    Creates the AD account and its record, returns the success message.
+    Uses a session of its own, so it may outlive the request that started it.
+    """
+    ad_service = ADService()
+    async with AsyncSessionLocal() as db:
+        db_service = AsyncDBService(db)
+        if await get_account(db_service, user_id, username):
+            raise HTTPException(
+                status_code=409,
+                detail=EXISTS,
+            )
+        encrypted_password, was_existing = await run_ldap(
+            ad_service.create_account, username, attributes, progress
+        )
+        progress("record")
+        ad_account = await db_service.create_ldap_account_record(
+            user_id, username, encrypted_password
+        )
+    invalidate_accounts(user_id)
+    logger.info("Account processed for %s: %s", username, vars(ad_account))
+    return RESET if was_existing else CREATED
+
+
+async def reset_password(user_id: str, ldap_username: str) -> str:
+    """Resets the AD password and stores it, returns the success message"""
+    ad_service = ADService()
+    async with AsyncSessionLocal() as db:
+        account = await get_account(AsyncDBService(db), user_id, ldap_username)
+        if not account:
+            raise HTTPException(
+                status_code=404,
+                detail=f"No record found in the database for '{ldap_username}'",
+            )
+        user_dn = f"CN={ldap_username},{config.ldap.default_users_dn}"
+        new_password = await run_ldap(
+            ad_service.reset_account_password, ldap_username, user_dn
+        )
+        account.kadmin_password = ad_service.encryptor.encrypt_password(new_password)
+        account.version += 1
+        await db.commit()
+    invalidate_accounts(user_id)
+    return f"Password successfully reset for '{ldap_username}'"
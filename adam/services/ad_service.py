@@ -1,168 +1,448 @@
-from typing import Tuple
+import time
+from typing import Any, Callable, Iterator, List, Optional, Tuple
 from fastapi import HTTPException
-from sqlalchemy.orm import Session
 import ldap
 from ldap import modlist
+from ldap.controls import LDAPControl, SimplePagedResultsControl
 
 from config import config
-from services.encryption import PasswordEncryptor
+from services.encryption import encryptor
 from services.utils import generate_password
-from services.db_service import DBService
-from models.ldap_accounts import LDAPAccount
 from schemas.ldap import LDAPUserAttributes
 from services.logging_config import get_logger
+from services.circuit_breaker import ldap_breaker, ldap_timeout
+from services.domain_controllers import FAILOVER_ERRORS, domain_controllers
+from services.ldap_pool import (
+    CONNECTION_ERRORS,
+    LDAPConnectionPool,
+    PoolTimeout,
+    ldap_pool,
+)
+from services.ldap_pipeline import LDAPOperation, LDAPPipeline
+from services.metrics import timed_ldap
+from services.timing import phase
+from services.provisioning import known_dns, provisioning_plan
 
 logger = get_logger(__name__)
 
+# Makes AD return deleted objects (tombstones) too, with isDeleted set
+SHOW_DELETED_OID = "1.2.840.113556.1.4.417"
+
+
+def no_progress(step: str) -> None:
+    pass
+
 
 class ADService:
-    def __init__(self):
+    def __init__(self, pool: LDAPConnectionPool = ldap_pool):
+        self.pool = pool
         self.connection = None
-        self.encryptor = PasswordEncryptor()
+        self.encryptor = encryptor
 
-    def connect(self, timeout: int = 2) -> None:
-        """Connect to Active Directory"""
+    def connect(
+        self, username: Optional[str] = None, prefer: Optional[str] = None
+    ) -> None:
+        """
+        Borrow an admin-bound connection to Active Directory from the pool,
+        on the prefer DC or the one that took the user's last write if it is
+        recent. Fails at once with 503 while the circuit breaker is open
+        """
+        ldap_breaker.before_call()
+        if prefer is None and username:
+            prefer = domain_controllers.sticky_url(username)
         try:
-            ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_ALLOW)
-            ldap.set_option(ldap.OPT_NETWORK_TIMEOUT, timeout)
-            ldap.set_option(ldap.OPT_TIMEOUT, timeout)
-
-            self.connection = ldap.initialize(config.ldap.url)
-            self.connection.simple_bind_s(
-                config.ldap.admin_dn, config.ldap.admin_pass.get_secret_value()
-            )
+            self.connection = self.pool.acquire(prefer)
         except ldap.LDAPError as e:
+            # Waiting for a busy pool is not a failure of AD
+            if isinstance(e, FAILOVER_ERRORS) and not isinstance(e, PoolTimeout):
+                ldap_breaker.record_failure()
             raise HTTPException(
                 status_code=500, detail=f"AD connection error: {str(e)}"
             )
 
-    def disconnect(self) -> None:
-        """Disconnect from Active Directory"""
+    def disconnect(self, discard: bool = False) -> None:
+        """Return the connection to the pool"""
         if self.connection:
-            self.connection.unbind_s()
+            self.pool.release(self.connection, discard=discard)
             self.connection = None
 
+    def _stick(self, username: str) -> None:
+        """Keeps the user's next operations on the DC that took this write"""
+        url = self.pool.url_of(self.connection)
+        if url:
+            domain_controllers.stick(username, url)
+
+    def _call(self, func: Callable[[Any], Any]) -> Any:
+        """Run func within the timeout derived from recent latency"""
+        self.connection.set_option(ldap.OPT_TIMEOUT, ldap_timeout.current())
+        started = time.perf_counter()
+        result = func(self.connection)
+        ldap_timeout.observe(time.perf_counter() - started)
+        return result
+
+    def _failover(self, name: str, func: Callable[[Any], Any]) -> Any:
+        """Run LDAP work on the connection, failing over to another DC once"""
+        try:
+            return self._call(func)
+        except ldap.TIMEOUT as e:
+            # The operation may still complete on the slow DC, and a pipeline
+            # may have been partly applied before the error. Repeating it is
+            # safe only for work that tolerates it: OU adds ignore
+            # ALREADY_EXISTS, a user add ending in it takes the existing-user
+            # path, group adds ignore TYPE_OR_VALUE_EXISTS and password
+            # modifies replace the value again
+            url = self.pool.url_of(self.connection)
+            self.disconnect(discard=True)
+            if not domain_controllers.mark_down(url, e):
+                raise
+            logger.warning("LDAP %s timed out on %s, failing over", name, url)
+        except CONNECTION_ERRORS as e:
+            url = self.pool.url_of(self.connection)
+            logger.warning("LDAP connection lost during %s, rebind: %s", name, e)
+            self.disconnect(discard=True)
+            domain_controllers.mark_down(url, e)
+        self.connect()
+        return self._call(func)
+
+    def _run(self, name: str, func: Callable[[Any], Any]) -> Any:
+        """Run LDAP work, reporting to the circuit breaker whether AD answered"""
+        if self.connection is None:
+            self.connect()
+        try:
+            result = self._failover(name, func)
+        except FAILOVER_ERRORS:
+            ldap_breaker.record_failure()
+            raise
+        except ldap.LDAPError:
+            ldap_breaker.record_success()
+            raise
+        ldap_breaker.record_success()
+        return result
+
+    def _execute(self, operation: str, *args):
+        """Run a synchronous LDAP operation"""
+        return self._run(
+            operation,
+            lambda connection: timed_ldap(
+                operation.removesuffix("_s"), getattr(connection, operation), *args
+            ),
+        )
+
+    def _execute_pipeline(self, pipeline: LDAPPipeline) -> List[LDAPOperation]:
+        """Run queued operations in one round trip"""
+        with phase("ldap-pipeline"):
+            return self._run("pipeline", pipeline.execute)
+
+    @staticmethod
+    def _ou_modlist(ou_name: str) -> list:
+        return modlist.addModlist(
+            {
+                "objectClass": [b"top", b"organizationalUnit"],
+                "ou": ou_name.encode("utf-8"),
+            }
+        )
+
+    @staticmethod
+    def _password_modlist(password: str) -> list:
+        unicode_pwd = f'"{password}"'.encode("utf-16-le")
+        return [(ldap.MOD_REPLACE, "unicodePwd", unicode_pwd)]
+
     def create_ou(self, ou_name: str, base_dn: str) -> None:
         """Create Organizational Unit in Active Directory"""
         ou_dn = f"OU={ou_name},{base_dn}"
         try:
-            ldif = modlist.addModlist(
-                {
-                    "objectClass": [b"top", b"organizationalUnit"],
-                    "ou": ou_name.encode("utf-8"),
-                }
-            )
-            self.connection.add_s(ou_dn, ldif)
-            logger.debug(f"OU has been successfully created: {ou_dn}")
+            self._execute("add_s", ou_dn, self._ou_modlist(ou_name))
+            logger.debug("OU has been successfully created: %s", ou_dn)
         except ldap.ALREADY_EXISTS:
-            logger.debug(f"OU already exists: {ou_dn}")
+            logger.debug("OU already exists: %s", ou_dn)
             pass
         except ldap.LDAPError as e:
             raise HTTPException(
                 status_code=500, detail=f"Error while creating OU '{ou_dn}': {str(e)}"
             )
 
-    def add_to_groups(self, user_dn: str, group_dns: list[str], username: str) -> None:
-        """Add user to groups"""
-        for group_dn in group_dns:
+    def create_ous(self, ous: List[Tuple[str, str]]) -> None:
+        """Create Organizational Units, given parents first, in one round trip"""
+        pipeline = LDAPPipeline()
+        for ou_name, base_dn in ous:
+            pipeline.add(
+                f"OU={ou_name},{base_dn}",
+                self._ou_modlist(ou_name),
+                ignore=(ldap.ALREADY_EXISTS,),
+            )
+        for (ou_name, base_dn), operation in zip(ous, self._execute_pipeline(pipeline)):
+            if isinstance(operation.error, ldap.NO_SUCH_OBJECT):
+                # The server may process a child before its parent, repeat in order
+                self.create_ou(ou_name, base_dn)
+            elif operation.failed:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error while creating OU '{operation.dn}': "
+                    f"{str(operation.error)}",
+                )
+
+    def ensure_parent_ous(self) -> None:
+        """Create the OU chain of default_users_dn, skipping OUs known to exist"""
+        missing = [
+            ou
+            for ou, ou_dn in zip(provisioning_plan.ou_chain, provisioning_plan.ou_dns())
+            if ou_dn not in known_dns
+        ]
+        if missing:
+            self.create_ous(missing)
+        for ou_dn in provisioning_plan.ou_dns():
+            known_dns.set(ou_dn, True)
+
+    def read_root_dse(self) -> None:
+        """Read the rootDSE, the cheapest request the directory answers"""
+        self.connect()
+        try:
+            self._execute("search_s", "", ldap.SCOPE_BASE, "(objectClass=*)", ["1.1"])
+        finally:
+            self.disconnect()
+
+    @property
+    def url(self) -> Optional[str]:
+        """DC of the borrowed connection"""
+        return self.pool.url_of(self.connection) if self.connection else None
+
+    def highest_usn(self) -> int:
+        """highestCommittedUSN of the connected DC, every change raises it"""
+        result = self._execute(
+            "search_s", "", ldap.SCOPE_BASE, "(objectClass=*)", ["highestCommittedUSN"]
+        )
+        return int(result[0][1]["highestCommittedUSN"][0])
+
+    def paged_search(
+        self,
+        base_dn: str,
+        filterstr: str,
+        attrlist: List[str],
+        page_size: int,
+        show_deleted: bool = False,
+    ) -> Iterator[list]:
+        """
+        Subtree search returning page_size entries per round trip with the
+        SimplePagedResults control, so the directory never has to send or
+        the service hold the whole result at once. Yields the pages
+        """
+        paging = SimplePagedResultsControl(True, size=page_size, cookie="")
+        controls = [paging]
+        if show_deleted:
+            controls.append(LDAPControl(SHOW_DELETED_OID, True))
+
+        def page(connection) -> Tuple[list, bytes]:
+            msgid = connection.search_ext(
+                base_dn, ldap.SCOPE_SUBTREE, filterstr, attrlist, serverctrls=controls
+            )
+            _, entries, _, response = connection.result3(
+                msgid, timeout=ldap_timeout.current()
+            )
+            cookie = next(
+                (
+                    control.cookie
+                    for control in response
+                    if control.controlType == SimplePagedResultsControl.controlType
+                ),
+                b"",
+            )
+            # Referrals come back without a DN
+            return [entry for entry in entries if entry[0]], cookie
+
+        while True:
+            entries, cookie = self._run(
+                "search", lambda connection: timed_ldap("search", page, connection)
+            )
+            yield entries
+            if not cookie:
+                return
+            paging.cookie = cookie
+
+    def validate_groups(self) -> None:
+        """Resolve member_of_groups in AD once, dropping groups that do not exist"""
+        try:
+            self.connect()
+            self._resolve_groups()
+        except HTTPException as e:
+            logger.warning("Groups are not validated: %s", e.detail)
+        except ldap.LDAPError as e:
+            logger.warning("Groups are not validated: %s", e)
+        finally:
+            self.disconnect()
+
+    def _resolve_groups(self) -> None:
+        """validate_groups on the borrowed connection"""
+        resolved = []
+        for group_dn in provisioning_plan.group_dns:
             try:
-                mod_attrs = [(ldap.MOD_ADD, "member", user_dn.encode("utf-8"))]
-                self.connection.modify_s(group_dn, mod_attrs)
+                result = self._execute(
+                    "search_s", group_dn, ldap.SCOPE_BASE, "(objectClass=*)", ["1.1"]
+                )
+                resolved.append(result[0][0] if result else group_dn)
             except ldap.NO_SUCH_OBJECT:
+                logger.warning("Group '%s' was not found in AD, skip it", group_dn)
+        provisioning_plan.group_dns = resolved
+        provisioning_plan.groups_validated = True
+
+    def _queue_group_adds(
+        self, pipeline: LDAPPipeline, user_dn: str, group_dns: list[str]
+    ) -> List[LDAPOperation]:
+        mod_attrs = [(ldap.MOD_ADD, "member", user_dn.encode("utf-8"))]
+        # Already a member, e.g. an existing user or a retried pipeline
+        return [
+            pipeline.modify(group_dn, mod_attrs, ignore=(ldap.TYPE_OR_VALUE_EXISTS,))
+            for group_dn in group_dns
+        ]
+
+    @staticmethod
+    def _log_group_errors(operations: List[LDAPOperation], username: str) -> None:
+        for operation in operations:
+            if isinstance(operation.error, ldap.NO_SUCH_OBJECT):
                 logger.warning(
-                    f"Group '{group_dn}' was not found for '{username}', skip it"
+                    "Group '%s' was not found for '%s', skip it", operation.dn, username
                 )
-            except ldap.LDAPError as e:
+            elif operation.failed:
                 logger.error(
-                    f"Error adding '{username}' to '{group_dn}' group: {str(e)}"
+                    "Error adding '%s' to '%s' group: %s",
+                    username,
+                    operation.dn,
+                    operation.error,
                 )
-                continue
+
+    def add_to_groups(self, user_dn: str, group_dns: list[str], username: str) -> None:
+        """Add user to groups"""
+        pipeline = LDAPPipeline()
+        operations = self._queue_group_adds(pipeline, user_dn, group_dns)
+        self._execute_pipeline(pipeline)
+        self._log_group_errors(operations, username)
 
     def create_account(
-        self, user_id: str, db: Session, username: str, attributes: LDAPUserAttributes
-    ) -> Tuple[LDAPAccount, bool]:
+        self,
+        username: str,
+        attributes: LDAPUserAttributes,
+        progress: Callable[[str], None] = no_progress,
+    ) -> Tuple[bytes, bool]:
+        """
+        Creates the account in AD, or resets its password if it already exists.
+        Returns the encrypted password and whether the account existed.
+        Blocks on LDAP, so run it with run_ldap from async code. progress is
+        called from the same thread with the name of each step it starts.
+        """
+        progress("connect")
+        self.connect(username)
         try:
-            db_service = DBService(db)
-            if any(
-                account.kadmin_principal == username
-                for account in db_service.get_ldap_accounts_by_user_id(user_id)
-            ):
-                raise HTTPException(
-                    status_code=409,
-                    detail=f"An account already exists in the database",
-                )
+            result = self.provision_account(username, attributes, progress)
+            self._stick(username)
+            return result
+        finally:
+            self.disconnect()
 
-            self.connect()
+    def provision_account(
+        self,
+        username: str,
+        attributes: LDAPUserAttributes,
+        progress: Callable[[str], None] = no_progress,
+    ) -> Tuple[bytes, bool]:
+        """create_account on an already borrowed connection"""
+        try:
             user_dn = f"CN={username},{config.ldap.default_users_dn}"
 
-            # Create all nesting OU
-            dn_parts = config.ldap.default_users_dn.split(",")
-            ou_parts = [
-                part.split("=")[1] for part in dn_parts if part.startswith("OU=")
-            ]
-            dc_parts = ",".join([part for part in dn_parts if part.startswith("DC=")])
-            current_dn = dc_parts
-            for ou in reversed(ou_parts):
-                self.create_ou(ou, current_dn)
-                current_dn = f"OU={ou},{current_dn}"
-
             password = attributes.password
             encrypted_password = self.encryptor.encrypt_password(password)
             was_existing = False
 
-            try:
-                ldap_attrs = {
-                    "objectClass": [
-                        oc.encode("utf-8") for oc in attributes.objectClass
-                    ],
-                    "cn": attributes.cn.encode("utf-8"),
-                    "sAMAccountName": attributes.sAMAccountName.encode("utf-8"),
-                    "userPrincipalName": attributes.userPrincipalName.encode("utf-8"),
-                    "mail": attributes.mail.encode("utf-8"),
-                    "unicodePwd": f'"{attributes.password}"'.encode("utf-16-le"),
-                    "userAccountControl": attributes.userAccountControl.encode("utf-8"),
-                }
-                ldif = modlist.addModlist(ldap_attrs)
-                self.connection.add_s(user_dn, ldif)
-                logger.info(f"Account successfully created: {user_dn}")
-
-            except ldap.ALREADY_EXISTS:
+            # The user and its OU do not depend on each other
+            user_ou = f"{username}_ou"
+            ldif = modlist.addModlist(provisioning_plan.user_attributes(attributes))
+            for attempt in range(2):
+                progress("ous")
+                self.ensure_parent_ous()
+                progress("user")
+                pipeline = LDAPPipeline()
+                user_add = pipeline.add(user_dn, ldif)
+                ou_add = pipeline.add(
+                    f"OU={user_ou},{config.ldap.default_users_dn}",
+                    self._ou_modlist(user_ou),
+                    ignore=(ldap.ALREADY_EXISTS,),
+                )
+                self._execute_pipeline(pipeline)
+                if attempt or not isinstance(user_add.error, ldap.NO_SUCH_OBJECT):
+                    break
+                # A parent OU known to exist was removed from AD, recreate it
+                known_dns.clear()
+
+            if isinstance(user_add.error, ldap.ALREADY_EXISTS):
                 was_existing = True
-                logger.info(f"Account already exists, reset password: {user_dn}")
-                new_password = self.reset_password(username, user_dn)
-                encrypted_password = self.encryptor.encrypt_password(new_password)
+                logger.info("Account already exists, reset password: %s", user_dn)
+            elif user_add.error is not None:
+                raise user_add.error
+            else:
+                logger.info("Account successfully created: %s", user_dn)
+            if ou_add.failed:
+                raise HTTPException(
+                    status_code=500,
+                    detail=f"Error while creating OU '{ou_add.dn}': {str(ou_add.error)}",
+                )
 
-            self.create_ou(f"{username}_ou", config.ldap.default_users_dn)
-            ad_account = db_service.create_ldap_account_record(
-                user_id, username, encrypted_password
+            # Password reset and group membership only need the user to exist
+            progress("groups")
+            if not provisioning_plan.groups_validated:
+                # Not done at startup, e.g. because AD was unreachable
+                try:
+                    self._resolve_groups()
+                except ldap.LDAPError as e:
+                    logger.warning("Groups are not validated: %s", e)
+            pipeline = LDAPPipeline()
+            if was_existing:
+                new_password = generate_password()
+                reset = pipeline.modify(user_dn, self._password_modlist(new_password))
+            group_adds = self._queue_group_adds(
+                pipeline, user_dn, provisioning_plan.group_dns
             )
-            if config.ldap.member_of_groups:
-                self.add_to_groups(user_dn, config.ldap.member_of_groups, username)
+            if pipeline.operations:
+                self._execute_pipeline(pipeline)
+            if was_existing:
+                self._raise_reset_error(reset.error, username, user_dn)
+                encrypted_password = self.encryptor.encrypt_password(new_password)
+            self._log_group_errors(group_adds, username)
 
-            return ad_account, was_existing
+            return encrypted_password, was_existing
 
         except ldap.LDAPError as e:
-            logger.error(f"Error when creating AD account: {str(e)}")
+            logger.error("Error when creating AD account: %s", e)
             raise HTTPException(
                 status_code=500, detail=f"Error when creating AD account: {str(e)}"
             )
+
+    def reset_account_password(self, username: str, user_dn: str) -> str:
+        """Connect and reset user password in AD. Blocks, see run_ldap"""
+        self.connect(username)
+        try:
+            new_password = self.reset_password(username, user_dn)
+            self._stick(username)
+            return new_password
         finally:
             self.disconnect()
 
     def reset_password(self, username: str, user_dn: str) -> str:
         """Reset user password in AD"""
+        new_password = generate_password()
         try:
-            new_password = generate_password()
-            unicode_pwd = f'"{new_password}"'.encode("utf-16-le")
-            mod_attrs = [(ldap.MOD_REPLACE, "unicodePwd", unicode_pwd)]
-            self.connection.modify_s(user_dn, mod_attrs)
-            return new_password
-        except ldap.NO_SUCH_OBJECT:
+            self._execute("modify_s", user_dn, self._password_modlist(new_password))
+        except ldap.LDAPError as e:
+            self._raise_reset_error(e, username, user_dn)
+        return new_password
+
+    @staticmethod
+    def _raise_reset_error(
+        error: Optional[ldap.LDAPError], username: str, user_dn: str
+    ) -> None:
+        if isinstance(error, ldap.NO_SUCH_OBJECT):
             raise HTTPException(
                 status_code=404, detail=f"User not found with such DN: '{user_dn}'"
             )
-        except ldap.LDAPError as e:
+        if error is not None:
             raise HTTPException(
                 status_code=500,
-                detail=f"Error resetting password for: '{username}': {str(e)}",
+                detail=f"Error resetting password for: '{username}': {str(error)}",
             )
@@ -0,0 +1,168 @@
+from typing import Dict, Iterable, Iterator, List, Set, Tuple
+
+from fastapi import HTTPException
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from models.ldap_accounts import LDAPAccount
+from models.users import SSOUser
+from services.account_cache import invalidate_accounts
+from services.account_service import CREATED, EXISTS, RESET
+from services.ad_service import ADService
+from services.db_service import DBService
+from services.logging_config import get_logger
+from services.provisioning import build_user_attributes
+from services.single_flight import HeldLeases
+from services.utils import username_from_email
+
+logger = get_logger(__name__)
+
+DEFAULT_CHUNK_SIZE = 50
+
+
+class BatchProvisioner:
+    """
+    Provisions AD accounts for many SSO users over one borrowed connection.
+    Account records are written in one transaction per chunk. Users that
+    already have a record are skipped, so a failed run can simply be repeated.
+    Each user's create lease is held while its chunk runs, users another
+    request or job is creating at the time are reported as busy.
+    """
+
+    def __init__(self, db: Session, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        self.db = db
+        self.db_service = DBService(db)
+        self.chunk_size = chunk_size
+
+    def provision(self, identifiers: Iterable[str]) -> Iterator[Dict[str, str]]:
+        """
+        Yields a result per identifier, a chunk at a time once its records
+        are committed. A consumer that stops in the middle never leaves an
+        account it was told about without its stored password
+        """
+        identifiers = list(dict.fromkeys(i.strip() for i in identifiers if i.strip()))
+        # The connection is borrowed on the first LDAP operation and kept
+        ad_service = ADService()
+        try:
+            for start in range(0, len(identifiers), self.chunk_size):
+                chunk = identifiers[start : start + self.chunk_size]
+                yield from self._provision_chunk(ad_service, chunk)
+        finally:
+            ad_service.disconnect()
+
+    def _provision_chunk(
+        self, ad_service: ADService, chunk: List[str]
+    ) -> List[Dict[str, str]]:
+        users = {}
+        for user in self.db_service.get_sso_users(chunk):
+            users[user.id] = user
+            users[user.email] = user
+        # The create lease of single-flight, so a request or job creating the
+        # same account does not run at the same time
+        leases = HeldLeases(self.db, "create")
+        try:
+            user_ids = {user.id for user in users.values()}
+            busy = {user_id for user_id in user_ids if not leases.claim(user_id)}
+            # Read with the leases held, records of calls that just finished count
+            done = self.db_service.get_user_ids_with_ldap_accounts(user_ids)
+            results = self._provision_users(
+                ad_service, chunk, users, busy, done, leases
+            )
+        finally:
+            # Users left without an outcome, e.g. invalid, or all if it failed
+            leases.release()
+        return results
+
+    def _provision_users(
+        self,
+        ad_service: ADService,
+        chunk: List[str],
+        users: Dict[str, SSOUser],
+        busy: Set[str],
+        done: Set[str],
+        leases: HeldLeases,
+    ) -> List[Dict[str, str]]:
+        results, records, provisioned = [], [], {}
+        # Status code and message per user, for callers waiting on its lease
+        outcomes: Dict[str, Tuple[int, str]] = {}
+        for identifier in chunk:
+            user = users.get(identifier)
+            if user is None:
+                results.append({"user": identifier, "status": "not_found"})
+                continue
+
+            username = username_from_email(user.email)
+            result = {"user": identifier, "user_id": user.id, "username": username}
+            results.append(result)
+            if user.id in busy:
+                result["status"] = "busy"
+                result["detail"] = "Another operation on the account is running"
+                continue
+            if user.id in done:
+                result["status"] = "skipped"
+                result["detail"] = EXISTS
+                outcomes.setdefault(user.id, (409, EXISTS))
+                continue
+            done.add(user.id)
+
+            try:
+                attributes = build_user_attributes(username, user.email)
+                encrypted_password, was_existing = ad_service.provision_account(
+                    username, attributes
+                )
+            except ValueError as e:
+                result["status"] = "error"
+                result["detail"] = f"User attributes validation error: {str(e)}"
+                continue
+            except HTTPException as e:
+                result["status"] = "error"
+                result["detail"] = e.detail
+                outcomes[user.id] = (e.status_code, e.detail)
+                continue
+            finally:
+                leases.renew()
+
+            result["status"] = "reset" if was_existing else "created"
+            records.append(
+                self.db_service.build_ldap_account_record(
+                    user.id, username, encrypted_password
+                )
+            )
+            provisioned[user.id] = result
+
+        self._store(records, provisioned)
+        for record in records:
+            invalidate_accounts(record.sso_user_id)
+        for user_id, result in provisioned.items():
+            message = RESET if result["status"] == "reset" else CREATED
+            stored = result["status"] != "error"
+            outcomes[user_id] = (200, message) if stored else (500, result["detail"])
+        for user_id, (status_code, detail) in outcomes.items():
+            leases.finish(user_id, status_code, detail)
+        return results
+
+    def _store(
+        self, records: List[LDAPAccount], provisioned: Dict[str, Dict[str, str]]
+    ) -> None:
+        """
+        Commits the chunk, isolating the rows that fail if the batch does.
+        Turns the result of every user whose row was not stored into an error
+        """
+        if not records:
+            return
+        try:
+            self.db_service.add_ldap_account_records(records)
+            return
+        except SQLAlchemyError as e:
+            self.db.rollback()
+            logger.warning("Batch commit failed, storing rows one by one: %s", e)
+
+        for record in records:
+            try:
+                self.db_service.add_ldap_account_records([record])
+            except SQLAlchemyError as e:
+                self.db.rollback()
+                error = getattr(e, "orig", None) or e
+                provisioned[record.sso_user_id].update(
+                    status="error", detail=f"Database error: {str(error)}"
+                )
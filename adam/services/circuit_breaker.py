@@ -0,0 +1,167 @@
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Optional
+
+from fastapi import HTTPException
+
+from config import config
+from services.lifecycle import resources
+from services.logging_config import get_logger
+from services.metrics import (
+    LDAP_CIRCUIT_REJECTED,
+    LDAP_CIRCUIT_STATE,
+    LDAP_TIMEOUT_SECONDS,
+)
+
+logger = get_logger(__name__)
+
+# Gauge value per state, the worst state is the highest
+STATES = {"closed": 0, "half_open": 1, "open": 2}
+
+
+class CircuitBreaker:
+    """
+    Stops sending work to AD after failure_threshold connection errors or
+    timeouts in a row, which all DCs failed. While open, calls fail at once
+    with 503 and Retry-After instead of waiting for the timeout. After
+    open_seconds one thread is let through (half-open): a success closes the
+    circuit, a failure opens it again. The state is per worker process.
+    """
+
+    def __init__(self, breaker_config=None):
+        self.config = breaker_config or config.ldap.breaker
+        self.state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        # Thread running the trial call while half-open
+        self._trial: Optional[int] = None
+        self._trial_started = 0.0
+        self._lock = threading.Lock()
+        LDAP_CIRCUIT_STATE.set(STATES[self.state])
+
+    def _set_state(self, state: str) -> None:
+        if state == self.state:
+            return
+        log = logger.info if state == "closed" else logger.warning
+        log("AD circuit %s after %s failures", state.replace("_", "-"), self._failures)
+        self.state = state
+        LDAP_CIRCUIT_STATE.set(STATES[state])
+
+    def _retry_after(self, now: float) -> int:
+        return max(1, math.ceil(self._opened_at + self.config.open_seconds - now))
+
+    def before_call(self) -> None:
+        """Raises 503 while the circuit is open or another thread runs the trial"""
+        if not self.config.enabled:
+            return
+        thread = threading.get_ident()
+        with self._lock:
+            if self.state == "closed":
+                return
+            now = time.monotonic()
+            if (
+                self.state == "open"
+                and now >= self._opened_at + self.config.open_seconds
+            ):
+                self._set_state("half_open")
+                self._trial = None
+            if self.state == "half_open":
+                # A trial that never reported back does not block for ever
+                stuck = now - self._trial_started > self.config.open_seconds
+                if self._trial in (None, thread) or stuck:
+                    if self._trial != thread:
+                        self._trial, self._trial_started = thread, now
+                    return
+                retry_after = 1
+            else:
+                retry_after = self._retry_after(now)
+        LDAP_CIRCUIT_REJECTED.inc()
+        raise HTTPException(
+            status_code=503,
+            detail="Active Directory is unavailable, try again later",
+            headers={"Retry-After": str(retry_after)},
+        )
+
+    def record_success(self) -> None:
+        """AD answered, even if with an error result"""
+        if not self.config.enabled:
+            return
+        with self._lock:
+            if self.state != "closed":
+                self._set_state("closed")
+            self._failures = 0
+            self._trial = None
+
+    def record_failure(self) -> None:
+        """AD could not be reached or did not answer in time"""
+        if not self.config.enabled:
+            return
+        with self._lock:
+            self._failures += 1
+            reopen = self.state == "half_open"
+            if reopen or (
+                self.state == "closed"
+                and self._failures >= self.config.failure_threshold
+            ):
+                self._opened_at = time.monotonic()
+                self._trial = None
+                self._set_state("open")
+
+    def status(self) -> Dict[str, Any]:
+        with self._lock:
+            status = {"state": self.state, "failures": self._failures}
+            if self.state == "open":
+                status["retry_after_s"] = self._retry_after(time.monotonic())
+        return status
+
+
+class AdaptiveTimeout:
+    """
+    LDAP operation timeout from the latency of the latest successful
+    operations: the configured percentile times multiplier, between min and
+    pool.timeout. A slow but answering directory keeps its headroom, a fast
+    one fails over to the next DC long before the fixed timeout.
+    """
+
+    def __init__(self, timeout_config=None, ceiling: Optional[float] = None):
+        self.config = timeout_config or config.ldap.adaptive_timeout
+        self.ceiling = float(ceiling or config.ldap.pool.timeout)
+        self._samples: deque = deque(maxlen=self.config.window)
+        self._observed = 0
+        self._value = self.ceiling
+        LDAP_TIMEOUT_SECONDS.set(self._value)
+
+    def observe(self, seconds: float) -> None:
+        self._samples.append(seconds)
+        self._observed += 1
+        # Sorting the window on every call would cost more than the gain
+        if self._observed % 10 == 0:
+            self._update()
+
+    def _update(self) -> None:
+        samples = sorted(self._samples)
+        if not self.config.enabled or len(samples) < self.config.min_samples:
+            return
+        index = min(len(samples) - 1, int(len(samples) * self.config.percentile))
+        value = samples[index] * self.config.multiplier
+        self._value = min(self.ceiling, max(self.config.min, value))
+        LDAP_TIMEOUT_SECONDS.set(self._value)
+
+    def current(self) -> float:
+        return self._value
+
+
+ldap_breaker = CircuitBreaker()
+ldap_timeout = AdaptiveTimeout()
+
+
+def _publish_gauges() -> None:
+    # Gauges live in files per process, values set in the gunicorn master
+    # before fork are not in the worker's
+    LDAP_CIRCUIT_STATE.set(STATES[ldap_breaker.state])
+    LDAP_TIMEOUT_SECONDS.set(ldap_timeout.current())
+
+
+resources.register("ldap circuit", after_fork=_publish_gauges)
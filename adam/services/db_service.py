@@ -1,10 +1,13 @@
+from sqlalchemy import or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from typing import List, Optional
+from typing import Iterable, List, Optional, Set
 
 from config import config
+from models.jobs import ProvisioningJob
 from models.users import SSOUser
 from models.ldap_accounts import LDAPAccount
-from services.encryption import PasswordEncryptor
+from services.encryption import encryptor
 from services.logging_config import get_logger
 from services.utils import dn_keys_to_upper
 
@@ -14,36 +17,63 @@ logger = get_logger(__name__)
 class DBService:
     def __init__(self, db: Session):
         self.db = db
-        self.encryptor = PasswordEncryptor()
+        self.encryptor = encryptor
 
     def get_sso_user_by_id(self, user_id: str) -> Optional[SSOUser]:
         """Get the SSO user by its UUID"""
         return self.db.query(SSOUser).filter(SSOUser.id == user_id).first()
 
+    def get_sso_users(self, identifiers: Iterable[str]) -> List[SSOUser]:
+        """Get SSO users by their UUIDs or emails in one query"""
+        identifiers = list(identifiers)
+        return (
+            self.db.query(SSOUser)
+            .filter(or_(SSOUser.id.in_(identifiers), SSOUser.email.in_(identifiers)))
+            .all()
+        )
+
+    def get_user_ids_with_ldap_accounts(self, user_ids: Iterable[str]) -> Set[str]:
+        """Gets which of the users already have an LDAP account"""
+        rows = (
+            self.db.query(LDAPAccount.sso_user_id)
+            .filter(LDAPAccount.sso_user_id.in_(list(user_ids)))
+            .all()
+        )
+        return {row.sso_user_id for row in rows}
+
     def get_ldap_accounts_by_user_id(self, user_id: str) -> List[LDAPAccount]:
-        """Gets all LDAP accounts for a user by its UUID"""
-        accounts = (
+        """Gets all LDAP accounts for a user by its UUID, passwords stay encrypted"""
+        return (
             self.db.query(LDAPAccount).filter(LDAPAccount.sso_user_id == user_id).all()
         )
-        for account in accounts:
-            try:
-                account.kadmin_password = self.encryptor.decrypt_password(
-                    account.kadmin_password
-                )
-            except Exception as e:
-                logger.error(f"Password decryption error: {e}")
-                account.kadmin_password = "Decryption error"
-        return accounts
 
     def create_ldap_account_record(
         self, user_id: str, username: str, encrypted_password: bytes
     ) -> LDAPAccount:
         """Creates LDAP account record in the database"""
+        ad_account = self.build_ldap_account_record(
+            user_id, username, encrypted_password
+        )
+        self.db.add(ad_account)
+        self.db.commit()
+        self.db.refresh(ad_account)
+        return ad_account
+
+    def add_ldap_account_records(self, accounts: List[LDAPAccount]) -> None:
+        """Stores several LDAP account records in one transaction"""
+        self.db.add_all(accounts)
+        self.db.commit()
+
+    @staticmethod
+    def build_ldap_account_record(
+        user_id: str, username: str, encrypted_password: bytes
+    ) -> LDAPAccount:
+        """Builds LDAP account record without adding it to the session"""
         admin_dn = dn_keys_to_upper(f"CN={username},{config.ldap.default_users_dn}")
         container_dn = dn_keys_to_upper(
             f"OU={username}_ou,{config.ldap.default_users_dn}"
         )
-        ad_account = LDAPAccount(
+        return LDAPAccount(
             sso_user_id=user_id,
             kdc_hosts=config.ldap.host,
             realm=config.ldap.realm,
@@ -54,10 +84,6 @@ class DBService:
             ldap_url=config.ldap.url,
             container_dn=container_dn,
         )
-        self.db.add(ad_account)
-        self.db.commit()
-        self.db.refresh(ad_account)
-        return ad_account
 
     def delete_ldap_account(self, user_id: str, username: str) -> None:
         """Deletes LDAP account from the database"""
@@ -67,3 +93,83 @@ class DBService:
                 self.db.delete(account)
                 self.db.commit()
                 break
+
+
+class AsyncDBService:
+    """DBService for request handlers, queries run on the async engine"""
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.encryptor = encryptor
+
+    async def get_sso_user_by_id(self, user_id: str) -> Optional[SSOUser]:
+        """Get the SSO user by its UUID"""
+        return await self.db.get(SSOUser, user_id)
+
+    async def get_sso_user_by(self, **filters) -> Optional[SSOUser]:
+        """Get the SSO user by column values, e.g. sso_id or username"""
+        return await self.db.scalar(select(SSOUser).filter_by(**filters).limit(1))
+
+    async def add_sso_user(self, sso_user: SSOUser) -> SSOUser:
+        """Stores a new SSO user"""
+        self.db.add(sso_user)
+        await self.db.commit()
+        await self.db.refresh(sso_user)
+        return sso_user
+
+    async def get_ldap_accounts_by_user_id(self, user_id: str) -> List[LDAPAccount]:
+        """Gets all LDAP accounts for a user by its UUID, passwords stay encrypted"""
+        accounts = await self.db.scalars(
+            select(LDAPAccount).where(LDAPAccount.sso_user_id == user_id)
+        )
+        return accounts.all()
+
+    async def get_ldap_account_versions(self, user_id: str) -> list:
+        """Gets what identifies the current state of the user's accounts"""
+        rows = await self.db.execute(
+            select(
+                LDAPAccount.kadmin_principal,
+                LDAPAccount.version,
+                LDAPAccount.created_at,
+                LDAPAccount.updated_at,
+            )
+            .where(LDAPAccount.sso_user_id == user_id)
+            .order_by(LDAPAccount.kadmin_principal)
+        )
+        return rows.all()
+
+    async def create_ldap_account_record(
+        self, user_id: str, username: str, encrypted_password: bytes
+    ) -> LDAPAccount:
+        """Creates LDAP account record in the database"""
+        ad_account = DBService.build_ldap_account_record(
+            user_id, username, encrypted_password
+        )
+        self.db.add(ad_account)
+        await self.db.commit()
+        await self.db.refresh(ad_account)
+        return ad_account
+
+    async def get_job(self, job_id: str) -> Optional[ProvisioningJob]:
+        return await self.db.get(ProvisioningJob, job_id)
+
+    async def get_active_job(
+        self, user_id: str, operation: str
+    ) -> Optional[ProvisioningJob]:
+        """Get the queued or running job of the operation for a user"""
+        return await self.db.scalar(
+            select(ProvisioningJob)
+            .where(
+                ProvisioningJob.sso_user_id == user_id,
+                ProvisioningJob.operation == operation,
+                ProvisioningJob.status.in_(("queued", "running")),
+            )
+            .limit(1)
+        )
+
+    async def add_job(self, job: ProvisioningJob) -> ProvisioningJob:
+        """Stores a new job"""
+        self.db.add(job)
+        await self.db.commit()
+        await self.db.refresh(job)
+        return job
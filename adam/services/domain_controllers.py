@@ -0,0 +1,172 @@
+import asyncio
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+import ldap
+
+from config import config
+from services.cache import TTLCache
+from services.logging_config import get_logger
+from services.metrics import LDAP_DC_BIND_SECONDS, LDAP_DC_UP, timed_ldap
+
+logger = get_logger(__name__)
+
+# Errors after which the next DC is tried
+FAILOVER_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR, ldap.TIMEOUT)
+
+# Share of a new bind latency sample in the moving average
+LATENCY_WEIGHT = 0.3
+
+
+def open_connection(url: str, timeout: float):
+    """Open a connection to a DC and bind as admin"""
+    ldap.set_option(ldap.OPT_X_TLS_REQUIRE_CERT, ldap.OPT_X_TLS_ALLOW)
+    ldap.set_option(ldap.OPT_NETWORK_TIMEOUT, timeout)
+    ldap.set_option(ldap.OPT_TIMEOUT, timeout)
+
+    connection = ldap.initialize(url)
+    timed_ldap(
+        "bind",
+        connection.simple_bind_s,
+        config.ldap.admin_dn,
+        config.ldap.admin_pass.get_secret_value(),
+    )
+    return connection
+
+
+class DomainController:
+    """Health and bind latency of a DC as seen by this worker"""
+
+    def __init__(self, url: str):
+        self.url = url
+        # Trusted until a bind or an operation fails
+        self.healthy = True
+        self.latency: Optional[float] = None
+        self.error: Optional[str] = None
+
+
+class DomainControllers:
+    """
+    The DCs new connections may go to. Healthy ones come first, fastest bind
+    first, the others stay as a last resort. A DC is marked down when a bind
+    or an operation on it fails with SERVER_DOWN or TIMEOUT, and up again by
+    the next successful bind, of the pool or of the background probe.
+    """
+
+    def __init__(self, urls: List[str]):
+        self.dcs = [DomainController(url) for url in urls]
+        self._by_url = {dc.url: dc for dc in self.dcs}
+        self._lock = threading.Lock()
+        # Username -> DC that took the user's last write
+        self._sticky = TTLCache(
+            maxsize=config.ldap.failover.sticky_size,
+            ttl=config.ldap.failover.sticky_ttl,
+        )
+
+    def ordered(self, prefer: Optional[str] = None) -> List[str]:
+        """URLs to try for a new connection, the preferred DC first if healthy"""
+        with self._lock:
+            # sorted is stable, DCs without a measured latency keep config order
+            healthy = sorted(
+                (dc for dc in self.dcs if dc.healthy),
+                key=lambda dc: float("inf") if dc.latency is None else dc.latency,
+            )
+            urls = [dc.url for dc in healthy]
+            urls += [dc.url for dc in self.dcs if not dc.healthy]
+        if prefer in urls[: len(healthy)]:
+            urls.remove(prefer)
+            urls.insert(0, prefer)
+        return urls
+
+    def is_healthy(self, url: str) -> bool:
+        dc = self._by_url.get(url)
+        return dc is not None and dc.healthy
+
+    def mark_up(self, url: str, latency: Optional[float] = None) -> None:
+        dc = self._by_url.get(url)
+        if dc is None:
+            return
+        with self._lock:
+            recovered = not dc.healthy
+            dc.healthy = True
+            dc.error = None
+            if latency is not None:
+                # Smoothed, so close DCs do not swap places on every probe
+                dc.latency = (
+                    latency
+                    if dc.latency is None
+                    else LATENCY_WEIGHT * latency + (1 - LATENCY_WEIGHT) * dc.latency
+                )
+        if recovered:
+            logger.info("Domain controller %s is back", url)
+        LDAP_DC_UP.labels(url).set(1)
+        if latency is not None:
+            LDAP_DC_BIND_SECONDS.labels(url).set(dc.latency)
+
+    def mark_down(self, url: str, error: Exception) -> bool:
+        """Takes the DC out of rotation, returns whether another DC is healthy"""
+        dc = self._by_url.get(url)
+        if dc is None:
+            return False
+        with self._lock:
+            failed = dc.healthy
+            dc.healthy = False
+            dc.error = str(error) or type(error).__name__
+            others = any(other.healthy for other in self.dcs)
+        if failed:
+            logger.warning("Domain controller %s is down: %s", url, dc.error)
+        LDAP_DC_UP.labels(url).set(0)
+        return others
+
+    def sticky_url(self, username: str) -> Optional[str]:
+        return self._sticky.get(username)
+
+    def stick(self, username: str, url: str) -> None:
+        """Keeps the user's next operations on the DC that took this write"""
+        if len(self.dcs) > 1:
+            self._sticky.set(username, url)
+
+    def probe(self, url: str) -> None:
+        """Binds to the DC to measure its latency, blocks"""
+        started = time.perf_counter()
+        try:
+            connection = open_connection(url, config.ldap.pool.timeout)
+        except ldap.LDAPError as e:
+            self.mark_down(url, e)
+            return
+        self.mark_up(url, time.perf_counter() - started)
+        try:
+            connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    async def run(self) -> None:
+        while True:
+            # Probe binds run on threads of their own, not the request executor
+            await asyncio.gather(
+                *(asyncio.to_thread(self.probe, dc.url) for dc in self.dcs)
+            )
+            await asyncio.sleep(config.ldap.failover.probe_interval)
+
+    def start(self) -> List[asyncio.Task]:
+        """Starts the probes of this worker, there is nothing to choose from one DC"""
+        if len(self.dcs) < 2:
+            return []
+        return [asyncio.create_task(self.run())]
+
+    def status(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            return {
+                dc.url: {
+                    "healthy": dc.healthy,
+                    "bind_ms": (
+                        None if dc.latency is None else round(dc.latency * 1000, 2)
+                    ),
+                    **({"error": dc.error} if dc.error else {}),
+                }
+                for dc in self.dcs
+            }
+
+
+domain_controllers = DomainControllers(config.ldap.dc_urls)
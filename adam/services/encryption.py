@@ -1,18 +1,77 @@
-from cryptography.fernet import Fernet
+import hashlib
+import time
+from typing import Optional
+
+from cryptography.fernet import Fernet, InvalidToken, MultiFernet
 from config import config
+from services.logging_config import get_logger
+from services.metrics import FERNET_OPERATIONS
+from services.timing import record
+
+logger = get_logger(__name__)
+
+_encrypted = FERNET_OPERATIONS.labels("encrypt", "success")
+_decrypted = FERNET_OPERATIONS.labels("decrypt", "success")
+_decrypt_failed = FERNET_OPERATIONS.labels("decrypt", "error")
+_rotated = FERNET_OPERATIONS.labels("rotate", "success")
 
 
 class PasswordEncryptor:
     def __init__(self):
-        self.cipher = Fernet(config.encryption.secret_key.get_secret_value().encode())
+        secret_key = config.encryption.secret_key.get_secret_value().encode()
+        self.primary = Fernet(secret_key)
+        old_keys = [
+            Fernet(key.get_secret_value().encode())
+            for key in config.encryption.old_keys
+        ]
+        # Encrypts with the first key, decrypts with any of them
+        self.cipher = MultiFernet([self.primary, *old_keys])
+        self.key_id = hashlib.sha256(secret_key).hexdigest()[:16]
 
     def encrypt_password(self, password: str) -> bytes:
         """Encrypt the password"""
-        return self.cipher.encrypt(password.encode())
+        started = time.perf_counter()
+        encrypted = self.cipher.encrypt(password.encode())
+        record("fernet", time.perf_counter() - started)
+        _encrypted.inc()
+        return encrypted
 
     def decrypt_password(self, encrypted_password: bytes) -> str:
         """Decrypt the password"""
+        started = time.perf_counter()
         try:
-            return self.cipher.decrypt(encrypted_password).decode()
+            password = self.cipher.decrypt(encrypted_password).decode()
         except Exception as e:
+            _decrypt_failed.inc()
             raise ValueError(f"Password decryption error: {str(e)}")
+        finally:
+            record("fernet", time.perf_counter() - started)
+        _decrypted.inc()
+        return password
+
+    def is_current(self, encrypted_password: bytes) -> bool:
+        """Whether the password is encrypted with the newest key"""
+        try:
+            self.primary.decrypt(encrypted_password)
+            return True
+        except InvalidToken:
+            return False
+
+    def rotate(self, encrypted_password: bytes) -> bytes:
+        """Re-encrypt the password with the newest key"""
+        _rotated.inc()
+        return self.cipher.rotate(encrypted_password)
+
+    def reveal_password(self, encrypted_password: Optional[bytes]) -> str:
+        """Decrypt a stored password where it is shown, never raises"""
+        if encrypted_password is None:
+            return ""
+        try:
+            return self.decrypt_password(encrypted_password)
+        except ValueError as e:
+            logger.error(str(e))
+            return "Decryption error"
+
+
+# Shared by all requests of the process, Fernet is stateless and thread-safe
+encryptor = PasswordEncryptor()
@@ -0,0 +1,71 @@
+from typing import Optional
+
+from fastapi import Request
+from itsdangerous import BadSignature, URLSafeSerializer
+from sqlalchemy import select
+
+from config import config
+from models.database import AsyncSessionLocal
+from models.users import SSOUser
+from services.cache import TTLCache
+from services.db_service import AsyncDBService
+from services.logging_config import get_logger
+from services.timing import phase
+
+logger = get_logger(__name__)
+serializer = URLSafeSerializer(config.encryption.user_session_key.get_secret_value())
+
+# auth_token -> SSO user, so repeated requests of a user cost no queries
+identity_cache = TTLCache(
+    maxsize=config.users.identity_cache_size, ttl=config.users.identity_cache_ttl
+)
+
+_UNRESOLVED = object()
+
+
+async def find_user(*criteria) -> Optional[SSOUser]:
+    """Get the SSO user matching the criteria in a short-lived session"""
+    async with AsyncSessionLocal() as db:
+        return await db.scalar(select(SSOUser).where(*criteria).limit(1))
+
+
+async def get_current_user(request: Request) -> Optional[SSOUser]:
+    """Get the user of the auth token, resolved once per request"""
+    user = getattr(request.state, "user", _UNRESOLVED)
+    if user is _UNRESOLVED:
+        with phase("auth"):
+            user = await _user_by_token(request.cookies.get("auth_token"))
+        request.state.user = user
+    return user
+
+
+async def get_sso_user(
+    request: Request, user_id: str, db_service: AsyncDBService
+) -> Optional[SSOUser]:
+    """Get the requested SSO user, reusing the current user if it is the same"""
+    user = await get_current_user(request)
+    if user is not None and user.id == user_id:
+        return user
+    return await db_service.get_sso_user_by_id(user_id)
+
+
+async def _user_by_token(auth_token: Optional[str]) -> Optional[SSOUser]:
+    if not auth_token:
+        return None
+    user = identity_cache.get(auth_token)
+    if user is not None:
+        return user
+
+    try:
+        user_id = str(serializer.loads(auth_token))
+        user = await find_user(SSOUser.id == user_id)
+    except BadSignature:
+        logger.warning("Invalid auth token")
+        return None
+    except Exception as e:
+        logger.error("Error getting current user: %s", e)
+        return None
+    # Unknown users are not cached, they may sign in a moment later
+    if user is not None:
+        identity_cache.set(auth_token, user)
+    return user
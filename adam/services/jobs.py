@@ -0,0 +1,254 @@
+import asyncio
+import time
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from config import config
+from models.database import AsyncSessionLocal
+from models.jobs import ProvisioningJob
+from services.account_service import CREATED, create_account, get_account
+from services.db_service import AsyncDBService
+from services.logging_config import get_logger
+from services.metrics import JOB_SECONDS
+from services.provisioning import build_user_attributes
+from services.single_flight import single_flight
+from services.utils import username_from_email
+
+logger = get_logger(__name__)
+
+USERS_PATH = f"{config.api.prefix}{config.api.v1.prefix}{config.api.v1.users}"
+
+
+async def _create(job: ProvisioningJob, progress: Callable[[str], None]) -> str:
+    async with AsyncSessionLocal() as db:
+        sso_user = await AsyncDBService(db).get_sso_user_by_id(job.sso_user_id)
+    if not sso_user:
+        raise HTTPException(status_code=404, detail="User not found")
+    username = username_from_email(sso_user.email)
+    # Generated again on every run, passwords are not stored in the queue
+    attributes = build_user_attributes(username, sso_user.email)
+    try:
+        return await single_flight.run(
+            "create",
+            job.sso_user_id,
+            lambda: create_account(job.sso_user_id, username, attributes, progress),
+        )
+    except HTTPException as e:
+        if e.status_code == 409 and await _stored_by_earlier_attempt(job, username):
+            return CREATED
+        raise
+
+
+async def _stored_by_earlier_attempt(job: ProvisioningJob, username: str) -> bool:
+    """
+    Whether the existing record was stored by an interrupted earlier attempt:
+    one got as far as the record step, and the user's record for the username
+    was created after the job was queued
+    """
+    if job.attempts < 2 or job.step != "record":
+        return False
+    async with AsyncSessionLocal() as db:
+        account = await get_account(AsyncDBService(db), job.sso_user_id, username)
+    return account is not None and account.created_at >= job.created_at
+
+
+# Operation name -> coroutine doing it, returns the success message
+OPERATIONS: Dict[
+    str, Callable[[ProvisioningJob, Callable[[str], None]], Awaitable[str]]
+] = {"create": _create}
+
+
+async def enqueue(db: AsyncSession, operation: str, user_id: str) -> ProvisioningJob:
+    """Queues the operation, or returns the job already queued for the user"""
+    db_service = AsyncDBService(db)
+    job = await db_service.get_active_job(user_id, operation)
+    if job is None:
+        job = await db_service.add_job(
+            ProvisioningJob(operation=operation, sso_user_id=user_id)
+        )
+        logger.info("Job %s queued: %s for %s", job.id, operation, user_id)
+        job_runner.wake()
+    return job
+
+
+def job_urls(job: ProvisioningJob) -> Dict[str, str]:
+    """Where the client follows a queued job"""
+    url = f"{USERS_PATH}/{job.sso_user_id}/jobs/{job.id}"
+    return {"status_url": url, "events_url": f"{url}/events"}
+
+
+class JobRunner:
+    """
+    Runs queued jobs, config.jobs.workers at a time in every worker process.
+    Jobs are claimed with a lease in the jobs table, renewed on every step;
+    a job whose worker died or restarted is claimed again once it expires.
+    """
+
+    def __init__(self):
+        self._wakeup = asyncio.Event()
+
+    def wake(self) -> None:
+        """Starts a job queued by this process without waiting for the next check"""
+        self._wakeup.set()
+
+    def start(self) -> List[asyncio.Task]:
+        """Starts the runners of this worker, cancel the tasks on shutdown"""
+        return [asyncio.create_task(self._work()) for _ in range(config.jobs.workers)]
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                job = await self._claim()
+            except Exception as e:
+                logger.error("Error checking the job queue: %s", e)
+                job = None
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(
+                        self._wakeup.wait(), config.jobs.queue_interval
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    @staticmethod
+    def _claimable(now: float):
+        return or_(
+            ProvisioningJob.status == "queued",
+            and_(
+                ProvisioningJob.status == "running",
+                ProvisioningJob.lease_expires_at < now,
+            ),
+        )
+
+    async def _claim(self) -> Optional[ProvisioningJob]:
+        """Takes the oldest queued or abandoned job, None if there is none"""
+        async with AsyncSessionLocal() as db:
+            while True:
+                now = time.time()
+                job_id = await db.scalar(
+                    select(ProvisioningJob.id)
+                    .where(self._claimable(now))
+                    .order_by(ProvisioningJob.created_at)
+                    .limit(1)
+                )
+                if job_id is None:
+                    return None
+                owner = uuid4().hex
+                # Only if no other runner claimed it since it was read
+                result = await db.execute(
+                    update(ProvisioningJob)
+                    .where(ProvisioningJob.id == job_id, self._claimable(now))
+                    .values(
+                        status="running",
+                        owner=owner,
+                        lease_expires_at=now + config.jobs.lease_ttl,
+                        attempts=ProvisioningJob.attempts + 1,
+                    )
+                )
+                await db.commit()
+                if result.rowcount == 1:
+                    return await db.get(ProvisioningJob, job_id)
+
+    async def _run(self, job: ProvisioningJob) -> None:
+        if job.attempts > config.jobs.max_attempts:
+            await self._finish(
+                job, 500, f"Job given up after {job.attempts - 1} attempts"
+            )
+            return
+        logger.info(
+            "Job %s started: %s, attempt %s", job.id, job.operation, job.attempts
+        )
+        loop = asyncio.get_running_loop()
+        steps: asyncio.Queue = asyncio.Queue()
+
+        def progress(step: str) -> None:
+            # Called from the LDAP threads as well
+            loop.call_soon_threadsafe(steps.put_nowait, step)
+
+        reporter = asyncio.create_task(self._report(job, steps))
+        retry_after = None
+        try:
+            message = await OPERATIONS[job.operation](job, progress)
+            status_code = 200
+        except HTTPException as e:
+            status_code, message = e.status_code, e.detail
+            retry_after = (e.headers or {}).get("Retry-After")
+        except Exception as e:
+            status_code, message = 500, f"Job error: {str(e)}"
+        finally:
+            steps.put_nowait(None)
+            await reporter
+        if status_code == 503 and retry_after:
+            # AD circuit open, another attempt once it lets requests through
+            await self._defer(job, float(retry_after), message)
+            return
+        await self._finish(job, status_code, message)
+
+    async def _report(self, job: ProvisioningJob, steps: asyncio.Queue) -> None:
+        """Stores the steps the job reaches, each renews its lease"""
+        while (step := await steps.get()) is not None:
+            try:
+                async with AsyncSessionLocal() as db:
+                    await db.execute(
+                        update(ProvisioningJob)
+                        .where(
+                            ProvisioningJob.id == job.id,
+                            ProvisioningJob.owner == job.owner,
+                        )
+                        .values(
+                            step=step,
+                            lease_expires_at=time.time() + config.jobs.lease_ttl,
+                        )
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Progress of job %s not stored: %s", job.id, e)
+
+    async def _defer(self, job: ProvisioningJob, seconds: float, message: str) -> None:
+        """Lets the lease run out in seconds, the job is claimed again then"""
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(ProvisioningJob)
+                .where(ProvisioningJob.id == job.id, ProvisioningJob.owner == job.owner)
+                .values(lease_expires_at=time.time() + seconds)
+            )
+            await db.commit()
+        logger.warning("Job %s deferred for %gs: %s", job.id, seconds, message)
+
+    async def _finish(
+        self, job: ProvisioningJob, status_code: int, message: str
+    ) -> None:
+        status = "succeeded" if status_code == 200 else "failed"
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(ProvisioningJob)
+                .where(ProvisioningJob.id == job.id, ProvisioningJob.owner == job.owner)
+                .values(
+                    status=status,
+                    step="done",
+                    status_code=status_code,
+                    message=message,
+                    owner=None,
+                    lease_expires_at=None,
+                )
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            logger.warning("Job %s was claimed again before it finished", job.id)
+            return
+        JOB_SECONDS.labels(job.operation, status).observe(
+            (datetime.now() - job.created_at).total_seconds()
+        )
+        log = logger.info if status == "succeeded" else logger.error
+        log("Job %s %s: %s", job.id, status, message)
+
+
+job_runner = JobRunner()
@@ -0,0 +1,157 @@
+import json
+import os
+import time
+from typing import Dict, Iterator, Optional
+
+from cryptography.fernet import InvalidToken
+from sqlalchemy import bindparam, func, select, update
+from sqlalchemy.orm import Session
+
+from models.ldap_accounts import LDAPAccount
+from services.encryption import PasswordEncryptor, encryptor
+from services.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_STATE_PATH = "./data/key_rotation.json"
+
+accounts = LDAPAccount.__table__
+
+
+class KeyRotation:
+    """
+    Re-encrypts stored passwords with the newest key while the service is running.
+    Rows are read in primary key order, a batch at a time, and each batch is
+    written in its own short transaction. The last key of every committed batch
+    is saved, so an interrupted run continues where it stopped.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        pause: float = 0.0,
+        state_path: str = DEFAULT_STATE_PATH,
+        cipher: PasswordEncryptor = encryptor,
+    ):
+        self.db = db
+        self.batch_size = batch_size
+        self.pause = pause
+        self.state_path = state_path
+        self.cipher = cipher
+
+    def run(self, restart: bool = False) -> Iterator[Dict[str, object]]:
+        """Yields progress after every committed batch"""
+        after = None if restart else self._load_state()
+        total = self.db.scalar(select(func.count()).select_from(accounts))
+        processed = 0
+        if after is not None:
+            processed = self.db.scalar(
+                select(func.count())
+                .select_from(accounts)
+                .where(accounts.c.kadmin_principal <= after)
+            )
+            logger.info("Resuming key rotation after '%s'", after)
+        self.db.commit()
+
+        progress = {
+            "total": total,
+            "processed": processed,
+            "rotated": 0,
+            "current": 0,
+            "changed": 0,
+            "failed": 0,
+        }
+        started = time.perf_counter()
+        run_processed = 0
+        while True:
+            rows = self._read_batch(after)
+            if not rows:
+                break
+            self._rotate_batch(rows, progress)
+            after = rows[-1].kadmin_principal
+            self._save_state(after)
+
+            run_processed += len(rows)
+            progress["processed"] += len(rows)
+            elapsed = time.perf_counter() - started
+            progress["rows_per_second"] = round(run_processed / elapsed, 1)
+            progress["after"] = after
+            yield dict(progress)
+            if self.pause:
+                time.sleep(self.pause)
+
+        self._clear_state()
+        logger.info(
+            "Key rotation finished: %s rotated, %s failed of %s",
+            progress["rotated"],
+            progress["failed"],
+            progress["total"],
+        )
+
+    def _read_batch(self, after: Optional[str]) -> list:
+        query = (
+            select(accounts.c.kadmin_principal, accounts.c.kadmin_password)
+            .order_by(accounts.c.kadmin_principal)
+            .limit(self.batch_size)
+        )
+        if after is not None:
+            query = query.where(accounts.c.kadmin_principal > after)
+        rows = self.db.execute(query).all()
+        # Do not keep the read transaction open while encrypting
+        self.db.commit()
+        return rows
+
+    def _rotate_batch(self, rows: list, progress: Dict[str, object]) -> None:
+        params = []
+        for principal, password in rows:
+            if password is None or self.cipher.is_current(password):
+                progress["current"] += 1
+                continue
+            try:
+                rotated = self.cipher.rotate(password)
+            except InvalidToken:
+                progress["failed"] += 1
+                logger.error("Password of '%s' matches none of the keys", principal)
+                continue
+            params.append({"pk": principal, "old": password, "new": rotated})
+        if not params:
+            return
+
+        # A row reset by the service meanwhile already has a new password, keep it
+        statement = (
+            update(accounts)
+            .where(accounts.c.kadmin_principal == bindparam("pk"))
+            .where(accounts.c.kadmin_password == bindparam("old"))
+            .values(kadmin_password=bindparam("new"))
+        )
+        result = self.db.execute(statement, params)
+        self.db.commit()
+        updated = result.rowcount if result.rowcount >= 0 else len(params)
+        progress["rotated"] += updated
+        progress["changed"] += len(params) - updated
+
+    def _load_state(self) -> Optional[str]:
+        try:
+            with open(self.state_path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return None
+        # Progress of a rotation to another key is useless
+        if state.get("key_id") != self.cipher.key_id:
+            return None
+        return state.get("after")
+
+    def _save_state(self, after: str) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.state_path)), exist_ok=True)
+        tmp_path = f"{self.state_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"key_id": self.cipher.key_id, "after": after}, f)
+        os.replace(tmp_path, self.state_path)
+
+    def _clear_state(self) -> None:
+        try:
+            os.remove(self.state_path)
+        except FileNotFoundError:
+            pass
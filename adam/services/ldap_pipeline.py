@@ -0,0 +1,94 @@
+import time
+from typing import List, Optional, Tuple, Type
+
+import ldap
+
+from services.circuit_breaker import ldap_timeout
+from services.ldap_pool import CONNECTION_ERRORS
+from services.metrics import observe_ldap
+
+
+class LDAPOperation:
+    """Operation submitted to a pipeline and its outcome"""
+
+    def __init__(
+        self,
+        kind: str,
+        dn: str,
+        modlist: list,
+        ignore: Tuple[Type[ldap.LDAPError], ...] = (),
+    ):
+        self.kind = kind
+        self.dn = dn
+        self.modlist = modlist
+        self.ignore = ignore
+        self.msgid: Optional[int] = None
+        self.error: Optional[ldap.LDAPError] = None
+        self.started = 0.0
+
+    @property
+    def failed(self) -> bool:
+        """The operation returned an error that is not ignored"""
+        return self.error is not None and not isinstance(self.error, self.ignore)
+
+
+class LDAPPipeline:
+    """
+    Submits independent operations on one connection without waiting for
+    each response, then collects the results by message id. N operations
+    cost about one round trip instead of N.
+    """
+
+    def __init__(self):
+        self.operations: List[LDAPOperation] = []
+
+    def add(self, dn: str, modlist: list, ignore=()) -> LDAPOperation:
+        return self._queue(LDAPOperation("add", dn, modlist, ignore))
+
+    def modify(self, dn: str, modlist: list, ignore=()) -> LDAPOperation:
+        return self._queue(LDAPOperation("modify", dn, modlist, ignore))
+
+    def _queue(self, operation: LDAPOperation) -> LDAPOperation:
+        self.operations.append(operation)
+        return operation
+
+    def execute(self, connection) -> List[LDAPOperation]:
+        """
+        Runs all queued operations. Errors are stored per operation,
+        connection errors and timeouts are raised since they fail the batch.
+        The operations stay queued, so running it again after such an error
+        sends the whole batch again
+        """
+        operations = self.operations
+        for operation in operations:
+            operation.msgid = None
+            operation.error = None
+        for operation in operations:
+            submit = (
+                connection.add_ext if operation.kind == "add" else connection.modify_ext
+            )
+            operation.started = time.perf_counter()
+            try:
+                operation.msgid = submit(operation.dn, operation.modlist)
+            except CONNECTION_ERRORS as e:
+                observe_ldap(operation.kind, operation.started, e)
+                raise
+            except ldap.LDAPError as e:
+                operation.error = e
+                observe_ldap(operation.kind, operation.started, e)
+
+        for operation in operations:
+            if operation.msgid is None:
+                continue
+            try:
+                connection.result3(
+                    operation.msgid, all=1, timeout=ldap_timeout.current()
+                )
+            except CONNECTION_ERRORS + (ldap.TIMEOUT,) as e:
+                observe_ldap(operation.kind, operation.started, e)
+                raise
+            except ldap.LDAPError as e:
+                operation.error = e
+            # Submitted together, so the latency includes waiting for earlier ones
+            observe_ldap(operation.kind, operation.started, operation.error)
+        return operations
@@ -0,0 +1,279 @@
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional
+
+import ldap
+
+from config import config
+from services.circuit_breaker import ldap_timeout
+from services.domain_controllers import (
+    FAILOVER_ERRORS,
+    DomainControllers,
+    domain_controllers,
+    open_connection,
+)
+from services.lifecycle import resources
+from services.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+# Errors after which a connection can not be reused and must be rebound
+CONNECTION_ERRORS = (ldap.SERVER_DOWN, ldap.CONNECT_ERROR)
+
+
+class PoolTimeout(ldap.TIMEOUT):
+    """No pooled connection became free within acquire_timeout"""
+
+
+class PooledConnection:
+    """Admin-bound LDAP connection with pool bookkeeping"""
+
+    def __init__(self, connection, url: str):
+        self.connection = connection
+        self.url = url
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+        self.last_checked = self.created_at
+
+
+class LDAPConnectionPool:
+    """Per-process pool of connections bound as the AD admin"""
+
+    def __init__(self, pool_config=None, dcs: Optional[DomainControllers] = None):
+        self.config = pool_config or config.ldap.pool
+        self.dcs = dcs or domain_controllers
+        self._idle: List[PooledConnection] = []
+        self._in_use: Dict[int, PooledConnection] = {}
+        self._size = 0
+        self._lock = threading.Condition()
+        self._waits = 0
+        self._wait_time = 0.0
+        self._created = 0
+        self._discarded = 0
+
+    def _open(self, prefer: Optional[str] = None) -> PooledConnection:
+        """Open a new connection to the best DC, failing over to the next ones"""
+        error = None
+        for url in self.dcs.ordered(prefer):
+            started = time.perf_counter()
+            try:
+                connection = open_connection(url, ldap_timeout.current())
+            except FAILOVER_ERRORS as e:
+                self.dcs.mark_down(url, e)
+                error = e
+                continue
+            self.dcs.mark_up(url, time.perf_counter() - started)
+            logger.debug("LDAP connection opened to %s", url)
+            return PooledConnection(connection, url)
+        raise error
+
+    @staticmethod
+    def _close(pooled: PooledConnection) -> None:
+        try:
+            pooled.connection.unbind_s()
+        except ldap.LDAPError:
+            pass
+
+    @staticmethod
+    def _is_alive(pooled: PooledConnection) -> bool:
+        """Liveness probe with the cheap WhoAmI extended operation"""
+        try:
+            pooled.connection.whoami_s()
+            return True
+        except ldap.LDAPError as e:
+            logger.debug("Pooled LDAP connection is dead: %s", e)
+            return False
+
+    def _evict_idle(self) -> List[PooledConnection]:
+        """Takes out connections idle for too long, keeping min_size open"""
+        now = time.monotonic()
+        evicted = []
+        for pooled in list(self._idle):
+            if self._size <= self.config.min_size:
+                break
+            if now - pooled.last_used > self.config.idle_timeout:
+                self._idle.remove(pooled)
+                self._size -= 1
+                evicted.append(pooled)
+        return evicted
+
+    def _take_idle(self, target: str) -> Optional[PooledConnection]:
+        """
+        An idle connection to the target DC. None if there is none and a new
+        one can be opened, any idle connection if the pool is full.
+        """
+        for index in range(len(self._idle) - 1, -1, -1):
+            if self._idle[index].url == target:
+                return self._idle.pop(index)
+        if self._size < self.config.max_size or not self._idle:
+            return None
+        return self._idle.pop()
+
+    def acquire(self, prefer: Optional[str] = None):
+        """Borrow a bound connection, waiting up to acquire_timeout"""
+        started = time.monotonic()
+        waited = False
+        while True:
+            # The fastest healthy DC, or the one that took the user's last write
+            target = self.dcs.ordered(prefer)[0]
+            with self._lock:
+                evicted = self._evict_idle()
+                pooled = self._take_idle(target)
+                if pooled is None and self._size < self.config.max_size:
+                    self._size += 1
+                elif pooled is None:
+                    remaining = self.config.acquire_timeout - (
+                        time.monotonic() - started
+                    )
+                    if remaining <= 0:
+                        raise PoolTimeout(
+                            {"desc": "Timed out waiting for a pooled LDAP connection"}
+                        )
+                    waited = True
+                    self._lock.wait(remaining)
+                    continue
+            for stale in evicted:
+                self._close(stale)
+
+            if pooled is None:
+                try:
+                    pooled = self._open(prefer)
+                except ldap.LDAPError:
+                    with self._lock:
+                        self._size -= 1
+                        self._lock.notify()
+                    raise
+                with self._lock:
+                    self._created += 1
+            elif not self.dcs.is_healthy(pooled.url):
+                self._discard(pooled)
+                continue
+            elif time.monotonic() - pooled.last_checked > self.config.check_interval:
+                # Connections to other DCs are replaced as they come up for a check
+                if pooled.url != target or not self._is_alive(pooled):
+                    self._discard(pooled)
+                    continue
+                pooled.last_checked = time.monotonic()
+
+            with self._lock:
+                self._in_use[id(pooled.connection)] = pooled
+                if waited:
+                    self._waits += 1
+                    self._wait_time += time.monotonic() - started
+            return pooled.connection
+
+    def url_of(self, connection) -> Optional[str]:
+        """DC of a borrowed connection"""
+        with self._lock:
+            pooled = self._in_use.get(id(connection))
+        return pooled.url if pooled else None
+
+    def release(self, connection, discard: bool = False) -> None:
+        """Return a connection to the pool, closing it if it is broken"""
+        with self._lock:
+            pooled = self._in_use.pop(id(connection), None)
+        if pooled is None:
+            return
+        if discard:
+            self._discard(pooled)
+            return
+        pooled.last_used = time.monotonic()
+        with self._lock:
+            self._idle.append(pooled)
+            self._lock.notify()
+
+    def _discard(self, pooled: PooledConnection) -> None:
+        self._close(pooled)
+        with self._lock:
+            self._size -= 1
+            self._discarded += 1
+            self._lock.notify()
+
+    def warmup(self) -> None:
+        """Open min_size connections in advance"""
+        connections = []
+        try:
+            while len(connections) < self.config.min_size:
+                connections.append(self.acquire())
+        except ldap.LDAPError as e:
+            logger.warning("LDAP pool warmup failed: %s", e)
+        finally:
+            for connection in connections:
+                self.release(connection)
+
+    def close(self) -> None:
+        """Close all idle connections"""
+        with self._lock:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for pooled in idle:
+            self._close(pooled)
+
+    def after_fork(self) -> None:
+        """Forgets the parent's connections, unbinding them would close its sockets"""
+        self._lock = threading.Condition()
+        self._idle, self._in_use, self._size = [], {}, 0
+
+    def stats(self) -> Dict[str, float]:
+        """Pool size and wait-time counters"""
+        with self._lock:
+            return {
+                "size": self._size,
+                "idle": len(self._idle),
+                "in_use": len(self._in_use),
+                "max_size": self.config.max_size,
+                "created": self._created,
+                "discarded": self._discarded,
+                "waits": self._waits,
+                "wait_time": round(self._wait_time, 6),
+            }
+
+
+ldap_pool = LDAPConnectionPool()
+
+
+def _new_executor() -> ThreadPoolExecutor:
+    # python-ldap calls block, so they run on a bounded executor off the event loop.
+    # It has as many threads as the pool has connections, so no thread waits twice
+    return ThreadPoolExecutor(
+        max_workers=config.ldap.pool.max_size, thread_name_prefix="ldap"
+    )
+
+
+ldap_executor = _new_executor()
+
+
+async def run_ldap(func: Callable[..., Any], *args, **kwargs) -> Any:
+    """Run blocking LDAP work on the LDAP executor"""
+    loop = asyncio.get_running_loop()
+    # Unlike asyncio.to_thread the executor does not pass on the context,
+    # the request's timing collector lives there
+    context = contextvars.copy_context()
+    return await loop.run_in_executor(
+        ldap_executor, functools.partial(context.run, func, *args, **kwargs)
+    )
+
+
+def submit_ldap(func: Callable[..., Any], *args) -> Future:
+    """Run blocking LDAP work on the LDAP executor without waiting for it"""
+    return ldap_executor.submit(func, *args)
+
+
+def _reset_after_fork() -> None:
+    global ldap_executor
+    ldap_pool.after_fork()
+    # Threads do not survive fork, the copy of an executor that started some
+    # would count them as idle and never run the work
+    ldap_executor = _new_executor()
+
+
+async def _close() -> None:
+    await run_ldap(ldap_pool.close)
+    ldap_executor.shutdown(wait=False)
+
+
+resources.register("ldap", after_fork=_reset_after_fork, close=_close)
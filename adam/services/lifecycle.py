@@ -0,0 +1,68 @@
+import inspect
+from typing import Any, Awaitable, Callable, List, Optional, Union
+
+from services.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class Resource:
+    """How a per-process resource is reset after fork and closed"""
+
+    def __init__(
+        self,
+        name: str,
+        after_fork: Optional[Callable[[], Any]] = None,
+        close: Optional[Callable[[], Union[Awaitable[Any], Any]]] = None,
+    ):
+        self.name = name
+        self.after_fork = after_fork
+        self.close = close
+
+
+class ResourceRegistry:
+    """
+    Connections, pools and threads every worker process must own. With
+    gunicorn's preload the modules creating them are imported in the master
+    and the workers inherit its copies. Modules register how to drop such a
+    copy without touching the master's sockets, called from the post_fork
+    hook, and how to close it when the worker stops.
+    """
+
+    def __init__(self):
+        self._resources: List[Resource] = []
+        self._closed = False
+
+    def register(
+        self,
+        name: str,
+        after_fork: Optional[Callable[[], Any]] = None,
+        close: Optional[Callable[[], Union[Awaitable[Any], Any]]] = None,
+    ) -> None:
+        self._resources.append(Resource(name, after_fork, close))
+
+    def after_fork(self) -> None:
+        """Runs in a new worker before it serves anything, in registration order"""
+        self._closed = False
+        for resource in self._resources:
+            if resource.after_fork is not None:
+                resource.after_fork()
+        logger.debug("Reset after fork: %s", ", ".join(r.name for r in self._resources))
+
+    async def close(self) -> None:
+        """Closes the resources once, in reverse registration order"""
+        if self._closed:
+            return
+        self._closed = True
+        for resource in reversed(self._resources):
+            if resource.close is None:
+                continue
+            try:
+                result = resource.close()
+                if inspect.isawaitable(result):
+                    await result
+            except Exception as e:
+                logger.error("Closing %s failed: %s", resource.name, e)
+
+
+resources = ResourceRegistry()
@@ -1,12 +1,104 @@
+import atexit
+import json
 import logging
+import os
+import queue
+import random
 import sys
-from logging.handlers import RotatingFileHandler
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from fastapi import Request
 from config import config
+from services.timing import current_timing
+
+LOG_FORMAT = "[%(asctime)s] [%(name)s] %(levelname)s %(message)s"
+DATE_FORMAT = "%Y-%m-%d %H:%M:%S"
 
 # Dictionary for storing already created loggers
 _loggers = {}
 
+# Attributes of every record, anything else was passed with extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {"message", "asctime"}
+
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line, fields passed with extra= become keys"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": self.formatTime(record, self.datefmt),
+            "logger": record.name,
+            "level": record.levelname,
+            "message": record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                entry[key] = value
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LocalQueueHandler(QueueHandler):
+    """
+    Puts records on the queue as they are. The stock prepare() formats the
+    message in the calling thread to make the record picklable, which is not
+    needed for a queue inside the process and is the work to move away from
+    the event loop. Arguments of a message are formatted later, so they must
+    not be changed after the logging call.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def _output_handlers() -> list:
+    """Handlers doing the actual formatting and I/O"""
+    if config.log.format == "json":
+        formatter = JSONFormatter(datefmt=DATE_FORMAT)
+    else:
+        formatter = logging.Formatter(LOG_FORMAT, datefmt=DATE_FORMAT)
+
+    # Handler for stdout/stderr
+    handlers = [logging.StreamHandler(sys.stdout)]
+    # Handler for file
+    if config.log.file is True:
+        handlers.append(
+            RotatingFileHandler(
+                config.log.path, maxBytes=10 * 1024 * 1024, backupCount=5
+            )
+        )
+    for handler in handlers:
+        handler.setFormatter(formatter)
+    return handlers
+
+
+_handlers = _output_handlers()
+_queue_handler = None
+_listener = None
+
+
+def _start_listener() -> None:
+    global _listener
+    # A fresh queue, the parent's one may have been locked at fork time
+    _queue_handler.queue = queue.SimpleQueue()
+    _listener = QueueListener(_queue_handler.queue, *_handlers)
+    _listener.start()
+
+
+def _stop_listener() -> None:
+    """Writes out the queued records"""
+    if _listener is not None and _listener._thread is not None:
+        _listener.stop()
+
+
+if config.log.queue:
+    _queue_handler = LocalQueueHandler(queue.SimpleQueue())
+    _start_listener()
+    # Threads do not survive fork, every gunicorn worker starts its own listener
+    os.register_at_fork(after_in_child=_start_listener)
+    atexit.register(_stop_listener)
+
 
 def get_logger(name: str) -> logging.Logger:
     """Returns the configured logger with the specified name"""
@@ -19,62 +111,89 @@ def get_logger(name: str) -> logging.Logger:
 
     # Check if the handlers have already been added to avoid duplicates
     if not logger.handlers:
-        # Logs format
-        log_format = logging.Formatter(
-            "[%(asctime)s] [%(name)s] %(levelname)s %(message)s",
-            datefmt="%Y-%m-%d %H:%M:%S",
-        )
-
-        # Handler for stdout/stderr
-        console_handler = logging.StreamHandler(sys.stdout)
-        console_handler.setFormatter(log_format)
-        logger.addHandler(console_handler)
-
-        # Handler for file
-        if config.log.file is True:
-            file_handler = RotatingFileHandler(
-                config.log.path, maxBytes=10 * 1024 * 1024, backupCount=5
-            )
-            file_handler.setFormatter(log_format)
-            logger.addHandler(file_handler)
+        if _queue_handler is not None:
+            logger.addHandler(_queue_handler)
+        else:
+            for handler in _handlers:
+                logger.addHandler(handler)
 
     _loggers[name] = logger
     return logger
 
 
+access_logger = get_logger("http")
+
+EXCLUDED_PATHS = ("/static", "/health", "/api/health", "/ready", "/api/ready")
+EXCLUDED_FILES = ("/favicon.ico", "/openapi.json", "/metrics")
+
+# Longest prefix first, so a route can override the rate of its parent
+_access_sample = sorted(
+    config.log.access_sample.items(), key=lambda item: len(item[0]), reverse=True
+)
+
+
+def _sampled_out(path: str) -> bool:
+    for prefix, rate in _access_sample:
+        if path.startswith(prefix):
+            return random.random() >= rate
+    return False
+
+
 async def log_requests_middleware(request: Request, call_next):
     """Middleware for logging HTTP requests"""
-    logger = get_logger("http")
-    client_ip = request.client.host
-    method = request.method
     path = request.url.path
-
-    excluded_paths = [
-        "/static",
-        "/health",
-        "/api/health",
-    ]
-    excluded_files = [
-        "/favicon.ico",
-        "/openapi.json",
-    ]
-
-    should_log = not (
-        any(path.startswith(excluded_path) for excluded_path in excluded_paths)
-        or path in excluded_files
+    should_log = access_logger.isEnabledFor(logging.INFO) and not (
+        path.startswith(EXCLUDED_PATHS) or path in EXCLUDED_FILES
     )
+    if not should_log:
+        return await call_next(request)
 
+    client_ip = request.client.host
+    method = request.method
+    started = time.perf_counter()
     try:
         response = await call_next(request)
-        if should_log:
-            status_code = response.status_code
-            logger.info(f'{client_ip} "{method} {path} HTTP/1.1" {status_code}')
-        return response
     except Exception as e:
-        if should_log:
-            logger.error(f'{client_ip} "{method} {path} HTTP/1.1" 500 - {str(e)}')
+        access_logger.error(
+            '%s "%s %s HTTP/1.1" 500 - %s',
+            client_ip,
+            method,
+            path,
+            e,
+            extra=_access_fields(client_ip, method, path, 500, started),
+        )
         raise
 
+    status_code = response.status_code
+    # Errors are always logged, successful requests of busy routes may be sampled
+    if status_code >= 400 or not _sampled_out(path):
+        access_logger.info(
+            '%s "%s %s HTTP/1.1" %s',
+            client_ip,
+            method,
+            path,
+            status_code,
+            extra=_access_fields(client_ip, method, path, status_code, started),
+        )
+    return response
+
+
+def _access_fields(
+    client_ip: str, method: str, path: str, status_code: int, started: float
+) -> dict:
+    """Fields of an access log line, keys of the JSON format"""
+    fields = {
+        "client": client_ip,
+        "method": method,
+        "path": path,
+        "status": status_code,
+        "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+    }
+    timing = current_timing()
+    if timing is not None:
+        fields["timing"] = timing.summary()
+    return fields
+
 
 def setup_logging():
     """Configures centralized logging for the application"""
@@ -0,0 +1,196 @@
+import os
+import time
+from typing import Callable, Optional
+
+from fastapi import Request, Response
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from services.timing import phase, record
+
+# Set by gunicorn.conf.py before the application is imported. Every worker
+# then writes its samples to files in this directory and /metrics of any
+# worker adds them up; without it metrics cover the serving process only
+MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR")
+
+HTTP_REQUESTS = Counter(
+    "adam_http_requests_total",
+    "HTTP requests by route and status code",
+    ["method", "route", "status"],
+)
+HTTP_REQUEST_SECONDS = Histogram(
+    "adam_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ["method", "route"],
+)
+HTTP_IN_PROGRESS = Gauge(
+    "adam_http_requests_in_progress",
+    "HTTP requests being served by route",
+    ["method", "route"],
+    multiprocess_mode="livesum",
+)
+LDAP_OPERATION_SECONDS = Histogram(
+    "adam_ldap_operation_duration_seconds",
+    "LDAP operation latency by operation and result code",
+    ["operation", "result"],
+)
+LDAP_DC_UP = Gauge(
+    "adam_ldap_dc_up",
+    "Whether a domain controller takes new connections",
+    ["url"],
+    multiprocess_mode="livemostrecent",
+)
+LDAP_DC_BIND_SECONDS = Gauge(
+    "adam_ldap_dc_bind_seconds",
+    "Latest admin bind latency of a domain controller",
+    ["url"],
+    multiprocess_mode="livemostrecent",
+)
+LDAP_CIRCUIT_STATE = Gauge(
+    "adam_ldap_circuit_state",
+    "Circuit breaker around AD: 0 closed, 1 half-open, 2 open",
+    multiprocess_mode="livemax",
+)
+LDAP_CIRCUIT_REJECTED = Counter(
+    "adam_ldap_circuit_rejected_total",
+    "AD calls failed at once because the circuit was open",
+)
+LDAP_TIMEOUT_SECONDS = Gauge(
+    "adam_ldap_timeout_seconds",
+    "LDAP operation timeout derived from recent latency",
+    multiprocess_mode="livemax",
+)
+DB_QUERY_SECONDS = Histogram(
+    "adam_db_query_duration_seconds",
+    "Database statement latency by engine and statement type",
+    ["engine", "statement"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0),
+)
+DB_POOL_CONNECTIONS = Gauge(
+    "adam_db_pool_connections",
+    "Database connections held by the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "adam_db_pool_checked_out",
+    "Database connections checked out of the pool",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+FERNET_OPERATIONS = Counter(
+    "adam_fernet_operations_total",
+    "Fernet operations on stored passwords",
+    ["operation", "result"],
+)
+SINGLE_FLIGHT_CALLS = Counter(
+    "adam_single_flight_calls_total",
+    "Account creations and password resets by whether they did the LDAP work",
+    ["operation", "role"],
+)
+JOB_SECONDS = Histogram(
+    "adam_job_duration_seconds",
+    "Time from queueing to the end of background jobs by result",
+    ["operation", "status"],
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0),
+)
+
+
+def ldap_result(error: Optional[Exception]) -> str:
+    """Result code label, python-ldap has an exception class per code"""
+    return "success" if error is None else type(error).__name__
+
+
+def observe_ldap(operation: str, started: float, error: Optional[Exception]) -> None:
+    LDAP_OPERATION_SECONDS.labels(operation, ldap_result(error)).observe(
+        time.perf_counter() - started
+    )
+
+
+def timed_ldap(operation: str, func: Callable, *args):
+    """Calls a blocking LDAP function and records its latency and result"""
+    with phase(f"ldap-{operation}"):
+        started = time.perf_counter()
+        try:
+            result = func(*args)
+        except Exception as e:
+            observe_ldap(operation, started, e)
+            raise
+        observe_ldap(operation, started, None)
+        return result
+
+
+def instrument_engine(engine: Engine, name: str) -> None:
+    """Records statement latency and pool usage of a synchronous engine"""
+
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        context._metrics_started = time.perf_counter()
+
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        kind = statement.lstrip().split(None, 1)[0].upper() if statement else ""
+        elapsed = time.perf_counter() - context._metrics_started
+        DB_QUERY_SECONDS.labels(name, kind).observe(elapsed)
+        record("db", elapsed)
+
+    pool_connections = DB_POOL_CONNECTIONS.labels(name)
+    checked_out = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(engine, "before_cursor_execute", before_execute)
+    event.listen(engine, "after_cursor_execute", after_execute)
+    event.listen(engine, "connect", lambda *args: pool_connections.inc())
+    event.listen(engine, "close", lambda *args: pool_connections.dec())
+    event.listen(engine, "detach", lambda *args: pool_connections.dec())
+    event.listen(engine, "checkout", lambda *args: checked_out.inc())
+    event.listen(engine, "checkin", lambda *args: checked_out.dec())
+
+
+def _route(request: Request) -> str:
+    """Path template of the matching route, keeps ids out of the labels"""
+    # Only the patterns are checked, Route.matches also converts path params
+    path = request.scope["path"]
+    method = request.method
+    for route in request.app.router.routes:
+        if route.path_regex.match(path):
+            methods = getattr(route, "methods", None)
+            if methods is None or method in methods:
+                return route.path
+    return "unmatched"
+
+
+async def metrics_middleware(request: Request, call_next):
+    """Middleware recording latency, status and concurrency per route"""
+    method = request.method
+    route = _route(request)
+    in_progress = HTTP_IN_PROGRESS.labels(method, route)
+    in_progress.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        HTTP_REQUEST_SECONDS.labels(method, route).observe(
+            time.perf_counter() - started
+        )
+        HTTP_REQUESTS.labels(method, route, str(status_code)).inc()
+        in_progress.dec()
+
+
+def render_metrics() -> Response:
+    """Metrics of all workers in the Prometheus text format"""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), media_type=CONTENT_TYPE_LATEST)
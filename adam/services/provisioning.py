@@ -0,0 +1,74 @@
+from typing import Dict, List, Tuple
+
+from ldap.dn import dn2str, str2dn
+
+from config import config, LDAPConfig
+from schemas.ldap import LDAPUserAttributes
+from services.cache import TTLCache
+from services.utils import generate_password
+
+
+class ProvisioningPlan:
+    """Account creation data that depends only on the config, compiled once"""
+
+    def __init__(self, ldap_config: LDAPConfig):
+        self.users_dn = ldap_config.default_users_dn
+        rdns = str2dn(self.users_dn)
+        # Positions of the OUs of default_users_dn, parents first. By
+        # position, as OU names may repeat along the path
+        ous = [i for i in reversed(range(len(rdns))) if rdns[i][0][0].upper() == "OU"]
+        # Every OU and the DN of its parent
+        self.ou_chain: List[Tuple[str, str]] = [
+            (rdns[i][0][1], dn2str(rdns[i + 1 :])) for i in ous
+        ]
+        self._ou_dns = [dn2str(rdns[i:]) for i in ous]
+        defaults = LDAPUserAttributes.model_fields
+        self.object_class_names = defaults["objectClass"].default
+        self.object_class = [oc.encode("utf-8") for oc in self.object_class_names]
+        self.user_account_control_value = defaults["userAccountControl"].default
+        self.user_account_control = self.user_account_control_value.encode("utf-8")
+        self.group_dns: List[str] = list(ldap_config.member_of_groups or [])
+        # Until then group adds validate them first, e.g. AD was down at startup
+        self.groups_validated = False
+
+    def ou_dns(self) -> List[str]:
+        return list(self._ou_dns)
+
+    def user_attributes(self, attributes: LDAPUserAttributes) -> Dict[str, object]:
+        """LDAP attributes of a new user, reusing the pre-encoded constants"""
+        object_class = (
+            self.object_class
+            if attributes.objectClass == self.object_class_names
+            else [oc.encode("utf-8") for oc in attributes.objectClass]
+        )
+        user_account_control = (
+            self.user_account_control
+            if attributes.userAccountControl == self.user_account_control_value
+            else attributes.userAccountControl.encode("utf-8")
+        )
+        return {
+            "objectClass": object_class,
+            "cn": attributes.cn.encode("utf-8"),
+            "sAMAccountName": attributes.sAMAccountName.encode("utf-8"),
+            "userPrincipalName": attributes.userPrincipalName.encode("utf-8"),
+            "mail": attributes.mail.encode("utf-8"),
+            "unicodePwd": f'"{attributes.password}"'.encode("utf-16-le"),
+            "userAccountControl": user_account_control,
+        }
+
+
+provisioning_plan = ProvisioningPlan(config.ldap)
+
+# DNs confirmed to exist in AD, so steady-state creation skips their round trips
+known_dns = TTLCache(maxsize=1024, ttl=config.ldap.known_dn_ttl)
+
+
+def build_user_attributes(username: str, email: str) -> LDAPUserAttributes:
+    """Attributes of a new AD account with a generated password"""
+    return LDAPUserAttributes(
+        cn=username,
+        sAMAccountName=username,
+        userPrincipalName=f"{username}@{config.ldap.domain}",
+        mail=email,
+        password=generate_password(),
+    )
@@ -0,0 +1,138 @@
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from sqlalchemy import text
+
+from config import config
+from models.database import async_engine, head_revision
+from services.ad_service import ADService
+from services.circuit_breaker import ldap_breaker
+from services.domain_controllers import domain_controllers
+from services.ldap_pool import run_ldap
+from services.logging_config import get_logger
+
+logger = get_logger(__name__)
+
+
+class ProbeResult:
+    """Outcome of one probe run"""
+
+    def __init__(
+        self, ok: bool, latency: float, error: Optional[str] = None, **details: Any
+    ):
+        self.ok = ok
+        self.latency = latency
+        self.error = error
+        self.details = details
+        self.checked_at = time.monotonic()
+
+
+class Probe:
+    """
+    Dependency check run in the background every interval seconds. Requests
+    only read the latest result, so a load balancer polling /ready never
+    causes LDAP or database traffic of its own.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        check: Callable[[], Awaitable[Optional[Dict[str, Any]]]],
+        interval: float,
+    ):
+        self.name = name
+        self.check = check
+        self.interval = interval
+        self.result: Optional[ProbeResult] = None
+
+    async def run_once(self) -> ProbeResult:
+        started = time.perf_counter()
+        try:
+            details = await asyncio.wait_for(self.check(), config.ready.timeout)
+            result = ProbeResult(True, time.perf_counter() - started, **(details or {}))
+        except Exception as e:
+            # HTTPException of ADService carries the LDAP error in detail
+            error = getattr(e, "detail", None) or str(e) or type(e).__name__
+            result = ProbeResult(False, time.perf_counter() - started, error)
+            # Logged once per outage, not on every run
+            if self.result is None or self.result.ok:
+                logger.warning("Readiness probe '%s' failed: %s", self.name, error)
+        else:
+            if self.result is not None and not self.result.ok:
+                logger.info("Readiness probe '%s' recovered", self.name)
+        self.result = result
+        return result
+
+    async def run(self) -> None:
+        while True:
+            await self.run_once()
+            await asyncio.sleep(self.interval)
+
+    def status(self, now: float) -> Dict[str, Any]:
+        """Latest result with its age, ok only while it is fresh"""
+        if self.result is None:
+            return {"ok": False, "error": "pending"}
+        result = self.result
+        age = now - result.checked_at
+        max_age = self.interval * config.ready.stale_intervals + config.ready.timeout
+        status = {
+            "ok": result.ok and age <= max_age,
+            "latency_ms": round(result.latency * 1000, 2),
+            "age_s": round(age, 1),
+            **result.details,
+        }
+        if result.error:
+            status["error"] = result.error
+        elif age > max_age:
+            status["error"] = "stale"
+        return status
+
+
+async def check_ldap() -> Dict[str, Any]:
+    """rootDSE read over a pooled admin connection, binds if the pool is empty"""
+    await run_ldap(ADService().read_root_dse)
+    if len(domain_controllers.dcs) > 1:
+        return {"dcs": domain_controllers.status()}
+    return {}
+
+
+async def check_database() -> None:
+    async with async_engine.connect() as connection:
+        await connection.execute(text("SELECT 1"))
+
+
+async def check_migrations() -> Dict[str, Any]:
+    """The database is at the newest revision this code knows about"""
+    head = await asyncio.to_thread(head_revision)
+    async with async_engine.connect() as connection:
+        revision = await connection.scalar(
+            text("SELECT version_num FROM alembic_version")
+        )
+    if revision != head:
+        raise RuntimeError(f"Database is at revision {revision}, expected {head}")
+    return {"revision": revision}
+
+
+probes: List[Probe] = [
+    Probe("ldap", check_ldap, config.ready.ldap_interval),
+    Probe("database", check_database, config.ready.db_interval),
+    Probe("migrations", check_migrations, config.ready.migrations_interval),
+]
+
+
+def start_probes() -> List[asyncio.Task]:
+    """Starts the probe loops of this worker, cancel the tasks on shutdown"""
+    return [asyncio.create_task(probe.run()) for probe in probes]
+
+
+def readiness() -> Dict[str, Any]:
+    """Latest probe results, ready when every probe passed recently"""
+    now = time.monotonic()
+    statuses = {probe.name: probe.status(now) for probe in probes}
+    ready = all(status["ok"] for status in statuses.values())
+    return {
+        "status": "ready" if ready else "not ready",
+        "probes": statuses,
+        "ldap_circuit": ldap_breaker.status(),
+    }
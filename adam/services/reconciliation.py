@@ -0,0 +1,313 @@
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from ldap.dn import AVA_STRING, dn2str, str2dn
+from sqlalchemy import func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from config import config
+from models.ldap_accounts import LDAPAccount
+from models.reconciliation import AccountDrift, ReconciliationRun
+from services.ad_service import ADService
+from services.logging_config import get_logger
+from services.utils import normalize_dn
+
+logger = get_logger(__name__)
+
+# User objects, as the service creates them
+USERS_FILTER = "(&(objectCategory=person)(objectClass=user))"
+# Tombstones lose objectCategory, objectClass stays
+CHANGES_FILTER = "(&(objectClass=user)(uSNChanged>={usn}))"
+ATTRIBUTES = ["sAMAccountName", "userAccountControl", "uSNChanged", "isDeleted"]
+ACCOUNTDISABLE = 0x2
+# Principals per IN query
+CHUNK_SIZE = 500
+
+accounts = LDAPAccount.__table__
+runs = ReconciliationRun.__table__
+drift = AccountDrift.__table__
+
+
+def _first(entry: dict, attribute: str) -> Optional[str]:
+    values = entry.get(attribute)
+    return values[0].decode("utf-8") if values else None
+
+
+def _chunks(items: List, size: int = CHUNK_SIZE) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def classify(dn: str, entry: dict) -> Tuple[str, Optional[str]]:
+    """sAMAccountName of an AD entry and its kind of drift, None if it matches"""
+    username = _first(entry, "sAMAccountName")
+    if (_first(entry, "isDeleted") or "").upper() == "TRUE":
+        return username, "deleted"
+    # The configured DN may be spaced or escaped differently than AD returns it
+    expected = [[("CN", username or "", AVA_STRING)]]
+    expected += str2dn(config.ldap.default_users_dn)
+    if normalize_dn(dn) != dn2str(expected).lower():
+        return username, "moved"
+    if int(_first(entry, "userAccountControl") or 0) & ACCOUNTDISABLE:
+        return username, "disabled"
+    return username, None
+
+
+class Reconciler:
+    """
+    Compares the account records with AD. A full run pages through every user
+    object; later runs ask the DC only for objects with a uSNChanged above
+    the highestCommittedUSN it reported at the start of the previous run,
+    including tombstones of deleted ones. USNs are local to a DC, so every DC
+    has its own watermark and a run prefers the DC of the last one.
+    Differences are kept as drift rows until a run sees the account match.
+    """
+
+    def __init__(
+        self,
+        db: Session,
+        ad_service: Optional[ADService] = None,
+        page_size: Optional[int] = None,
+    ):
+        self.db = db
+        self.ad = ad_service or ADService()
+        self.page_size = page_size or config.reconcile.page_size
+
+    def _last_run(self, dc_url: Optional[str] = None, mode: Optional[str] = None):
+        query = (
+            select(runs)
+            .where(runs.c.finished_at.is_not(None), runs.c.error.is_(None))
+            .order_by(runs.c.id.desc())
+            .limit(1)
+        )
+        if dc_url is not None:
+            query = query.where(runs.c.dc_url == dc_url)
+        if mode is not None:
+            query = query.where(runs.c.mode == mode)
+        return self.db.execute(query).first()
+
+    def _mode(self, full: bool, dc_url: str, highest: int) -> Tuple[str, Optional[int]]:
+        """full or incremental, and the watermark of the latter"""
+        if full:
+            return "full", None
+        previous = self._last_run(dc_url)
+        if previous is None:
+            logger.info("No reconciliation on %s yet, running a full one", dc_url)
+            return "full", None
+        if previous.usn > highest:
+            # Restored from a backup, the USNs since are not the same changes
+            logger.warning("USN of %s went back, running a full reconciliation", dc_url)
+            return "full", None
+        last_full = self._last_run(mode="full")
+        interval = timedelta(seconds=config.reconcile.full_interval)
+        if last_full is None or last_full.started_at < datetime.now() - interval:
+            return "full", None
+        return "incremental", previous.usn
+
+    def run(self, full: bool = False) -> Dict[str, object]:
+        """Runs a reconciliation, returns the stored run as a dict"""
+        previous = self._last_run()
+        self.ad.connect(prefer=previous.dc_url if previous else None)
+        try:
+            dc_url = self.ad.url
+            highest = self.ad.highest_usn()
+            mode, watermark = self._mode(full, dc_url, highest)
+            run_id = self.db.execute(
+                insert(runs).values(
+                    mode=mode,
+                    dc_url=dc_url,
+                    usn=highest,
+                    started_at=datetime.now(),
+                    entries=0,
+                    pages=0,
+                    found=0,
+                    resolved=0,
+                )
+            ).inserted_primary_key[0]
+            self.db.commit()
+
+            stats = {"entries": 0, "pages": 0, "found": 0, "resolved": 0}
+            started = time.perf_counter()
+            try:
+                if mode == "full":
+                    seen = self._scan(run_id, dc_url, USERS_FILTER, False, stats)
+                    self._mark_missing(run_id, seen, stats)
+                else:
+                    filterstr = CHANGES_FILTER.format(usn=watermark + 1)
+                    self._scan(run_id, dc_url, filterstr, True, stats)
+            except Exception as e:
+                self.db.rollback()
+                self._finish(run_id, stats, error=str(e))
+                logger.error("Reconciliation with %s failed: %s", dc_url, e)
+                raise
+            self._finish(run_id, stats)
+        finally:
+            self.ad.disconnect()
+
+        logger.info(
+            "%s reconciliation with %s: %s entries in %s pages, "
+            "%s new drift, %s resolved, %.1fs",
+            mode.capitalize(),
+            dc_url,
+            stats["entries"],
+            stats["pages"],
+            stats["found"],
+            stats["resolved"],
+            time.perf_counter() - started,
+        )
+        row = self.db.execute(select(runs).where(runs.c.id == run_id)).first()
+        self.db.commit()
+        return dict(row._mapping)
+
+    def _finish(self, run_id: int, stats: Dict[str, int], error=None) -> None:
+        self.db.execute(
+            update(runs)
+            .where(runs.c.id == run_id)
+            .values(finished_at=datetime.now(), error=error, **stats)
+        )
+        self.db.commit()
+
+    def _scan(
+        self,
+        run_id: int,
+        dc_url: str,
+        filterstr: str,
+        show_deleted: bool,
+        stats: Dict[str, int],
+    ) -> Set[str]:
+        """Compares every page of the search, returns the principals seen"""
+        seen = set()
+        pages = self.ad.paged_search(
+            config.ldap.base_dn, filterstr, ATTRIBUTES, self.page_size, show_deleted
+        )
+        for entries in pages:
+            if self.ad.url != dc_url:
+                # The paging cookie and the watermark belong to the first DC
+                raise RuntimeError(f"Failed over from {dc_url} during the search")
+            stats["pages"] += 1
+            stats["entries"] += len(entries)
+            statuses = {}
+            for dn, entry in entries:
+                username, kind = classify(dn, entry)
+                if username is None:
+                    continue
+                # A tombstone and a live account with the same name, the live one counts
+                if kind == "deleted" and username in statuses:
+                    continue
+                statuses[username] = (kind, None if kind == "deleted" else dn)
+            seen.update(statuses)
+            for chunk in _chunks(list(statuses)):
+                known = self.db.scalars(
+                    select(accounts.c.kadmin_principal).where(
+                        accounts.c.kadmin_principal.in_(chunk)
+                    )
+                ).all()
+                self._apply(run_id, {name: statuses[name] for name in known}, stats)
+        return seen
+
+    def _mark_missing(self, run_id: int, seen: Set[str], stats: Dict[str, int]) -> None:
+        """Accounts a full sweep did not find in AD at all"""
+        after = ""
+        while True:
+            principals = self.db.scalars(
+                select(accounts.c.kadmin_principal)
+                .where(accounts.c.kadmin_principal > after)
+                .order_by(accounts.c.kadmin_principal)
+                .limit(CHUNK_SIZE)
+            ).all()
+            if not principals:
+                return
+            after = principals[-1]
+            missing = {
+                name: ("missing", None) for name in principals if name not in seen
+            }
+            if missing:
+                # Users are searched without tombstones, a known deletion stays one
+                missing.update(
+                    (name, ("deleted", None))
+                    for name in self.db.scalars(
+                        select(drift.c.kadmin_principal).where(
+                            drift.c.kadmin_principal.in_(list(missing)),
+                            drift.c.kind == "deleted",
+                            drift.c.resolved_at.is_(None),
+                        )
+                    )
+                )
+                self._apply(run_id, missing, stats)
+            else:
+                self.db.commit()
+
+    def _apply(
+        self,
+        run_id: int,
+        statuses: Dict[str, Tuple[Optional[str], Optional[str]]],
+        stats: Dict[str, int],
+    ) -> None:
+        """Opens drift for new differences and resolves drift that no longer holds"""
+        if not statuses:
+            return
+        now = datetime.now()
+        open_drift = self.db.execute(
+            select(drift.c.id, drift.c.kadmin_principal, drift.c.kind).where(
+                drift.c.kadmin_principal.in_(list(statuses)),
+                drift.c.resolved_at.is_(None),
+            )
+        ).all()
+        resolved = [
+            row.id
+            for row in open_drift
+            if statuses[row.kadmin_principal][0] != row.kind
+        ]
+        still_open = {(row.kadmin_principal, row.kind) for row in open_drift}
+        found = [
+            {
+                "kadmin_principal": name,
+                "kind": kind,
+                "ad_dn": dn,
+                "run_id": run_id,
+                "detected_at": now,
+            }
+            for name, (kind, dn) in statuses.items()
+            if kind is not None and (name, kind) not in still_open
+        ]
+        if resolved:
+            self.db.execute(
+                update(drift).where(drift.c.id.in_(resolved)).values(resolved_at=now)
+            )
+        if found:
+            self.db.execute(insert(drift), found)
+        self.db.commit()
+        stats["resolved"] += len(resolved)
+        stats["found"] += len(found)
+
+
+async def drift_report(db: AsyncSession, limit: int = 1000) -> Dict[str, object]:
+    """Open drift, newest first, its counts per kind and the latest run per DC"""
+    counts = (
+        await db.execute(
+            select(drift.c.kind, func.count())
+            .where(drift.c.resolved_at.is_(None))
+            .group_by(drift.c.kind)
+        )
+    ).all()
+    rows = (
+        await db.execute(
+            select(drift)
+            .where(drift.c.resolved_at.is_(None))
+            .order_by(drift.c.id.desc())
+            .limit(limit)
+        )
+    ).all()
+    latest = select(func.max(runs.c.id)).group_by(runs.c.dc_url)
+    run_rows = (
+        await db.execute(
+            select(runs).where(runs.c.id.in_(latest)).order_by(runs.c.dc_url)
+        )
+    ).all()
+    return {
+        "counts": {kind: count for kind, count in counts},
+        "drift": [dict(row._mapping) for row in rows],
+        "runs": [dict(row._mapping) for row in run_rows],
+    }
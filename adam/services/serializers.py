@@ -0,0 +1,50 @@
+from operator import attrgetter
+from typing import Any, Callable, Dict, Optional, Type
+
+from pydantic import BaseModel
+
+from schemas import SSOUserResponse
+from schemas.jobs import JobResponse
+from schemas.ldap import LDAPAccountDisplay, LDAPAccountResponse
+from services.encryption import encryptor
+
+
+class ModelSerializer:
+    """
+    Turns ORM objects into plain dicts shaped like a response model.
+    Attribute names, response keys and converters are resolved once at import,
+    so a response costs one attrgetter call and a zip instead of column
+    introspection and a walk through jsonable_encoder.
+    """
+
+    def __init__(
+        self,
+        schema: Type[BaseModel],
+        converters: Optional[Dict[str, Callable[[Any], Any]]] = None,
+    ):
+        fields = schema.model_fields
+        self._get = attrgetter(*fields)
+        self._keys = tuple(field.alias or name for name, field in fields.items())
+        self._converters = tuple(
+            (index, converters[name])
+            for index, name in enumerate(fields)
+            if converters and name in converters
+        )
+
+    def __call__(self, obj: Any) -> Dict[str, Any]:
+        values = self._get(obj)
+        if self._converters:
+            values = list(values)
+            for index, convert in self._converters:
+                values[index] = convert(values[index])
+        return dict(zip(self._keys, values))
+
+
+# Passwords are decrypted while serializing, they are stored encrypted
+_password = {"kadmin_password": encryptor.reveal_password}
+
+# Password still encrypted, the account cache decrypts it for each response
+serialize_ldap_account_row = ModelSerializer(LDAPAccountResponse)
+serialize_ldap_account_display = ModelSerializer(LDAPAccountDisplay, _password)
+serialize_sso_user = ModelSerializer(SSOUserResponse)
+serialize_job = ModelSerializer(JobResponse)
@@ -0,0 +1,301 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Optional, Set, Tuple
+from uuid import uuid4
+
+from fastapi import HTTPException
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import config
+from models.database import AsyncSessionLocal
+from models.leases import OperationLease
+from services.logging_config import get_logger
+from services.metrics import SINGLE_FLIGHT_CALLS
+
+logger = get_logger(__name__)
+
+# Shared outcome of an operation, what every duplicate caller gets back
+Outcome = Dict[str, object]
+
+
+def _outcome(
+    status_code: int, detail: str, headers: Optional[Dict[str, str]] = None
+) -> Outcome:
+    outcome = {"status_code": status_code, "detail": detail}
+    if headers:
+        # Retry-After of a 503 while the AD circuit is open
+        outcome["headers"] = headers
+    return outcome
+
+
+def lease_key(operation: str, user_id: str) -> str:
+    return f"{operation}:{user_id}"
+
+
+def _replay(outcome: Outcome) -> str:
+    """Message of a successful outcome, the HTTPException of a failed one"""
+    if outcome["status_code"] != 200:
+        raise HTTPException(
+            status_code=outcome["status_code"],
+            detail=outcome["detail"],
+            headers=outcome.get("headers"),
+        )
+    return outcome["detail"]
+
+
+class SingleFlight:
+    """
+    Runs one call per operation and user at a time, duplicates wait for it
+    and get its outcome instead of repeating the LDAP work. Callers in this
+    worker share a task; other workers see the lease row the running call
+    holds in the database, poll it and read the outcome stored there. The
+    leader renews the lease while the call runs, so it expires only if the
+    leader's worker died. The outcome is the success message or the
+    HTTPException of the call, so passwords never leave the account records.
+    """
+
+    def __init__(self):
+        self._tasks: Dict[str, asyncio.Task] = {}
+
+    async def run(
+        self, operation: str, user_id: str, func: Callable[[], Awaitable[str]]
+    ) -> str:
+        key = lease_key(operation, user_id)
+        task = self._tasks.get(key)
+        if task is None:
+            # A task of its own, so a client disconnecting does not cancel
+            # the operation others are waiting for
+            task = asyncio.create_task(self._run(operation, key, func))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _: self._tasks.pop(key, None))
+        else:
+            SINGLE_FLIGHT_CALLS.labels(operation, "waiter").inc()
+        return await asyncio.shield(task)
+
+    async def _run(
+        self, operation: str, key: str, func: Callable[[], Awaitable[str]]
+    ) -> str:
+        owner = uuid4().hex
+        acquired, outcome = await self._claim(key, owner, waiting=False)
+        if not acquired:
+            SINGLE_FLIGHT_CALLS.labels(operation, "follower").inc()
+        while not acquired and outcome is None:
+            await asyncio.sleep(config.provisioning.poll_interval)
+            acquired, outcome = await self._claim(key, owner, waiting=True)
+        if outcome is not None:
+            logger.info("Reusing the result of a concurrent %s", key)
+            return _replay(outcome)
+
+        SINGLE_FLIGHT_CALLS.labels(operation, "leader").inc()
+        try:
+            outcome = _outcome(200, await self._holding(key, owner, func))
+        except HTTPException as e:
+            outcome = _outcome(e.status_code, e.detail, e.headers)
+        except BaseException:
+            # Nothing to share, the next caller tries again
+            await self._release(key, owner)
+            raise
+        await self._finish(key, owner, outcome)
+        return _replay(outcome)
+
+    async def _holding(
+        self, key: str, owner: str, func: Callable[[], Awaitable[str]]
+    ) -> str:
+        """Runs func, renewing the lease until it returns"""
+        heartbeat = asyncio.create_task(self._renew(key, owner))
+        try:
+            return await func()
+        finally:
+            heartbeat.cancel()
+
+    async def _renew(self, key: str, owner: str) -> None:
+        """
+        Extends the lease three times per lease_ttl, so waits for the LDAP
+        pool, timeouts and failover never let another worker take over an
+        operation that is still running. Only a leader that died stops this
+        """
+        ttl = config.provisioning.lease_ttl
+        while True:
+            await asyncio.sleep(ttl / 3)
+            try:
+                async with AsyncSessionLocal() as db:
+                    result = await db.execute(
+                        update(OperationLease)
+                        .where(
+                            OperationLease.key == key,
+                            OperationLease.owner == owner,
+                            OperationLease.outcome.is_(None),
+                        )
+                        .values(expires_at=time.time() + ttl)
+                    )
+                    await db.commit()
+            except Exception as e:
+                logger.warning("Lease of %s not renewed: %s", key, e)
+                continue
+            if result.rowcount == 0:
+                logger.warning("Lease of %s was taken over while running", key)
+                return
+
+    async def _claim(
+        self, key: str, owner: str, waiting: bool
+    ) -> Tuple[bool, Optional[Outcome]]:
+        """
+        Takes the lease unless an operation holds it. A caller that has been
+        waiting gets the outcome of the finished operation instead; one that
+        just arrived starts a new operation, a later request is not a duplicate.
+        """
+        now = time.time()
+        async with AsyncSessionLocal() as db:
+            lease = await db.get(OperationLease, key)
+            if lease is not None:
+                if lease.outcome is not None and waiting:
+                    return False, lease.outcome
+                if lease.outcome is None and lease.expires_at > now:
+                    return False, None
+            expires_at = now + config.provisioning.lease_ttl
+            if lease is None:
+                db.add(OperationLease(key=key, owner=owner, expires_at=expires_at))
+                try:
+                    await db.commit()
+                except IntegrityError:
+                    # Inserted by another worker in the meantime
+                    return False, None
+                return True, None
+            expired = lease.outcome is None
+            # Only if nobody claimed it since it was read
+            result = await db.execute(
+                update(OperationLease)
+                .where(
+                    OperationLease.key == key,
+                    OperationLease.owner == lease.owner,
+                    OperationLease.expires_at == lease.expires_at,
+                )
+                .values(owner=owner, expires_at=expires_at, outcome=None)
+            )
+            await db.commit()
+            if result.rowcount != 1:
+                return False, None
+            if expired:
+                logger.warning("Took over the expired lease of %s", key)
+            return True, None
+
+    async def _finish(self, key: str, owner: str, outcome: Outcome) -> None:
+        """Stores the outcome for callers in other workers and frees the lease"""
+        async with AsyncSessionLocal() as db:
+            result = await db.execute(
+                update(OperationLease)
+                .where(OperationLease.key == key, OperationLease.owner == owner)
+                .values(outcome=outcome, expires_at=time.time())
+            )
+            await db.commit()
+        if result.rowcount == 0:
+            logger.warning("Lease of %s expired before the operation finished", key)
+
+    async def _release(self, key: str, owner: str) -> None:
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(OperationLease).where(
+                    OperationLease.key == key, OperationLease.owner == owner
+                )
+            )
+            await db.commit()
+
+
+class HeldLeases:
+    """
+    Leases of one operation taken by synchronous code for several users, as
+    batch provisioning does. A user whose lease another call holds is left
+    out instead of waited for. Outcomes are stored as SingleFlight stores
+    them, so callers that waited on one of these users get its result.
+    """
+
+    def __init__(self, db: Session, operation: str):
+        self.db = db
+        self.operation = operation
+        self.owner = uuid4().hex
+        self.keys: Set[str] = set()
+        self._renewed = 0.0
+
+    def claim(self, user_id: str) -> bool:
+        """Takes the user's lease unless an operation holds it"""
+        key = lease_key(self.operation, user_id)
+        now = time.time()
+        expires_at = now + config.provisioning.lease_ttl
+        lease = self.db.get(OperationLease, key, populate_existing=True)
+        if lease is None:
+            self.db.add(
+                OperationLease(key=key, owner=self.owner, expires_at=expires_at)
+            )
+            try:
+                self.db.commit()
+            except IntegrityError:
+                # Inserted by another worker in the meantime
+                self.db.rollback()
+                return False
+        else:
+            if lease.outcome is None and lease.expires_at > now:
+                return False
+            # Only if nobody claimed it since it was read
+            result = self.db.execute(
+                update(OperationLease)
+                .where(
+                    OperationLease.key == key,
+                    OperationLease.owner == lease.owner,
+                    OperationLease.expires_at == lease.expires_at,
+                )
+                .values(owner=self.owner, expires_at=expires_at, outcome=None)
+            )
+            self.db.commit()
+            if result.rowcount != 1:
+                return False
+        self.keys.add(key)
+        self._renewed = now
+        return True
+
+    def renew(self) -> None:
+        """Extends the held leases, at most three times per lease_ttl"""
+        ttl = config.provisioning.lease_ttl
+        now = time.time()
+        if not self.keys or now - self._renewed < ttl / 3:
+            return
+        self.db.execute(
+            update(OperationLease)
+            .where(
+                OperationLease.key.in_(self.keys),
+                OperationLease.owner == self.owner,
+                OperationLease.outcome.is_(None),
+            )
+            .values(expires_at=now + ttl)
+        )
+        self.db.commit()
+        self._renewed = now
+
+    def finish(self, user_id: str, status_code: int, detail: str) -> None:
+        """Stores the user's outcome and frees the lease"""
+        key = lease_key(self.operation, user_id)
+        self.db.execute(
+            update(OperationLease)
+            .where(OperationLease.key == key, OperationLease.owner == self.owner)
+            .values(outcome=_outcome(status_code, detail), expires_at=time.time())
+        )
+        self.db.commit()
+        self.keys.discard(key)
+
+    def release(self) -> None:
+        """Frees the leases left without an outcome, their waiters try again"""
+        if not self.keys:
+            return
+        self.db.rollback()
+        self.db.execute(
+            delete(OperationLease).where(
+                OperationLease.key.in_(self.keys),
+                OperationLease.owner == self.owner,
+            )
+        )
+        self.db.commit()
+        self.keys.clear()
+
+
+single_flight = SingleFlight()
@@ -1,10 +1,33 @@
-from fastapi_sso.sso.yandex import YandexSSO
+import functools
+from typing import TYPE_CHECKING, Type
 
 from config import config
+from services.lifecycle import resources
 
-sso = YandexSSO(
-    client_id=config.sso.client_id.get_secret_value(),
-    client_secret=config.sso.client_secret.get_secret_value(),
-    redirect_uri=config.sso.redirect_uri,
-    allow_insecure_http=config.sso.allow_insecure_http,
-)
+if TYPE_CHECKING:
+    from fastapi_sso.sso.yandex import YandexSSO
+
+
+# fastapi_sso and oauthlib with it take as long to import as the rest of the
+# routes together and only the login needs them, so they load on first use
+@functools.cache
+def get_sso() -> "YandexSSO":
+    from fastapi_sso.sso.yandex import YandexSSO
+
+    return YandexSSO(
+        client_id=config.sso.client_id.get_secret_value(),
+        client_secret=config.sso.client_secret.get_secret_value(),
+        redirect_uri=config.sso.redirect_uri,
+        allow_insecure_http=config.sso.allow_insecure_http,
+    )
+
+
+# Its HTTP client must not be shared with the process it was forked from
+resources.register("sso", after_fork=get_sso.cache_clear)
+
+
+def invalid_grant_error() -> Type[Exception]:
+    """Error of an expired authorization code, for except clauses"""
+    from oauthlib.oauth2.rfc6749.errors import InvalidGrantError
+
+    return InvalidGrantError
@@ -0,0 +1,92 @@
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from fastapi import Request
+
+from config import config
+
+
+class ServerTiming:
+    """Durations of the phases of one request, phases may nest"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        # list.append is atomic, LDAP phases are added from executor threads
+        self.entries: List[Tuple[str, float]] = []
+
+    def add(self, phase: str, seconds: float) -> None:
+        self.entries.append((phase, seconds))
+
+    def phases(self) -> Dict[str, Tuple[float, int]]:
+        """Total seconds and number of calls per phase, in first-seen order"""
+        totals: Dict[str, Tuple[float, int]] = {}
+        for phase, seconds in self.entries:
+            total, count = totals.get(phase, (0.0, 0))
+            totals[phase] = (total + seconds, count + 1)
+        return totals
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def summary(self) -> Dict[str, float]:
+        """Milliseconds per phase, the structured log field"""
+        summary = {
+            phase: round(total * 1000, 2) for phase, (total, _) in self.phases().items()
+        }
+        summary["total"] = round(self.elapsed() * 1000, 2)
+        return summary
+
+    def header(self) -> str:
+        """Server-Timing header value"""
+        parts = []
+        for phase, (total, count) in self.phases().items():
+            part = f"{phase};dur={total * 1000:.2f}"
+            if count > 1:
+                part += f';desc="{count} calls"'
+            parts.append(part)
+        parts.append(f"total;dur={self.elapsed() * 1000:.2f}")
+        return ", ".join(parts)
+
+
+# Collector of the request being served, None outside requests or when disabled
+_current: ContextVar[Optional[ServerTiming]] = ContextVar("server_timing", default=None)
+
+
+def current_timing() -> Optional[ServerTiming]:
+    return _current.get()
+
+
+def record(phase: str, seconds: float) -> None:
+    """Adds a measured duration to the request being served"""
+    timing = _current.get()
+    if timing is not None:
+        timing.add(phase, seconds)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Measures the enclosed block as a phase of the request"""
+    timing = _current.get()
+    if timing is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timing.add(name, time.perf_counter() - started)
+
+
+async def server_timing_middleware(request: Request, call_next):
+    """Middleware collecting the phases of a request into Server-Timing"""
+    timing = ServerTiming()
+    token = _current.set(timing)
+    try:
+        response = await call_next(request)
+    finally:
+        _current.reset(token)
+    if config.timing.header:
+        response.headers["Server-Timing"] = timing.header()
+    return response
@@ -2,6 +2,8 @@ import string
 import secrets
 import re
 
+from ldap.dn import dn2str, str2dn
+
 
 def generate_password(length=20):
     """
@@ -13,6 +15,13 @@ def generate_password(length=20):
     return password
 
 
+def username_from_email(email: str) -> str:
+    """
+    Builds the AD username from the local part of the email.
+    """
+    return email.split("@")[0].replace(".", "_")
+
+
 def dn_keys_to_upper(dn: str) -> str:
     """
     Converts all occurrences of OU=, DC=, CN= in the DN string to uppercase.
@@ -22,3 +31,11 @@ def dn_keys_to_upper(dn: str) -> str:
         return match.group(1).upper() + match.group(2)
 
     return re.sub(r"((?:ou|dc|cn)=)([^,]+)", repl, dn, flags=re.IGNORECASE)
+
+
+def normalize_dn(dn: str) -> str:
+    """
+    Canonical, lowercased form of the DN, for comparing DNs AD returned with
+    configured ones that may differ in spacing or escaping.
+    """
+    return dn2str(str2dn(dn)).lower()
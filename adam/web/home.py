@@ -1,17 +1,53 @@
-from fastapi import APIRouter, Request, Depends
+import os
+
+from fastapi import APIRouter, Request, Depends, Response
 from fastapi.responses import HTMLResponse, RedirectResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy.orm import Session
-from itsdangerous import URLSafeSerializer
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from config import config
-from models.database import get_db
+from models.database import get_async_db
 from models.ldap_accounts import LDAPAccount
-from services.db_service import DBService
+from services.account_cache import (
+    PASSWORD_SLOT,
+    TEMPLATES_VERSION,
+    AccountsHTML,
+    AccountsVersion,
+    get_fragment,
+    set_fragment,
+)
+from services.db_service import AsyncDBService
+from services.identity import get_current_user
+from services.jobs import job_urls
+from services.timing import phase
 
 home_router = APIRouter()
 templates = Jinja2Templates(directory="templates")
-serializer = URLSafeSerializer(config.encryption.user_session_key.get_secret_value())
+# Passwords are left out of the rendered accounts, filled in for each response
+templates.env.filters["password_slot"] = lambda _: PASSWORD_SLOT
+if config.run.template_cache:
+    os.makedirs(config.run.template_cache, exist_ok=True)
+    templates.env.bytecode_cache = FileSystemBytecodeCache(config.run.template_cache)
+
+
+def precompile_templates() -> None:
+    """
+    Compiles every template now instead of on the first request that renders
+    it. With gunicorn's preload the master does it once for all workers, the
+    bytecode cache spares the parsing on later starts
+    """
+    for name in templates.env.list_templates():
+        templates.env.get_template(name)
+
+
+# Shown columns of an account, version and updated_at are internal
+columns = [
+    col.name
+    for col in LDAPAccount.__table__.columns
+    if col.name in LDAPAccount.display_names
+]
+display_columns = {col: LDAPAccount.display_names[col] for col in columns}
 
 
 @home_router.get("/login", response_class=HTMLResponse, include_in_schema=False)
@@ -36,9 +72,11 @@ async def features(request: Request) -> HTMLResponse:
 
 
 @home_router.get("/", response_class=HTMLResponse, include_in_schema=False)
-async def home_page(request: Request, db: Session = Depends(get_db)) -> HTMLResponse:
-    auth_token = request.cookies.get("auth_token")
-    if not auth_token:
+async def home_page(
+    request: Request, db: AsyncSession = Depends(get_async_db)
+) -> Response:
+    sso_user = await get_current_user(request)
+    if not sso_user:
         return templates.TemplateResponse(
             "login.html",
             {
@@ -47,42 +85,51 @@ async def home_page(request: Request, db: Session = Depends(get_db)) -> HTMLResp
             },
         )
 
-    try:
-        user_id = str(serializer.loads(auth_token))
-    except Exception as e:
-        return templates.TemplateResponse(
-            "login.html",
-            {
-                "request": request,
-                "title": "AD.AM",
-            },
-        )
+    db_service = AsyncDBService(db)
+    version = AccountsVersion(
+        await db_service.get_ldap_account_versions(sso_user.id),
+        TEMPLATES_VERSION,
+        sso_user.id,
+        sso_user.picture or "",
+    )
+    flash_message = request.session.pop("flash_message", None)
+    # Account creation running in the background, the page follows its progress
+    job = (
+        await db_service.get_active_job(sso_user.id, "create")
+        if config.jobs.enabled
+        else None
+    )
+    # A page with a flash message or a job is shown once, never a cached version
+    uncached = flash_message is not None or job is not None
+    if not uncached and version.matches(request):
+        return version.not_modified()
 
-    db_service = DBService(db)
-    sso_user = db_service.get_sso_user_by_id(user_id)
-    if not sso_user:
+    accounts = get_fragment("html", sso_user.id, version)
+    if accounts is None:
+        ad_accounts = await db_service.get_ldap_accounts_by_user_id(sso_user.id)
+        with phase("render"):
+            accounts = AccountsHTML(
+                templates.get_template("_accounts.html").render(
+                    user=sso_user,
+                    ad_accounts=ad_accounts,
+                    columns=columns,
+                    display_columns=display_columns,
+                ),
+                [account.kadmin_password for account in ad_accounts],
+            )
+        set_fragment("html", sso_user.id, version, accounts)
+
+    with phase("render"):
         return templates.TemplateResponse(
-            "login.html",
+            "index.html",
             {
                 "request": request,
+                "user": sso_user,
+                "accounts_html": accounts.fill(),
+                "message": flash_message,
+                "job": job,
+                "job_events_url": job_urls(job)["events_url"] if job else None,
                 "title": "AD.AM",
             },
+            headers=None if uncached else version.headers(),
         )
-
-    ad_accounts = db_service.get_ldap_accounts_by_user_id(user_id)
-    columns = [col.name for col in LDAPAccount.__table__.columns]
-    display_columns = {col: LDAPAccount.display_names.get(col, col) for col in columns}
-    flash_message = request.session.pop("flash_message", None)
-
-    return templates.TemplateResponse(
-        "index.html",
-        {
-            "request": request,
-            "user": sso_user,
-            "ad_accounts": ad_accounts,
-            "columns": columns,
-            "display_columns": display_columns,
-            "message": flash_message,
-            "title": "AD.AM",
-        },
-    )
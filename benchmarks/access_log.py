@@ -0,0 +1,111 @@
+"""
+Per-request cost of the access log on the event loop.
+
+log_requests_middleware is called in a loop with a trivial endpoint, once per
+logging setup, each in a fresh process because the setup is read at import.
+Lines go to a log file and to stdout redirected to a file, as in a container.
+The time a request spends in the middleware is compared with logging off;
+with the queue the listener thread writes the lines and the count written is
+checked after it drains. On a single CPU the listener competes with the loop
+for the GIL, which shows in the wall time per request.
+
+    python benchmarks/access_log.py --requests 20000
+"""
+
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, summary
+
+MODES = {
+    "off": {"LOG__LEVEL": "WARNING"},
+    "sync_text": {"LOG__QUEUE": "False"},
+    "queue_text": {},
+    "queue_json": {"LOG__FORMAT": "json"},
+    "queue_text_sampled_10%": {"LOG__ACCESS_SAMPLE": '{"/api": 0.1}'},
+}
+
+
+def run_mode(args) -> dict:
+    env, requests, tmp = args
+    log_path = os.path.join(tmp, "app.log")
+    os.environ.update(
+        {
+            **BASE_ENV,
+            "LOG__LEVEL": "INFO",
+            "LOG__FILE": "True",
+            "LOG__PATH": log_path,
+            **env,
+        }
+    )
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+    stdout_path = os.path.join(tmp, "stdout.log")
+    sys.stdout = open(stdout_path, "w")
+
+    from fastapi import Request, Response
+    from services import logging_config
+
+    async def call_next(request: Request) -> Response:
+        return Response(b"{}", media_type="application/json")
+
+    async def load() -> list:
+        samples = []
+        for i in range(requests):
+            scope = {
+                "type": "http",
+                "method": "GET",
+                "path": f"/api/v1/users/{i % 100}/ldap_account",
+                "query_string": b"",
+                "headers": [],
+                "client": ("10.0.0.1", 50000),
+                "server": ("adam", 8000),
+                "scheme": "http",
+            }
+            started = time.perf_counter()
+            await logging_config.log_requests_middleware(Request(scope), call_next)
+            samples.append(time.perf_counter() - started)
+        return samples
+
+    started = time.perf_counter()
+    samples = asyncio.run(load())
+    loop_seconds = time.perf_counter() - started
+    logging_config._stop_listener()
+    drained_seconds = time.perf_counter() - started
+    sys.stdout.flush()
+
+    with open(log_path) as f:
+        written = sum(1 for line in f if '"http"' in line or "[http]" in line)
+    return {
+        # Wall time, includes the listener thread taking turns on the GIL
+        "per_request_us": round(loop_seconds / requests * 1e6, 2),
+        "in_middleware_us": round(sum(samples) / requests * 1e6, 2),
+        "latency_ms": summary(samples),
+        "lines_written": written,
+        "drained_after_s": round(drained_seconds, 3),
+    }
+
+
+def main(args) -> None:
+    results = {}
+    ctx = multiprocessing.get_context("spawn")
+    for name, env in MODES.items():
+        with tempfile.TemporaryDirectory() as tmp:
+            with ctx.Pool(1) as pool:
+                results[name] = pool.apply(run_mode, ((env, args.requests, tmp),))
+    baseline = results["off"]["in_middleware_us"]
+    for result in results.values():
+        result["overhead_us"] = round(result["in_middleware_us"] - baseline, 2)
+    print(json.dumps({"requests": args.requests, "modes": results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=20000)
+    main(parser.parse_args())
@@ -0,0 +1,149 @@
+"""Helpers shared by the benchmark scripts"""
+
+import os
+import socket
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, Iterator, List, Optional
+
+import httpx
+from itsdangerous import URLSafeSerializer
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "adam"
+FAKES_DIR = ROOT / "benchmarks" / "fakes"
+
+SESSION_KEY = "3q6i7yV3zY7fH7k3tM0xQ5vT9sK8jW2rL4pN6mP8qR0="
+SECRET_KEY = "69d83bkt3TTanCC8Nxw/9viMh7nhBvQPv7NEqQNS7JQ="
+
+BASE_ENV = {
+    "SSO__CLIENT_ID": "bench",
+    "SSO__CLIENT_SECRET": "bench",
+    "SSO__REDIRECT_URI": "http://localhost/api/auth/callback",
+    "SSO__ALLOW_INSECURE_HTTP": "True",
+    "LDAP__DOMAIN": "bench.local",
+    "LDAP__BASE_DN": "DC=bench,DC=local",
+    "LDAP__URL": "ldap://dc1.bench.local",
+    "LDAP__ADMIN_DN": "CN=Administrator,CN=Users,DC=bench,DC=local",
+    "LDAP__ADMIN_PASS": "bench",
+    "LDAP__DEFAULT_USERS_DN": "OU=Users,OU=ADAM,DC=bench,DC=local",
+    "LDAP__MEMBER_OF_GROUPS": '["CN=G1,DC=bench,DC=local","CN=G2,DC=bench,DC=local"]',
+    "ENCRYPTION__SECRET_KEY": SECRET_KEY,
+    "ENCRYPTION__USER_SESSION_KEY": SESSION_KEY,
+    "LOG__LEVEL": "WARNING",
+}
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def percentile(samples: List[float], p: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summary(samples: List[float]) -> Dict[str, float]:
+    """Latency summary in milliseconds"""
+    return {
+        "count": len(samples),
+        "p50": round(percentile(samples, 50) * 1000, 2),
+        "p95": round(percentile(samples, 95) * 1000, 2),
+        "p99": round(percentile(samples, 99) * 1000, 2),
+        "max": round(max(samples, default=0) * 1000, 2),
+    }
+
+
+def auth_cookie(user_id: str) -> str:
+    """Forges the auth_token cookie the SSO callback would set"""
+    return URLSafeSerializer(SESSION_KEY).dumps(user_id)
+
+
+def seed_users(db_path: str, count: int) -> List[str]:
+    """Inserts SSO users straight into the database, returns their ids"""
+    ids = [str(uuid.uuid4()) for _ in range(count)]
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO users (id, username, email, sso_id, picture, created_at) "
+            "VALUES (?, ?, ?, ?, '', CURRENT_TIMESTAMP)",
+            [
+                (user_id, f"bench_{i}", f"bench.{i}@example.com", f"sso-{i}")
+                for i, user_id in enumerate(ids)
+            ],
+        )
+    return ids
+
+
+@contextmanager
+def run_server(
+    env: Optional[Dict[str, str]] = None, workers: int = 1
+) -> Iterator[Dict[str, str]]:
+    """Boots main:app with uvicorn against a temporary SQLite file and the fake ldap"""
+    with tempfile.TemporaryDirectory() as tmp:
+        port = free_port()
+        db_path = os.path.join(tmp, "database.sqlite")
+        server_env = {
+            **os.environ,
+            **BASE_ENV,
+            "DB__PATH": db_path,
+            "DB__URL": f"sqlite:///{db_path}",
+            "PYTHONPATH": os.pathsep.join([str(FAKES_DIR), str(APP_DIR)]),
+            **(env or {}),
+        }
+        if workers > 1:
+            # Every worker sees the accounts the others created
+            server_env.setdefault(
+                "FAKE_LDAP_DIRECTORY", os.path.join(tmp, "directory.sqlite")
+            )
+            # Workers would race to migrate the new file, migrate it first
+            migrate = "from models.database import init_db; init_db()"
+            subprocess.run(
+                [sys.executable, "-c", migrate], cwd=APP_DIR, env=server_env, check=True
+            )
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "uvicorn",
+                "main:app",
+                "--port",
+                str(port),
+                "--workers",
+                str(workers),
+                "--log-level",
+                "warning",
+            ],
+            cwd=APP_DIR,
+            env=server_env,
+        )
+        url = f"http://127.0.0.1:{port}"
+        try:
+            wait_ready(url)
+            yield {"url": url, "db_path": db_path, "pid": str(process.pid)}
+        finally:
+            process.terminate()
+            process.wait(timeout=10)
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> float:
+    """Polls /health until it answers, returns the time it took"""
+    started = time.perf_counter()
+    while time.perf_counter() - started < timeout:
+        try:
+            if httpx.get(f"{url}/health", timeout=1).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    raise RuntimeError(f"Server at {url} did not become ready")
@@ -0,0 +1,84 @@
+"""
+Concurrent requests served by one worker while every SQLite statement is slow.
+
+Every statement waits FAKE_SQLITE_LATENCY seconds (see fakes/sitecustomize.py),
+as on a congested disk. Clients load the home page and the account list at the
+same time, /health is sampled alongside. With synchronous sessions each query
+stops the event loop, so requests are served one after another; with the async
+engine they wait for the database concurrently.
+
+    python benchmarks/db_slow_disk.py --latency 0.02 --clients 16
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import auth_cookie, run_server, seed_users, summary
+
+
+async def client_load(url: str, user_id: str, deadline: float, api: bool) -> list:
+    cookies = {"auth_token": auth_cookie(user_id)}
+    paths = ["/", f"/api/v1/users/{user_id}/ldap_account"] if api else ["/"]
+    samples = []
+    async with httpx.AsyncClient(base_url=url, cookies=cookies, timeout=60) as client:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            response = await client.get(paths[len(samples) % len(paths)])
+            response.raise_for_status()
+            samples.append(time.perf_counter() - started)
+    return samples
+
+
+async def sample_health(url: str, deadline: float) -> list:
+    samples = []
+    async with httpx.AsyncClient(base_url=url, timeout=60) as client:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            (await client.get("/health")).raise_for_status()
+            samples.append(time.perf_counter() - started)
+            await asyncio.sleep(0.01)
+    return samples
+
+
+async def main(args) -> None:
+    env = {"FAKE_SQLITE_LATENCY": str(args.latency)}
+    with run_server(env) as server:
+        user_ids = seed_users(server["db_path"], args.clients)
+        deadline = time.perf_counter() + args.duration
+        health = asyncio.create_task(sample_health(server["url"], deadline))
+        results = await asyncio.gather(
+            *(
+                client_load(server["url"], user_id, deadline, not args.home_only)
+                for user_id in user_ids
+            )
+        )
+        health = await health
+
+    requests = [sample for samples in results for sample in samples]
+    print(
+        json.dumps(
+            {
+                "statement_latency": args.latency,
+                "clients": args.clients,
+                "requests_per_second": round(len(requests) / args.duration, 1),
+                "request_latency_ms": summary(requests),
+                "health_latency_ms": summary(health),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0)
+    parser.add_argument(
+        "--home-only", action="store_true", help="Skip the account list API"
+    )
+    asyncio.run(main(parser.parse_args()))
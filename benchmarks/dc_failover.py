@@ -0,0 +1,109 @@
+"""
+Password resets across two domain controllers while one of them fails.
+
+The fake ldap serves ldap://dc1 and ldap://dc2 from one directory, dc2
+answering faster. Resets run through ADService in phases: both DCs up, the
+fast DC down (SERVER_DOWN), the fast DC hanging (TIMEOUT after
+LDAP__POOL__TIMEOUT), and after it recovered. Per phase the output has the
+reset latency, the errors and which DC took the writes. Users written to
+the slow DC during the outage stay there after it, the others go back to the
+fast one.
+
+    python benchmarks/dc_failover.py --resets 50 --slow 0.02 --fast 0.002
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections import Counter
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, summary
+
+DC1 = "ldap://dc1.bench.local"
+DC2 = "ldap://dc2.bench.local"
+
+
+def run(args) -> dict:
+    os.environ.update(
+        {
+            **BASE_ENV,
+            "LDAP__URLS": json.dumps([DC1, DC2]),
+            "LDAP__POOL__TIMEOUT": "1",
+            "FAKE_LDAP_DC_LATENCY": f"{DC1}={args.slow},{DC2}={args.fast}",
+        }
+    )
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+
+    from fastapi import HTTPException
+    from services.ad_service import ADService
+    from services.domain_controllers import domain_controllers
+    from services.provisioning import build_user_attributes
+
+    users_dn = BASE_ENV["LDAP__DEFAULT_USERS_DN"]
+
+    def probe() -> None:
+        for dc in domain_controllers.dcs:
+            domain_controllers.probe(dc.url)
+
+    def resets(usernames) -> dict:
+        samples, errors, served = [], 0, Counter()
+        for username in usernames:
+            started = time.perf_counter()
+            try:
+                ADService().reset_account_password(
+                    username, f"CN={username},{users_dn}"
+                )
+            except HTTPException:
+                errors += 1
+                continue
+            samples.append(time.perf_counter() - started)
+            served[domain_controllers.sticky_url(username)] += 1
+        return {"latency_ms": summary(samples), "errors": errors, "served_by": served}
+
+    usernames = [f"dc_bench_{i}" for i in range(args.resets)]
+    probe()
+    for username in usernames:
+        ADService().create_account(
+            username, build_user_attributes(username, f"{username}@example.com")
+        )
+    phases = {"both_up": resets(usernames)}
+
+    # Half of the users are written during the outage
+    sticky_users = usernames[: len(usernames) // 2]
+    os.environ["FAKE_LDAP_DOWN"] = DC2
+    phases["fast_dc_down"] = resets(sticky_users)
+
+    os.environ["FAKE_LDAP_DOWN"] = ""
+    probe()
+    # Written to dc1 a moment ago, the same users stay there
+    phases["recovered_sticky_users"] = resets(sticky_users)
+    phases["recovered_other_users"] = resets(usernames[len(sticky_users) :])
+
+    os.environ["FAKE_LDAP_HANG"] = DC2
+    phases["fast_dc_hangs"] = resets(usernames[len(sticky_users) :])
+    os.environ["FAKE_LDAP_HANG"] = ""
+
+    return {
+        "dcs": {DC1: args.slow, DC2: args.fast},
+        "phases": phases,
+        "state": domain_controllers.status(),
+    }
+
+
+def main(args) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        result = pool.apply(run, (args,))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--resets", type=int, default=50)
+    parser.add_argument("--slow", type=float, default=0.02, help="dc1 latency, s")
+    parser.add_argument("--fast", type=float, default=0.002, help="dc2 latency, s")
+    main(parser.parse_args())
@@ -0,0 +1,472 @@
+"""
+In-memory stand-in for python-ldap used by the benchmarks.
+
+Put ``benchmarks/fakes`` first on PYTHONPATH and ``import ldap`` resolves
+here. Behaviour is scripted with environment variables:
+
+- FAKE_LDAP_LATENCY: seconds every operation takes, default 0
+- FAKE_LDAP_BIND_LATENCY: extra seconds for a bind, default 0
+- FAKE_LDAP_FAILURE_RATE: share of operations failing with SERVER_DOWN, default 0
+- FAKE_LDAP_OP_LATENCY: extra seconds per operation (bind, whoami, search, add,
+  modify), "add=0.05,modify=0.02"; a pipelined round trip counts as its slowest
+- FAKE_LDAP_OP_FAILURE_RATE: share of SERVER_DOWN per operation, "modify=0.01"
+- FAKE_LDAP_DC_LATENCY: extra seconds per server URI, "ldap://dc1=0.2,ldap://dc2=0"
+- FAKE_LDAP_DOWN: server URIs failing every operation with SERVER_DOWN,
+  "ldap://dc1,ldap://dc2"
+- FAKE_LDAP_HANG: server URIs whose operations run into TIMEOUT, after the
+  timeout of the call or the OPT_TIMEOUT of the connection
+
+All URIs share one directory, as DCs that replicate instantly. The settings
+are read on every operation, so a benchmark can take a DC down while it runs.
+The directory lives in the process, unless FAKE_LDAP_DIRECTORY names an
+SQLite file that several server workers share.
+
+Entries carry uSNCreated and uSNChanged, the rootDSE highestCommittedUSN.
+Searches below the base honour conjunctions of equality, presence and >=
+filter items, the SimplePagedResults control and the AD show-deleted
+control; delete_s leaves a tombstone with isDeleted, rename_s moves entries.
+ldap.dn parses and builds DNs as python-ldap does.
+"""
+
+import builtins
+import itertools
+import os
+import pickle
+import random
+import re
+import sqlite3
+import threading
+import time
+
+OPT_X_TLS_REQUIRE_CERT = 0x6006
+OPT_X_TLS_ALLOW = 3
+OPT_NETWORK_TIMEOUT = 0x5005
+OPT_TIMEOUT = 0x5002
+OPT_REFERRALS = 0x0008
+
+MOD_ADD = 0
+MOD_DELETE = 1
+MOD_REPLACE = 2
+
+SCOPE_BASE = 0
+SCOPE_ONELEVEL = 1
+SCOPE_SUBTREE = 2
+
+RES_ADD = 0x69
+RES_MODIFY = 0x67
+RES_SEARCH_RESULT = 0x65
+RES_OPERATIONS = {RES_ADD: "add", RES_MODIFY: "modify", RES_SEARCH_RESULT: "search"}
+
+SHOW_DELETED_OID = "1.2.840.113556.1.4.417"
+
+from ldap.controls import SimplePagedResultsControl  # noqa: E402
+
+
+class LDAPError(Exception):
+    pass
+
+
+class SERVER_DOWN(LDAPError):
+    pass
+
+
+class CONNECT_ERROR(LDAPError):
+    pass
+
+
+class TIMEOUT(LDAPError):
+    pass
+
+
+class ALREADY_EXISTS(LDAPError):
+    pass
+
+
+class NO_SUCH_OBJECT(LDAPError):
+    pass
+
+
+class TYPE_OR_VALUE_EXISTS(LDAPError):
+    pass
+
+
+class INVALID_CREDENTIALS(LDAPError):
+    pass
+
+
+_options = {}
+
+
+class _SharedDirectory:
+    """Entries in an SQLite file, the dict operations the fake uses"""
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, entry BLOB)"
+            )
+
+    def _connect(self) -> sqlite3.Connection:
+        return sqlite3.connect(self.path, timeout=30)
+
+    def get(self, key: str):
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT entry FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def __setitem__(self, key: str, entry: dict) -> None:
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?)",
+                (key, pickle.dumps(entry)),
+            )
+
+    def __delitem__(self, key: str) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries WHERE key = ?", (key,))
+
+    def items(self):
+        with self._connect() as conn:
+            rows = conn.execute("SELECT key, entry FROM entries").fetchall()
+        return [(key, pickle.loads(entry)) for key, entry in rows]
+
+    def clear(self) -> None:
+        with self._connect() as conn:
+            conn.execute("DELETE FROM entries")
+
+
+_directory = (
+    _SharedDirectory(os.environ["FAKE_LDAP_DIRECTORY"])
+    if os.environ.get("FAKE_LDAP_DIRECTORY")
+    else {}
+)
+_directory_lock = threading.Lock()
+_msgids = itertools.count(1)
+
+
+def _setting(name: str) -> float:
+    return float(os.environ.get(name, "0") or 0)
+
+
+def _uris(name: str) -> list:
+    return [uri for uri in os.environ.get(name, "").split(",") if uri]
+
+
+def _keyed_setting(name: str, key: str) -> float:
+    """Value for key of a "key=value,key=value" variable, 0 if it is not listed"""
+    for item in _uris(name):
+        item_key, _, value = item.rpartition("=")
+        if item_key == key:
+            return float(value)
+    return 0.0
+
+
+def _simulate(
+    uri: str, operation: str, extra: float = 0.0, timeout: float = 0.0
+) -> None:
+    if uri in _uris("FAKE_LDAP_DOWN"):
+        raise SERVER_DOWN({"desc": "Can't contact LDAP server (injected)"})
+    if uri in _uris("FAKE_LDAP_HANG"):
+        time.sleep(timeout)
+        raise TIMEOUT({"desc": "Timed out (injected)"})
+    latency = (
+        _setting("FAKE_LDAP_LATENCY")
+        + _keyed_setting("FAKE_LDAP_DC_LATENCY", uri)
+        + _keyed_setting("FAKE_LDAP_OP_LATENCY", operation)
+        + extra
+    )
+    if latency:
+        time.sleep(latency)
+    failure_rate = max(
+        _setting("FAKE_LDAP_FAILURE_RATE"),
+        _keyed_setting("FAKE_LDAP_OP_FAILURE_RATE", operation),
+    )
+    if random.random() < failure_rate:
+        raise SERVER_DOWN({"desc": "Can't contact LDAP server (injected)"})
+
+
+_last_usn = 0
+
+
+def _next_usn() -> bytes:
+    """
+    Microseconds, so processes sharing a directory hand out increasing
+    numbers as well. Called with the directory lock held
+    """
+    global _last_usn
+    _last_usn = max(_last_usn + 1, time.time_ns() // 1000)
+    return str(_last_usn).encode()
+
+
+def _highest_usn() -> int:
+    # Changes after this call get a higher number
+    return max(_last_usn, time.time_ns() // 1000 - 1)
+
+
+_FILTER_ITEM = re.compile(r"\(([\w-]+)(>=|=)([^()]*)\)")
+
+
+def _values(entry: dict, attr: str) -> list:
+    for name, values in entry.items():
+        if name.lower() == attr.lower() and name != "dn":
+            values = values if isinstance(values, list) else [values]
+            return [v.decode() if isinstance(v, bytes) else str(v) for v in values]
+    return []
+
+
+def _matches(entry: dict, filterstr: str) -> bool:
+    """Every item of the filter holds, "&" and nesting are not looked at"""
+    for attr, op, value in _FILTER_ITEM.findall(filterstr):
+        values = _values(entry, attr)
+        if op == ">=":
+            ok = any(int(v) >= int(value) for v in values)
+        elif value == "*":
+            ok = bool(values)
+        else:
+            # objectCategory=person matches CN=Person,CN=Schema,... as in AD
+            wanted = value.lower()
+            ok = any(
+                v.lower() == wanted or v.lower().startswith(f"cn={wanted},")
+                for v in values
+            )
+        if not ok:
+            return False
+    return True
+
+
+def _deleted(entry: dict) -> bool:
+    return _values(entry, "isDeleted") == ["TRUE"]
+
+
+def _key(dn: str) -> str:
+    return dn.replace(" ", "").lower()
+
+
+def _parent(dn: str) -> str:
+    return dn.split(",", 1)[1] if "," in dn else ""
+
+
+def set_option(option, value) -> None:
+    _options[option] = value
+
+
+def initialize(uri: str, **kwargs) -> "LDAPObject":
+    return LDAPObject(uri)
+
+
+class LDAPObject:
+    def __init__(self, uri: str):
+        self.uri = uri
+        self.timeout = -1
+        self._bound = False
+        self._pending = {}
+        # Like libldap, a connection starts with the global options
+        self._options = dict(_options)
+
+    def set_option(self, option, value) -> None:
+        self._options[option] = value
+
+    def _wait(self, operation: str, extra: float = 0.0, timeout=None) -> None:
+        """Latency and failures of the server, hangs until the timeout"""
+        if timeout is None or timeout < 0:
+            timeout = self._options.get(OPT_TIMEOUT) or 0
+        _simulate(self.uri, operation, extra, timeout)
+
+    def simple_bind_s(self, who: str = "", cred: str = "") -> None:
+        self._wait("bind", _setting("FAKE_LDAP_BIND_LATENCY"))
+        self._bound = True
+
+    def unbind_s(self) -> None:
+        self._bound = False
+
+    unbind = unbind_s
+
+    def whoami_s(self) -> str:
+        self._wait("whoami")
+        return "u:ADMIN"
+
+    @staticmethod
+    def _live(dn: str):
+        entry = _directory.get(_key(dn))
+        return None if entry is None or _deleted(entry) else entry
+
+    @classmethod
+    def _check_parent(cls, dn: str) -> None:
+        parent = _parent(dn)
+        if parent.upper().startswith(("OU=", "CN=")) and cls._live(parent) is None:
+            raise NO_SUCH_OBJECT({"desc": "No such object", "matched": parent})
+
+    def _add(self, dn: str, modlist) -> None:
+        with _directory_lock:
+            if self._live(dn) is not None:
+                raise ALREADY_EXISTS({"desc": "Already exists"})
+            self._check_parent(dn)
+            entry = {"dn": dn, **{k: v for k, v in modlist}}
+            if "user" in [v.lower() for v in _values(entry, "objectClass")]:
+                entry["objectCategory"] = [b"CN=Person,CN=Schema,CN=Configuration"]
+            entry["uSNCreated"] = entry["uSNChanged"] = [_next_usn()]
+            _directory[_key(dn)] = entry
+
+    def _modify(self, dn: str, modlist) -> None:
+        with _directory_lock:
+            entry = self._live(dn)
+            if entry is None:
+                raise NO_SUCH_OBJECT({"desc": "No such object"})
+            for op, attr, value in modlist:
+                values = value if isinstance(value, list) else [value]
+                if op == MOD_ADD and set(values) & set(entry.get(attr, [])):
+                    raise TYPE_OR_VALUE_EXISTS({"desc": "Type or value exists"})
+                if op == MOD_REPLACE:
+                    entry[attr] = values
+                elif op == MOD_ADD:
+                    entry.setdefault(attr, [])
+                    entry[attr] = list(entry[attr]) + values
+            entry["uSNChanged"] = [_next_usn()]
+            _directory[_key(dn)] = entry
+
+    def delete_s(self, dn: str) -> None:
+        """Leaves a tombstone, found only with the show-deleted control"""
+        self._wait("delete")
+        with _directory_lock:
+            entry = self._live(dn)
+            if entry is None:
+                raise NO_SUCH_OBJECT({"desc": "No such object"})
+            entry["isDeleted"] = [b"TRUE"]
+            entry["uSNChanged"] = [_next_usn()]
+            _directory[_key(dn)] = entry
+
+    def rename_s(self, dn: str, newrdn: str, newsuperior=None, delold=1) -> None:
+        self._wait("modify")
+        new_dn = f"{newrdn},{newsuperior or _parent(dn)}"
+        with _directory_lock:
+            entry = self._live(dn)
+            if entry is None:
+                raise NO_SUCH_OBJECT({"desc": "No such object"})
+            if self._live(new_dn) is not None:
+                raise ALREADY_EXISTS({"desc": "Already exists"})
+            self._check_parent(new_dn)
+            del _directory[_key(dn)]
+            entry["dn"] = new_dn
+            entry["uSNChanged"] = [_next_usn()]
+            _directory[_key(new_dn)] = entry
+
+    def add_s(self, dn: str, modlist) -> None:
+        self._wait("add")
+        self._add(dn, modlist)
+
+    def modify_s(self, dn: str, modlist) -> None:
+        self._wait("modify")
+        self._modify(dn, modlist)
+
+    @staticmethod
+    def _below(base: str, filterstr: str, show_deleted: bool = False) -> list:
+        with _directory_lock:
+            items = sorted(_directory.items(), key=lambda item: item[0])
+        return [
+            (e["dn"], e)
+            for k, e in items
+            if k.endswith(_key(base))
+            and k != _key(base)
+            and (show_deleted or not _deleted(e))
+            and _matches(e, filterstr)
+        ]
+
+    def search_s(self, base, scope, filterstr="(objectClass=*)", attrlist=None):
+        self._wait("search")
+        if base == "" and scope == SCOPE_BASE:
+            return [("", {"highestCommittedUSN": [str(_highest_usn()).encode()]})]
+        with _directory_lock:
+            entry = self._live(base)
+        if scope == SCOPE_BASE:
+            if entry is not None or not base.upper().startswith(("OU=", "CN=")):
+                return [(base, entry or {})]
+            raise NO_SUCH_OBJECT({"desc": "No such object"})
+        return self._below(base, filterstr)
+
+    def search_ext(
+        self,
+        base,
+        scope,
+        filterstr="(objectClass=*)",
+        attrlist=None,
+        attrsonly=0,
+        serverctrls=None,
+        clientctrls=None,
+        timeout=-1,
+        sizelimit=0,
+    ) -> int:
+        return self._submit(
+            RES_SEARCH_RESULT, self._search_page, base, filterstr, attrlist, serverctrls
+        )
+
+    def _search_page(self, base, filterstr, attrlist, serverctrls):
+        controls = {control.controlType: control for control in serverctrls or []}
+        entries = self._below(base, filterstr, SHOW_DELETED_OID in controls)
+        if attrlist is not None:
+            wanted = {attr.lower() for attr in attrlist}
+            entries = [
+                (dn, {k: v for k, v in e.items() if k.lower() in wanted})
+                for dn, e in entries
+            ]
+        paged = controls.get(SimplePagedResultsControl.controlType)
+        if paged is None:
+            return entries, []
+        offset = int(paged.cookie or 0)
+        end = offset + paged.size
+        cookie = str(end).encode() if end < len(entries) else b""
+        return entries[offset:end], [SimplePagedResultsControl(size=0, cookie=cookie)]
+
+    # Asynchronous API: operations are executed when their result is read,
+    # all outstanding operations share one simulated round trip
+    def add_ext(self, dn, modlist, serverctrls=None, clientctrls=None) -> int:
+        return self._submit(RES_ADD, self._add, dn, modlist)
+
+    def modify_ext(self, dn, modlist, serverctrls=None, clientctrls=None) -> int:
+        return self._submit(RES_MODIFY, self._modify, dn, modlist)
+
+    def add(self, dn, modlist) -> int:
+        return self.add_ext(dn, modlist)
+
+    def modify(self, dn, modlist) -> int:
+        return self.modify_ext(dn, modlist)
+
+    def _submit(self, result_type, func, *args) -> int:
+        msgid = next(_msgids)
+        self._pending[msgid] = (result_type, func, args, None)
+        return msgid
+
+    def result3(self, msgid=-1, all=1, timeout=None):
+        if self._pending and builtins.all(
+            entry[3] is None for entry in self._pending.values()
+        ):
+            # One round trip, as slow as its slowest operation
+            slowest = max(
+                (RES_OPERATIONS[entry[0]] for entry in self._pending.values()),
+                key=lambda operation: _keyed_setting("FAKE_LDAP_OP_LATENCY", operation),
+            )
+            self._wait(slowest, timeout=timeout)
+            for pending_id, (result_type, func, args, _) in list(self._pending.items()):
+                try:
+                    data, controls = func(*args) or ([], [])
+                    outcome = (result_type, data, pending_id, controls)
+                except LDAPError as e:
+                    outcome = e
+                self._pending[pending_id] = (result_type, func, args, outcome)
+        result_type, func, args, outcome = self._pending.pop(msgid)
+        if isinstance(outcome, LDAPError):
+            raise outcome
+        return outcome
+
+    def result(self, msgid=-1, all=1, timeout=None):
+        return self.result3(msgid, all, timeout)[:2]
+
+
+def reset_directory() -> None:
+    with _directory_lock:
+        _directory.clear()
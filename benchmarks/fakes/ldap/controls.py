@@ -0,0 +1,21 @@
+"""Controls of the python-ldap stand-in, the ones the service sends"""
+
+
+class LDAPControl:
+    def __init__(self, controlType=None, criticality=False, encodedControlValue=None):
+        if controlType is not None:
+            self.controlType = controlType
+        self.criticality = criticality
+        self.encodedControlValue = encodedControlValue
+
+
+RequestControl = ResponseControl = LDAPControl
+
+
+class SimplePagedResultsControl(LDAPControl):
+    controlType = "1.2.840.113556.1.4.319"
+
+    def __init__(self, criticality=False, size=10, cookie=""):
+        self.criticality = criticality
+        self.size = size
+        self.cookie = cookie
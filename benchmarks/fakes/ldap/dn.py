@@ -0,0 +1,75 @@
+"""str2dn and dn2str of python-ldap, RFC 4514 escapes included"""
+
+import re
+from typing import List, Tuple
+
+AVA_STRING = 1
+
+_HEX = re.compile(r"[0-9A-Fa-f]{2}")
+
+
+def _split(value: str, separator: str) -> List[str]:
+    """Splits at the separators that are not escaped"""
+    parts, current, escaped = [], [], False
+    for char in value:
+        if escaped:
+            current.append(char)
+            escaped = False
+        elif char == "\\":
+            current.append(char)
+            escaped = True
+        elif char == separator:
+            parts.append("".join(current))
+            current = []
+        else:
+            current.append(char)
+    parts.append("".join(current))
+    return parts
+
+
+def _unescape(value: str) -> str:
+    value = value.strip()
+    if "\\" not in value:
+        return value
+    # Hex escapes are UTF-8 bytes, so the value is rebuilt as bytes
+    decoded, i = bytearray(), 0
+    while i < len(value):
+        if value[i] != "\\":
+            decoded += value[i].encode("utf-8")
+            i += 1
+        elif _HEX.fullmatch(value[i + 1 : i + 3]):
+            decoded += bytes.fromhex(value[i + 1 : i + 3])
+            i += 3
+        else:
+            decoded += value[i + 1 : i + 2].encode("utf-8")
+            i += 2
+    return decoded.decode("utf-8")
+
+
+def escape_dn_chars(value: str) -> str:
+    value = re.sub(r'([\\,+"<>;=])', r"\\\1", value).replace("\x00", "\\00")
+    if value.startswith(("#", " ")):
+        value = "\\" + value
+    if value.endswith(" "):
+        value = value[:-1] + "\\ "
+    return value
+
+
+def str2dn(dn: str, flags: int = 0) -> List[List[Tuple[str, str, int]]]:
+    if not dn.strip():
+        return []
+    rdns = []
+    for rdn in _split(dn, ","):
+        avas = []
+        for ava in _split(rdn, "+"):
+            attr, value = ava.split("=", 1)
+            avas.append((attr.strip(), _unescape(value), AVA_STRING))
+        rdns.append(avas)
+    return rdns
+
+
+def dn2str(dn: List[List[Tuple[str, str, int]]]) -> str:
+    return ",".join(
+        "+".join(f"{attr}={escape_dn_chars(value)}" for attr, value, _ in rdn)
+        for rdn in dn
+    )
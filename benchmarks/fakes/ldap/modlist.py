@@ -0,0 +1,9 @@
+def addModlist(entry, ignore_attr_types=None):
+    ignore = {a.lower() for a in ignore_attr_types or []}
+    modlist = []
+    for attr, value in entry.items():
+        if attr.lower() in ignore:
+            continue
+        values = value if isinstance(value, list) else [value]
+        modlist.append((attr, values))
+    return modlist
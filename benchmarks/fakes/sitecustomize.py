@@ -0,0 +1,27 @@
+"""
+Slow disk simulation for SQLite, loaded automatically from PYTHONPATH.
+
+FAKE_SQLITE_LATENCY  seconds every SQLite statement waits before it runs
+                     in the thread that executes it, default 0 (disabled)
+"""
+
+import os
+import sqlite3
+import sqlite3.dbapi2
+import time
+
+LATENCY = float(os.environ.get("FAKE_SQLITE_LATENCY", "0"))
+
+if LATENCY > 0:
+    _connect = sqlite3.connect
+
+    def _slow(statement: str) -> None:
+        time.sleep(LATENCY)
+
+    def connect(*args, **kwargs):
+        connection = _connect(*args, **kwargs)
+        connection.set_trace_callback(_slow)
+        return connection
+
+    # SQLAlchemy's pysqlite dialect connects through dbapi2, aiosqlite through sqlite3
+    sqlite3.connect = sqlite3.dbapi2.connect = connect
@@ -0,0 +1,82 @@
+"""
+/health latency while a slow directory serves provisioning requests.
+
+Runs one uvicorn worker with the fake ldap answering every operation after
+FAKE_LDAP_LATENCY seconds, samples /health on its own, then again while
+clients keep resetting passwords. With LDAP calls on the event loop the p99
+grows to the LDAP latency, with the LDAP executor it stays flat.
+
+    python benchmarks/health_under_ldap_load.py --latency 0.5 --clients 8
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import httpx
+
+from common import auth_cookie, run_server, seed_users, summary
+
+
+async def sample_health(client: httpx.AsyncClient, duration: float) -> list:
+    samples = []
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/health")
+        response.raise_for_status()
+        samples.append(time.perf_counter() - started)
+        await asyncio.sleep(0.01)
+    return samples
+
+
+async def provision_load(url: str, user_id: str, stop: asyncio.Event) -> int:
+    headers = {"Accept": "application/json"}
+    cookies = {"auth_token": auth_cookie(user_id)}
+    path = f"/api/v1/users/{user_id}/ldap_account"
+    done = 0
+    async with httpx.AsyncClient(base_url=url, cookies=cookies, timeout=60) as client:
+        await client.post(path, headers=headers)
+        while not stop.is_set():
+            await client.post(f"{path}/reset_password", headers=headers)
+            done += 1
+    return done
+
+
+async def main(args) -> None:
+    env = {"FAKE_LDAP_LATENCY": str(args.latency)}
+    with run_server(env) as server:
+        user_ids = seed_users(server["db_path"], args.clients)
+        async with httpx.AsyncClient(base_url=server["url"]) as client:
+            idle = await sample_health(client, args.duration)
+
+            stop = asyncio.Event()
+            load = [
+                asyncio.create_task(provision_load(server["url"], user_id, stop))
+                for user_id in user_ids
+            ]
+            loaded = await sample_health(client, args.duration)
+            stop.set()
+            provisioned = sum(await asyncio.gather(*load))
+
+    print(
+        json.dumps(
+            {
+                "ldap_latency": args.latency,
+                "clients": args.clients,
+                "ldap_requests": provisioned,
+                "health_idle_ms": summary(idle),
+                "health_under_load_ms": summary(loaded),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--latency", type=float, default=0.5)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=5.0)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,142 @@
+"""
+Password resets while AD stops answering, with and without the circuit breaker.
+
+Every run boots main:app in a process of its own with the fake ldap
+answering after --latency seconds. Clients reset passwords in a loop: first
+against the healthy directory, which also trains the adaptive timeout, then
+while every operation hangs until its timeout (FAKE_LDAP_HANG), then after AD
+came back. The "fixed" run disables the breaker and the adaptive timeout.
+Per phase the output has the latency, the status codes and the seconds
+requests held a worker thread; for the recovery the time to the first reset
+that went through again.
+
+    python benchmarks/ldap_circuit_breaker.py --clients 8 --outage 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, auth_cookie, seed_users, summary
+
+RUNS = {
+    "breaker": {},
+    "fixed": {
+        "LDAP__BREAKER__ENABLED": "False",
+        "LDAP__ADAPTIVE_TIMEOUT__ENABLED": "False",
+    },
+}
+
+
+def run(name: str, args) -> dict:
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "database.sqlite")
+    os.environ.update(
+        {
+            **BASE_ENV,
+            **RUNS[name],
+            "DB__PATH": db_path,
+            "DB__URL": f"sqlite:///{db_path}",
+            "LDAP__BREAKER__OPEN_SECONDS": str(args.open_seconds),
+            "LDAP__ADAPTIVE_TIMEOUT__MIN_SAMPLES": "20",
+            "FAKE_LDAP_LATENCY": str(args.latency),
+        }
+    )
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+
+    from fastapi.testclient import TestClient
+
+    from main import app
+    from services.circuit_breaker import ldap_breaker, ldap_timeout
+
+    headers = {"Accept": "application/json"}
+
+    def reset(client: TestClient, user_id: str):
+        started = time.perf_counter()
+        response = client.post(
+            f"/api/v1/users/{user_id}/ldap_account/reset_password",
+            headers=headers,
+            cookies={"auth_token": auth_cookie(user_id)},
+        )
+        return response, time.perf_counter() - started
+
+    def load(client: TestClient, user_ids, duration: float) -> dict:
+        samples, statuses, retry_after = [], Counter(), 0
+        lock = threading.Lock()
+        deadline = time.perf_counter() + duration
+
+        def loop(user_id: str) -> None:
+            nonlocal retry_after
+            while time.perf_counter() < deadline:
+                response, elapsed = reset(client, user_id)
+                with lock:
+                    samples.append(elapsed)
+                    statuses[response.status_code] += 1
+                    retry_after += "retry-after" in response.headers
+                if response.status_code == 503:
+                    # A polite client, the benchmark does not wait the full Retry-After
+                    time.sleep(0.05)
+
+        with ThreadPoolExecutor(len(user_ids)) as pool:
+            list(pool.map(loop, user_ids))
+        return {
+            "latency_ms": summary(samples),
+            "statuses": dict(statuses),
+            "with_retry_after": retry_after,
+            "request_seconds": round(sum(samples), 2),
+        }
+
+    with TestClient(app) as client:
+        user_ids = seed_users(db_path, args.clients)
+        for user_id in user_ids:
+            client.post(
+                f"/api/v1/users/{user_id}/ldap_account",
+                headers=headers,
+                cookies={"auth_token": auth_cookie(user_id)},
+            )
+        phases = {"healthy": load(client, user_ids, args.warmup)}
+        trained_timeout = ldap_timeout.current()
+
+        os.environ["FAKE_LDAP_HANG"] = BASE_ENV["LDAP__URL"]
+        phases["outage"] = load(client, user_ids, args.outage)
+        state = ldap_breaker.status()
+
+        os.environ["FAKE_LDAP_HANG"] = ""
+        started = time.perf_counter()
+        while reset(client, user_ids[0])[0].status_code != 200:
+            time.sleep(0.1)
+        recovered = time.perf_counter() - started
+
+    return {
+        "timeout_s": trained_timeout,
+        "phases": phases,
+        "circuit_after_outage": state,
+        "recovered_after_s": round(recovered, 2),
+    }
+
+
+def main(args) -> None:
+    ctx = multiprocessing.get_context("spawn")
+    results = {}
+    for name in RUNS:
+        with ctx.Pool(1) as pool:
+            results[name] = pool.apply(run, (name, args))
+    print(json.dumps({"ldap_latency": args.latency, **results}, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds")
+    parser.add_argument("--outage", type=float, default=10.0, help="seconds")
+    parser.add_argument("--open-seconds", type=float, default=3.0)
+    main(parser.parse_args())
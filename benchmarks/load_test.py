@@ -0,0 +1,268 @@
+"""
+Mixed traffic against main:app with per-route throughput and latency.
+
+Boots main:app with uvicorn on a temporary SQLite file and the fake ldap,
+seeds SSO users, forges their auth_token cookies and keeps --clients virtual
+users busy for --duration seconds. Every request picks a route by the
+weights of --mix: the home page, GET /ldap_account, a password reset, or an
+account creation for a user that has none yet. FAKE_LDAP_* variables of the
+environment reach the server, --ldap-latency and --ldap-failure-rate are
+shortcuts for the common ones.
+
+Results are JSON with the git revision, to stdout or --output. With
+--baseline the change of throughput and latency against an earlier result
+file is added, so two branches can be compared:
+
+    python load_test.py --clients 16 --duration 30 --output main.json
+    git checkout my-branch
+    python load_test.py --clients 16 --duration 30 --baseline main.json
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import subprocess
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+
+from common import ROOT, auth_cookie, run_server, seed_users, summary
+
+JSON = {"Accept": "application/json"}
+USERS_PATH = "/api/v1/users"
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for item in value.split(","):
+        route, _, weight = item.partition("=")
+        if route not in ROUTES:
+            raise argparse.ArgumentTypeError(f"unknown route '{route}'")
+        mix[route] = float(weight)
+    return mix
+
+
+class Traffic:
+    """Users with and without an account, and the samples per route"""
+
+    def __init__(self, with_account: List[str], without_account: List[str]):
+        self.with_account = with_account
+        self.without_account = without_account
+        self.samples: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.recording = False
+
+    def record(self, route: str, status: str, elapsed: float) -> None:
+        if self.recording:
+            self.samples[route].append(elapsed)
+            self.statuses[route][status] += 1
+
+
+async def home(client: httpx.AsyncClient, traffic: Traffic) -> Optional[int]:
+    user_id = random.choice(traffic.with_account)
+    response = await client.get("/", cookies={"auth_token": auth_cookie(user_id)})
+    return response.status_code
+
+
+async def account(client: httpx.AsyncClient, traffic: Traffic) -> Optional[int]:
+    user_id = random.choice(traffic.with_account)
+    response = await client.get(
+        f"{USERS_PATH}/{user_id}/ldap_account",
+        headers=JSON,
+        cookies={"auth_token": auth_cookie(user_id)},
+    )
+    return response.status_code
+
+
+async def reset(client: httpx.AsyncClient, traffic: Traffic) -> Optional[int]:
+    user_id = random.choice(traffic.with_account)
+    response = await client.post(
+        f"{USERS_PATH}/{user_id}/ldap_account/reset_password",
+        headers=JSON,
+        cookies={"auth_token": auth_cookie(user_id)},
+    )
+    return response.status_code
+
+
+async def create(client: httpx.AsyncClient, traffic: Traffic) -> Optional[int]:
+    if not traffic.without_account:
+        return None
+    user_id = traffic.without_account.pop()
+    response = await client.post(
+        f"{USERS_PATH}/{user_id}/ldap_account",
+        headers=JSON,
+        cookies={"auth_token": auth_cookie(user_id)},
+    )
+    if response.status_code == 200:
+        traffic.with_account.append(user_id)
+    return response.status_code
+
+
+ROUTES = {"home": home, "account": account, "reset": reset, "create": create}
+
+
+async def virtual_user(
+    client: httpx.AsyncClient, traffic: Traffic, mix: Dict[str, float], deadline: float
+) -> None:
+    routes, weights = list(mix), list(mix.values())
+    while time.perf_counter() < deadline:
+        route = random.choices(routes, weights)[0]
+        started = time.perf_counter()
+        try:
+            status = await ROUTES[route](client, traffic)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if status is not None:
+            traffic.record(route, str(status), time.perf_counter() - started)
+
+
+async def drive(url: str, traffic: Traffic, args) -> float:
+    """Runs the virtual users, returns the measured seconds"""
+    limits = httpx.Limits(max_connections=args.clients)
+    async with httpx.AsyncClient(base_url=url, timeout=60, limits=limits) as client:
+        # Accounts for the users the other routes need
+        for user_id in traffic.with_account:
+            await client.post(
+                f"{USERS_PATH}/{user_id}/ldap_account",
+                headers=JSON,
+                cookies={"auth_token": auth_cookie(user_id)},
+            )
+        deadline = time.perf_counter() + args.warmup + args.duration
+        users = [
+            asyncio.create_task(virtual_user(client, traffic, args.mix, deadline))
+            for _ in range(args.clients)
+        ]
+        await asyncio.sleep(args.warmup)
+        traffic.recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*users)
+        return time.perf_counter() - started
+
+
+def is_error(status: str) -> bool:
+    """Server errors and failed connections, 4xx are answers of the service"""
+    return not status.isdigit() or int(status) >= 500
+
+
+def report(traffic: Traffic, elapsed: float) -> Dict[str, Dict]:
+    routes = {}
+    for route in ROUTES:
+        samples = traffic.samples.get(route, [])
+        if not samples:
+            continue
+        statuses = traffic.statuses[route]
+        routes[route] = {
+            "requests": len(samples),
+            "rps": round(len(samples) / elapsed, 1),
+            "errors": sum(n for status, n in statuses.items() if is_error(status)),
+            "statuses": dict(statuses),
+            "latency_ms": summary(samples),
+        }
+    every = [sample for samples in traffic.samples.values() for sample in samples]
+    routes["total"] = {
+        "requests": len(every),
+        "rps": round(len(every) / elapsed, 1),
+        "errors": sum(route["errors"] for route in routes.values()),
+        "latency_ms": summary(every),
+    }
+    return routes
+
+
+def revision() -> Dict[str, object]:
+    def git(*args: str) -> str:
+        return subprocess.run(
+            ["git", *args], cwd=ROOT, capture_output=True, text=True
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "--short", "HEAD"),
+        "branch": git("rev-parse", "--abbrev-ref", "HEAD"),
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+def compare(routes: Dict[str, Dict], baseline: Dict[str, Dict]) -> Dict[str, Dict]:
+    """Change against the baseline in percent, positive rps and negative latency are better"""
+
+    def change(new: float, old: float) -> Optional[float]:
+        return round((new - old) / old * 100, 1) if old else None
+
+    changes = {}
+    for route, result in routes.items():
+        old = baseline.get(route)
+        if old is None:
+            continue
+        changes[route] = {
+            "rps": change(result["rps"], old["rps"]),
+            **{
+                key: change(result["latency_ms"][key], old["latency_ms"][key])
+                for key in ("p50", "p95", "p99")
+            },
+        }
+    return changes
+
+
+async def main(args) -> None:
+    env = {}
+    if args.ldap_latency is not None:
+        env["FAKE_LDAP_LATENCY"] = str(args.ldap_latency)
+    if args.ldap_failure_rate is not None:
+        env["FAKE_LDAP_FAILURE_RATE"] = str(args.ldap_failure_rate)
+    with run_server(env, workers=args.workers) as server:
+        user_ids = seed_users(server["db_path"], args.users + args.new_users)
+        traffic = Traffic(user_ids[: args.users], user_ids[args.users :])
+        elapsed = await drive(server["url"], traffic, args)
+
+    result = {
+        "revision": revision(),
+        "date": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "args": {
+            key: value
+            for key, value in vars(args).items()
+            if key not in ("output", "baseline")
+        },
+        "seconds": round(elapsed, 2),
+        "routes": report(traffic, elapsed),
+    }
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        result["baseline"] = baseline["revision"]
+        result["change_percent"] = compare(result["routes"], baseline["routes"])
+
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    print(output)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--clients", type=int, default=16, help="virtual users")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="seconds")
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--users", type=int, default=50, help="users with an account")
+    parser.add_argument(
+        "--new-users", type=int, default=2000, help="users the create route can use"
+    )
+    parser.add_argument(
+        "--mix",
+        type=parse_mix,
+        default="home=50,account=30,reset=15,create=5",
+        help="route weights",
+    )
+    parser.add_argument("--ldap-latency", type=float, help="FAKE_LDAP_LATENCY")
+    parser.add_argument(
+        "--ldap-failure-rate", type=float, help="FAKE_LDAP_FAILURE_RATE"
+    )
+    parser.add_argument("--output", help="write the JSON result to this file")
+    parser.add_argument("--baseline", help="earlier result file to compare with")
+    asyncio.run(main(parser.parse_args()))
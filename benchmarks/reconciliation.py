@@ -0,0 +1,166 @@
+"""
+Reconciliation of the account records with AD, full and incremental.
+
+Seeds --accounts users in the fake ldap and their records in a temporary
+SQLite file, then runs Reconciler in phases: the first (full) run pages
+through every user object; --changes accounts are disabled, deleted and moved
+out of the users DN and an incremental run reads only what changed since;
+the disabled accounts are enabled again and the next run resolves their
+drift. Every search costs --latency seconds in the fake directory. For
+comparison the output also has the time of checking every account with a
+search of its own, as a per-row sync would.
+
+    python benchmarks/reconciliation.py --accounts 5000 --changes 50
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, seed_users
+
+
+def run(args) -> dict:
+    tmp = tempfile.mkdtemp()
+    db_path = os.path.join(tmp, "database.sqlite")
+    os.environ.update(
+        {
+            **BASE_ENV,
+            "DB__PATH": db_path,
+            "DB__URL": f"sqlite:///{db_path}",
+            "RECONCILE__PAGE_SIZE": str(args.page_size),
+        }
+    )
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+
+    import ldap
+    from ldap import modlist
+
+    from models.database import SessionLocal, init_db
+    from services.ad_service import ADService
+    from services.provisioning import build_user_attributes, provisioning_plan
+    from services.reconciliation import Reconciler
+
+    users_dn = BASE_ENV["LDAP__DEFAULT_USERS_DN"]
+    base_dn = BASE_ENV["LDAP__BASE_DN"]
+    moved_dn = f"OU=Moved,{base_dn}"
+
+    init_db()
+    connection = ldap.initialize(BASE_ENV["LDAP__URL"])
+    for ou_dn in [*provisioning_plan.ou_dns(), moved_dn]:
+        ou = ou_dn.split(",")[0].split("=")[1]
+        connection.add_s(ou_dn, modlist.addModlist({"objectClass": [b"top"], "ou": ou}))
+    usernames = [f"rec_bench_{i}" for i in range(args.accounts)]
+    for username in usernames:
+        attributes = build_user_attributes(username, f"{username}@example.com")
+        connection.add_s(
+            f"CN={username},{users_dn}",
+            modlist.addModlist(provisioning_plan.user_attributes(attributes)),
+        )
+    user_ids = seed_users(db_path, args.accounts)
+    with sqlite3.connect(db_path) as conn:
+        conn.executemany(
+            "INSERT INTO ldap_accounts (kadmin_principal, sso_user_id, created_at) "
+            "VALUES (?, ?, CURRENT_TIMESTAMP)",
+            zip(usernames, user_ids),
+        )
+
+    os.environ["FAKE_LDAP_LATENCY"] = str(args.latency)
+
+    def reconcile(full: bool = False) -> dict:
+        db = SessionLocal()
+        started = time.perf_counter()
+        try:
+            result = Reconciler(db).run(full=full)
+        finally:
+            db.close()
+        return {
+            "mode": result["mode"],
+            "seconds": round(time.perf_counter() - started, 3),
+            "entries": result["entries"],
+            "pages": result["pages"],
+            "found": result["found"],
+            "resolved": result["resolved"],
+        }
+
+    def open_drift() -> dict:
+        with sqlite3.connect(db_path) as conn:
+            rows = conn.execute(
+                "SELECT kind, count(*) FROM account_drift "
+                "WHERE resolved_at IS NULL GROUP BY kind"
+            ).fetchall()
+        return dict(rows)
+
+    phases = {"first": reconcile()}
+
+    # A third of the changes each
+    changed = usernames[:: max(1, args.accounts // args.changes)][: args.changes]
+    disabled, deleted, moved = changed[0::3], changed[1::3], changed[2::3]
+    for username in disabled:
+        connection.modify_s(
+            f"CN={username},{users_dn}",
+            [(ldap.MOD_REPLACE, "userAccountControl", b"66050")],
+        )
+    for username in deleted:
+        connection.delete_s(f"CN={username},{users_dn}")
+    for username in moved:
+        connection.rename_s(f"CN={username},{users_dn}", f"CN={username}", moved_dn)
+    phases["changed"] = reconcile()
+    phases["changed"]["open_drift"] = open_drift()
+
+    for username in disabled:
+        connection.modify_s(
+            f"CN={username},{users_dn}",
+            [(ldap.MOD_REPLACE, "userAccountControl", b"66048")],
+        )
+    phases["enabled_again"] = reconcile()
+    phases["enabled_again"]["open_drift"] = open_drift()
+    phases["forced_full"] = reconcile(full=True)
+
+    # What checking every account on its own costs
+    service = ADService()
+    service.connect()
+    started = time.perf_counter()
+    try:
+        for username in usernames:
+            try:
+                service._execute(
+                    "search_s", f"CN={username},{users_dn}", ldap.SCOPE_BASE
+                )
+            except ldap.NO_SUCH_OBJECT:
+                pass
+    finally:
+        service.disconnect()
+    per_row = round(time.perf_counter() - started, 3)
+
+    return {
+        "accounts": args.accounts,
+        "changes": len(changed),
+        "latency_s": args.latency,
+        "page_size": args.page_size,
+        "phases": phases,
+        "per_account_search_seconds": per_row,
+    }
+
+
+def main(args) -> None:
+    # The app reads its settings at import, so it runs in a fresh process
+    ctx = multiprocessing.get_context("spawn")
+    with ctx.Pool(1) as pool:
+        result = pool.apply(run, (args,))
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--accounts", type=int, default=5000)
+    parser.add_argument("--changes", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.002, help="per search")
+    main(parser.parse_args())
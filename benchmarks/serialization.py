@@ -0,0 +1,162 @@
+"""
+CPU cost of building the JSON body of the account and user responses.
+
+The previous code paths (column introspection, display name remapping,
+jsonable_encoder over ORM objects, response model validation and the stdlib
+JSONResponse) are timed against the precompiled serializers with orjson on
+the same transient ORM objects. No server or database is involved. Both
+paths decrypt the passwords, --no-decrypt leaves that cost out.
+
+    python benchmarks/serialization.py --accounts 1 --rounds 20000
+"""
+
+import argparse
+import json
+import os
+import sys
+import timeit
+import uuid
+from datetime import datetime
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR
+
+
+def configure() -> None:
+    os.environ.update(BASE_ENV)
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+
+
+def canonical(body: bytes) -> str:
+    return json.dumps(json.loads(body))
+
+
+def main(args) -> None:
+    configure()
+    from fastapi.encoders import jsonable_encoder
+    from fastapi.responses import JSONResponse, ORJSONResponse
+
+    import orjson
+    from models.ldap_accounts import LDAPAccount
+    from models.users import SSOUser
+    from schemas import SSOUserResponse
+    from schemas.ldap import LDAPAccountDisplay, LDAPAccountResponse
+    from services.encryption import encryptor
+    from services.serializers import ModelSerializer, serialize_sso_user
+
+    if args.no_decrypt:
+        reveal = str
+        password = "x" * 20
+    else:
+        reveal = encryptor.reveal_password
+        password = encryptor.encrypt_password("x" * 20)
+    # Configured like the application's serializers
+    serialize_account = ModelSerializer(
+        LDAPAccountResponse, {"kadmin_password": reveal}
+    )
+    serialize_display = ModelSerializer(LDAPAccountDisplay, {"kadmin_password": reveal})
+
+    user = SSOUser(
+        id=str(uuid.uuid4()),
+        username="john_doe",
+        email="john.doe@example.com",
+        sso_id="1234567890",
+        picture="https://example.com/john.png",
+        created_at=datetime.now(),
+    )
+    accounts = [
+        LDAPAccount(
+            kdc_hosts="dc1.example.com",
+            realm="EXAMPLE.COM",
+            kadmin_server="dc1.example.com",
+            kadmin_principal=f"john_doe_{i}",
+            kadmin_password=password,
+            admin_dn=f"CN=john_doe_{i},OU=Users,DC=example,DC=com",
+            ldap_url="ldap://dc1.example.com",
+            container_dn=f"OU=john_doe_{i}_ou,OU=Users,DC=example,DC=com",
+            created_at=datetime.now(),
+            version=1,
+            sso_user_id=user.id,
+        )
+        for i in range(args.accounts)
+    ]
+
+    def list_before() -> bytes:
+        content = []
+        for account in accounts:
+            fields = {
+                col.name: getattr(account, col.name)
+                for col in LDAPAccount.__table__.columns
+            }
+            fields["kadmin_password"] = reveal(account.kadmin_password)
+            content.append(fields)
+        return JSONResponse(content=jsonable_encoder(content)).body
+
+    def list_after() -> bytes:
+        return orjson.dumps([serialize_account(account) for account in accounts])
+
+    def create_before() -> bytes:
+        account = accounts[0]
+        columns = [
+            col.name
+            for col in LDAPAccount.__table__.columns
+            if col.name not in ["sso_user_id", "created_at", "version", "updated_at"]
+        ]
+        account_dict = {col: getattr(account, col) for col in columns}
+        account_dict["kadmin_password"] = reveal(account.kadmin_password)
+        display_account = {
+            LDAPAccount.display_names.get(col, col): value
+            for col, value in account_dict.items()
+        }
+        return JSONResponse(
+            content={"message": "created", "account": display_account}
+        ).body
+
+    def create_after() -> bytes:
+        display_account = serialize_display(accounts[0])
+        return ORJSONResponse(
+            content={"message": "created", "account": display_account}
+        ).body
+
+    def user_before() -> bytes:
+        # What FastAPI does with response_model for a returned ORM object
+        model = SSOUserResponse.model_validate(user)
+        return JSONResponse(content=jsonable_encoder(model)).body
+
+    def user_after() -> bytes:
+        return ORJSONResponse(serialize_sso_user(user)).body
+
+    results = {}
+    for name, before, after in [
+        ("account_list", list_before, list_after),
+        ("account_create", create_before, create_after),
+        ("sso_user", user_before, user_after),
+    ]:
+        # Same document either way, in the same key order
+        assert canonical(before()) == canonical(after()), name
+        timings = {}
+        for label, func in [("before", before), ("after", after)]:
+            best = min(timeit.repeat(func, number=args.rounds, repeat=args.repeat))
+            timings[f"{label}_us"] = round(best / args.rounds * 1e6, 2)
+        timings["speedup"] = round(timings["before_us"] / timings["after_us"], 2)
+        results[name] = timings
+
+    print(
+        json.dumps(
+            {
+                "accounts": args.accounts,
+                "decrypt": not args.no_decrypt,
+                "per_response": results,
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--accounts", type=int, default=1)
+    parser.add_argument("--rounds", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--no-decrypt", action="store_true")
+    main(parser.parse_args())
@@ -0,0 +1,174 @@
+"""
+SQLite under concurrent writers and readers, default vs tuned profile.
+
+Writer processes create account records and reset passwords, each commit in
+its own transaction, while reader processes run the queries of the home page.
+Every process uses the application engine, so DB__SQLITE__TUNED decides which
+connect events are installed:
+
+    python benchmarks/sqlite_concurrency.py --writers 4 --readers 4 --seconds 10
+"""
+
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, summary
+
+
+def configure(db_path: str, tuned: bool) -> None:
+    os.environ.update(BASE_ENV)
+    os.environ["DB__PATH"] = db_path
+    os.environ["DB__URL"] = f"sqlite:///{db_path}"
+    os.environ["DB__SQLITE__TUNED"] = str(tuned)
+    sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+    os.chdir(APP_DIR)
+
+
+def count_error(errors: dict, e: Exception) -> None:
+    error = str(getattr(e, "orig", None) or e).split("\n")[0]
+    errors[error] = errors.get(error, 0) + 1
+
+
+def writer(db_path, tuned, user_ids, seconds, barrier, results) -> None:
+    configure(db_path, tuned)
+    from models.database import SessionLocal
+    from models.ldap_accounts import LDAPAccount
+    from models.users import SSOUser  # noqa
+    from services.encryption import PasswordEncryptor
+
+    password = PasswordEncryptor().encrypt_password("password")
+    latencies, errors = [], {}
+    db = SessionLocal()
+    principals = []
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        try:
+            if principals and len(latencies) % 2:
+                # Password reset of an existing record
+                account = db.get(LDAPAccount, principals[-1])
+                account.kadmin_password = password
+            else:
+                principal = f"bench_{uuid.uuid4().hex}"
+                db.add(
+                    LDAPAccount(
+                        kadmin_principal=principal,
+                        kadmin_password=password,
+                        sso_user_id=user_ids[len(latencies) % len(user_ids)],
+                    )
+                )
+                principals.append(principal)
+            db.commit()
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            db.rollback()
+            count_error(errors, e)
+    db.close()
+    results.put({"writes": latencies, "reads": [], "errors": errors})
+
+
+def reader(db_path, tuned, user_ids, seconds, barrier, results) -> None:
+    configure(db_path, tuned)
+    from models.database import SessionLocal
+    from services.db_service import DBService
+
+    latencies, errors = [], {}
+    i = 0
+    barrier.wait()
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        db = SessionLocal()
+        try:
+            db_service = DBService(db)
+            user = db_service.get_sso_user_by_id(user_ids[i % len(user_ids)])
+            db_service.get_ldap_accounts_by_user_id(user.id)
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            count_error(errors, e)
+        finally:
+            db.close()
+        i += 1
+    results.put({"writes": [], "reads": latencies, "errors": errors})
+
+
+def run(args, tuned: bool) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "database.sqlite")
+        context = multiprocessing.get_context("spawn")
+        with context.Pool(1) as pool:
+            user_ids = pool.apply(prepare, ((db_path, tuned, args.users),))
+
+        # Workers start measuring together, once all of them are imported
+        barrier = context.Barrier(args.writers + args.readers)
+        queue = context.Queue()
+        worker_args = (db_path, tuned, user_ids, args.seconds, barrier, queue)
+        processes = [
+            context.Process(target=target, args=worker_args)
+            for target in [writer] * args.writers + [reader] * args.readers
+        ]
+        for process in processes:
+            process.start()
+        results = [queue.get() for _ in processes]
+        for process in processes:
+            process.join()
+
+    errors = {}
+    for result in results:
+        for error, count in result["errors"].items():
+            errors[error] = errors.get(error, 0) + count
+    write_latencies = [value for result in results for value in result["writes"]]
+    read_latencies = [value for result in results for value in result["reads"]]
+    return {
+        "profile": "tuned" if tuned else "default",
+        "errors": errors,
+        "writes_per_second": round(len(write_latencies) / args.seconds, 1),
+        "reads_per_second": round(len(read_latencies) / args.seconds, 1),
+        "write_latency_ms": summary(write_latencies),
+        "read_latency_ms": summary(read_latencies),
+    }
+
+
+def prepare(args) -> list:
+    """Creates the schema and the users whose accounts are written"""
+    db_path, tuned, count = args
+    configure(db_path, tuned)
+    from models.database import SessionLocal, init_db
+    from models.users import SSOUser
+    from models.ldap_accounts import LDAPAccount  # noqa
+
+    init_db()
+    db = SessionLocal()
+    users = [
+        SSOUser(
+            username=f"bench_{i}",
+            email=f"bench.{i}@example.com",
+            sso_id=f"sso-{i}",
+            picture="",
+        )
+        for i in range(count)
+    ]
+    db.add_all(users)
+    db.commit()
+    user_ids = [user.id for user in users]
+    db.close()
+    return user_ids
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--writers", type=int, default=4)
+    parser.add_argument("--readers", type=int, default=4)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    parser.add_argument("--users", type=int, default=200)
+    arguments = parser.parse_args()
+    print(
+        json.dumps([run(arguments, tuned=False), run(arguments, tuned=True)], indent=2)
+    )
@@ -0,0 +1,165 @@
+"""
+Startup cost of the service: import profile and time to the first request.
+
+The import profile runs `python -X importtime -c "import main"` and sums the
+time per top-level package, the slowest first. Then the server is started
+--repeat times per run and the seconds from spawning the process to the
+first 200 of GET /login (routing, middleware and a template) are measured:
+
+    uvicorn        one uvicorn worker, database already migrated
+    uvicorn_fresh  one uvicorn worker migrating an empty database
+    gunicorn       gunicorn.conf.py with --workers, the master migrates once
+
+With --budget the script exits with status 1 if the median of the gunicorn
+run is slower, so a CI job can track it:
+
+    python benchmarks/startup.py --repeat 5 --workers 4 --budget 3
+"""
+
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List
+
+import httpx
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, free_port
+
+IMPORT_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \| ( *)(\S+)")
+
+
+def server_env(tmp: str) -> Dict[str, str]:
+    db_path = os.path.join(tmp, "database.sqlite")
+    os.makedirs(os.path.join(tmp, "metrics"))
+    return {
+        **os.environ,
+        **BASE_ENV,
+        "DB__PATH": db_path,
+        "DB__URL": f"sqlite:///{db_path}",
+        "RUN__TEMPLATE_CACHE": os.path.join(tmp, "templates"),
+        "PROMETHEUS_MULTIPROC_DIR": os.path.join(tmp, "metrics"),
+        "FAKE_LDAP_DIRECTORY": os.path.join(tmp, "directory.sqlite"),
+        "PYTHONPATH": os.pathsep.join([str(FAKES_DIR), str(APP_DIR)]),
+    }
+
+
+def import_profile(top: int) -> dict:
+    with tempfile.TemporaryDirectory() as tmp:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import main"],
+            cwd=APP_DIR,
+            env=server_env(tmp),
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    packages: Dict[str, int] = defaultdict(int)
+    total = 0
+    for self_us, cumulative_us, indent, name in IMPORT_LINE.findall(result.stderr):
+        packages[name.split(".")[0]] += int(self_us)
+        if name == "main" and not indent:
+            total = int(cumulative_us)
+    slowest = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    return {
+        "import_main_ms": round(total / 1000, 1),
+        "slowest_packages_ms": {
+            name: round(us / 1000, 1) for name, us in slowest[:top]
+        },
+    }
+
+
+def first_request(command: List[str], migrate: bool) -> float:
+    """Seconds from spawning the server to the first page it served"""
+    with tempfile.TemporaryDirectory() as tmp:
+        env = server_env(tmp)
+        if migrate:
+            subprocess.run(
+                [sys.executable, "cli.py", "migrate"],
+                cwd=APP_DIR,
+                env=env,
+                check=True,
+                capture_output=True,
+            )
+        port = free_port()
+        url = f"http://127.0.0.1:{port}/login"
+        if "gunicorn" in command[2]:
+            command = [*command, "--bind", f"127.0.0.1:{port}"]
+        else:
+            command = [*command, "--port", str(port)]
+        # A new client per attempt would cost more than the polling interval
+        client = httpx.Client(timeout=1)
+        started = time.perf_counter()
+        process = subprocess.Popen(
+            command,
+            cwd=APP_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            while time.perf_counter() - started < 60:
+                try:
+                    if client.get(url).status_code == 200:
+                        return time.perf_counter() - started
+                except httpx.HTTPError:
+                    pass
+                time.sleep(0.01)
+            raise RuntimeError(f"{command[2]} did not answer within 60 seconds")
+        finally:
+            client.close()
+            process.terminate()
+            process.wait(timeout=30)
+
+
+def measure(command: List[str], migrate: bool, repeat: int) -> dict:
+    samples = [first_request(command, migrate) for _ in range(repeat)]
+    return {
+        "median_s": round(statistics.median(samples), 3),
+        "min_s": round(min(samples), 3),
+        "max_s": round(max(samples), 3),
+    }
+
+
+def main(args) -> int:
+    uvicorn = [sys.executable, "-m", "uvicorn", "main:app", "--log-level", "warning"]
+    gunicorn = [
+        sys.executable,
+        "-m",
+        "gunicorn",
+        "main:app",
+        "--config",
+        "gunicorn.conf.py",
+        "--workers",
+        str(args.workers),
+    ]
+    result = {
+        **import_profile(args.top),
+        "first_request": {
+            "uvicorn": measure(uvicorn, True, args.repeat),
+            "uvicorn_fresh": measure(uvicorn, False, args.repeat),
+            "gunicorn": measure(gunicorn, False, args.repeat),
+        },
+        "workers": args.workers,
+    }
+    over = args.budget and result["first_request"]["gunicorn"]["median_s"] > args.budget
+    if args.budget:
+        result["budget_s"] = args.budget
+        result["within_budget"] = not over
+    print(json.dumps(result, indent=2))
+    return 1 if over else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--workers", type=int, default=4, help="gunicorn workers")
+    parser.add_argument("--top", type=int, default=10, help="packages in the profile")
+    parser.add_argument("--budget", type=float, help="seconds to the first request")
+    sys.exit(main(parser.parse_args()))
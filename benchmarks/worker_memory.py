@@ -0,0 +1,180 @@
+"""
+Memory of gunicorn workers in preload mode after some traffic.
+
+Starts main:app with gunicorn.conf.py and --workers against a temporary
+SQLite file and the fake ldap, creates accounts and loads pages and account
+JSON for --seconds from --clients threads, then reads /proc of the master
+and every worker: RSS, PSS (shared pages divided among the processes that
+map them), shared and private bytes. Sockets a worker has open that are also
+open in the master, other than the listening one, are connections it
+inherited at fork.
+
+Run it on two revisions to compare:
+
+    python benchmarks/worker_memory.py --workers 4 --seconds 10
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Set
+
+import httpx
+
+from common import APP_DIR, BASE_ENV, FAKES_DIR, auth_cookie, free_port, seed_users
+
+JSON = {"Accept": "application/json"}
+SMAPS_FIELDS = {
+    "Rss": "rss",
+    "Pss": "pss",
+    "Shared_Clean": "shared",
+    "Shared_Dirty": "shared",
+    "Private_Clean": "private",
+    "Private_Dirty": "private",
+}
+
+
+def memory(pid: int) -> Dict[str, float]:
+    """MiB per kind from smaps_rollup"""
+    values = dict.fromkeys(SMAPS_FIELDS.values(), 0)
+    with open(f"/proc/{pid}/smaps_rollup") as f:
+        for line in f:
+            name, _, rest = line.partition(":")
+            if name in SMAPS_FIELDS:
+                values[SMAPS_FIELDS[name]] += int(rest.split()[0])
+    return {kind: round(kib / 1024, 1) for kind, kib in values.items()}
+
+
+def sockets(pid: int) -> Set[str]:
+    found = set()
+    for fd in os.listdir(f"/proc/{pid}/fd"):
+        try:
+            target = os.readlink(f"/proc/{pid}/fd/{fd}")
+        except OSError:
+            continue
+        if target.startswith("socket:"):
+            found.add(target)
+    return found
+
+
+def children(pid: int) -> List[int]:
+    with open(f"/proc/{pid}/task/{pid}/children") as f:
+        return [int(child) for child in f.read().split()]
+
+
+def traffic(url: str, user_ids: List[str], seconds: float, clients: int) -> int:
+    deadline = time.perf_counter() + seconds
+
+    def loop(user_ids: List[str]) -> int:
+        requests = 0
+        with httpx.Client(base_url=url, timeout=30) as client:
+            while time.perf_counter() < deadline:
+                for user_id in user_ids:
+                    cookies = {"auth_token": auth_cookie(user_id)}
+                    client.get("/", cookies=cookies)
+                    client.get(
+                        f"/api/v1/users/{user_id}/ldap_account",
+                        headers=JSON,
+                        cookies=cookies,
+                    )
+                    requests += 2
+        return requests
+
+    with ThreadPoolExecutor(clients) as pool:
+        return sum(pool.map(loop, [user_ids[i::clients] for i in range(clients)]))
+
+
+def main(args) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "database.sqlite")
+        metrics_dir = os.path.join(tmp, "metrics")
+        os.makedirs(metrics_dir)
+        env = {
+            **os.environ,
+            **BASE_ENV,
+            "DB__PATH": db_path,
+            "DB__URL": f"sqlite:///{db_path}",
+            "PROMETHEUS_MULTIPROC_DIR": metrics_dir,
+            "FAKE_LDAP_DIRECTORY": os.path.join(tmp, "directory.sqlite"),
+            "PYTHONPATH": os.pathsep.join([str(FAKES_DIR), str(APP_DIR)]),
+        }
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        process = subprocess.Popen(
+            [
+                sys.executable,
+                "-m",
+                "gunicorn",
+                "main:app",
+                "--config",
+                "gunicorn.conf.py",
+                "--workers",
+                str(args.workers),
+                "--bind",
+                f"127.0.0.1:{port}",
+            ],
+            cwd=APP_DIR,
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            with httpx.Client(base_url=url, timeout=30) as client:
+                while True:
+                    try:
+                        if client.get("/login").status_code == 200:
+                            break
+                    except httpx.HTTPError:
+                        time.sleep(0.05)
+                user_ids = seed_users(db_path, args.users)
+                for user_id in user_ids:
+                    client.post(
+                        f"/api/v1/users/{user_id}/ldap_account",
+                        headers=JSON,
+                        cookies={"auth_token": auth_cookie(user_id)},
+                    )
+            requests = traffic(url, user_ids, args.seconds, args.clients)
+
+            master = process.pid
+            workers = children(master)
+            master_sockets = sockets(master)
+            master_memory = memory(master)
+            per_worker = {}
+            for pid in workers:
+                inherited = sockets(pid) & master_sockets
+                per_worker[pid] = {
+                    **memory(pid),
+                    # The listening socket is shared on purpose
+                    "sockets_shared_with_master": len(inherited) - 1,
+                }
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    result = {
+        "workers": len(workers),
+        "requests": requests,
+        "master_mib": master_memory,
+        "worker_mib": {
+            kind: round(statistics.mean(w[kind] for w in per_worker.values()), 1)
+            for kind in ("rss", "pss", "shared", "private")
+        },
+        "pss_total_mib": round(sum(w["pss"] for w in per_worker.values()), 1),
+        "per_worker": list(per_worker.values()),
+    }
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--clients", type=int, default=8)
+    parser.add_argument("--seconds", type=float, default=10.0)
+    main(parser.parse_args())
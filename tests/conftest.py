@@ -0,0 +1,127 @@
+"""
+Tests run the service code against the fake python-ldap of the benchmarks
+and a temporary SQLite database. Settings are read when config is imported,
+so the environment is set up here, before any test module imports the app.
+"""
+
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+APP_DIR = ROOT / "adam"
+FAKES_DIR = ROOT / "benchmarks" / "fakes"
+TMP_DIR = tempfile.mkdtemp(prefix="adam-tests-")
+DB_PATH = os.path.join(TMP_DIR, "database.sqlite")
+
+USERS_DN = "OU=Users,OU=ADAM,DC=test,DC=local"
+GROUP_DNS = ["CN=G1,DC=test,DC=local", "CN=G2,DC=test,DC=local"]
+
+os.environ.update(
+    {
+        "SSO__CLIENT_ID": "test",
+        "SSO__CLIENT_SECRET": "test",
+        "SSO__REDIRECT_URI": "http://localhost/api/auth/callback",
+        "SSO__ALLOW_INSECURE_HTTP": "True",
+        "LDAP__DOMAIN": "test.local",
+        "LDAP__BASE_DN": "DC=test,DC=local",
+        "LDAP__URL": "ldap://dc1.test.local",
+        "LDAP__ADMIN_DN": "CN=Administrator,CN=Users,DC=test,DC=local",
+        "LDAP__ADMIN_PASS": "test",
+        "LDAP__DEFAULT_USERS_DN": USERS_DN,
+        "LDAP__MEMBER_OF_GROUPS": f'["{GROUP_DNS[0]}","{GROUP_DNS[1]}"]',
+        "ENCRYPTION__SECRET_KEY": "69d83bkt3TTanCC8Nxw/9viMh7nhBvQPv7NEqQNS7JQ=",
+        "ENCRYPTION__USER_SESSION_KEY": "3q6i7yV3zY7fH7k3tM0xQ5vT9sK8jW2rL4pN6mP8qR0=",
+        "DB__PATH": DB_PATH,
+        "DB__URL": f"sqlite:///{DB_PATH}",
+        "RUN__TEMPLATE_CACHE": os.path.join(TMP_DIR, "templates"),
+        "LOG__LEVEL": "WARNING",
+    }
+)
+sys.path[:0] = [str(FAKES_DIR), str(APP_DIR)]
+# Alembic, the templates and the data directories are relative to the app
+os.chdir(APP_DIR)
+
+import ldap  # noqa: E402
+from ldap import modlist  # noqa: E402
+
+from models.database import SessionLocal, async_engine, init_db  # noqa: E402
+from models.users import SSOUser  # noqa: E402
+from services.circuit_breaker import ldap_breaker  # noqa: E402
+from services.domain_controllers import domain_controllers  # noqa: E402
+from services.ldap_pool import ldap_pool  # noqa: E402
+from services.provisioning import known_dns  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def database():
+    init_db()
+    yield
+    shutil.rmtree(TMP_DIR, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def directory(monkeypatch):
+    """An empty directory with the configured groups, every DC up"""
+    for name in list(os.environ):
+        if name.startswith("FAKE_LDAP_"):
+            monkeypatch.delenv(name)
+    ldap.reset_directory()
+    ldap_pool.after_fork()
+    known_dns.clear()
+    for dc in domain_controllers.dcs:
+        domain_controllers.mark_up(dc.url)
+    ldap_breaker.record_success()
+
+    connection = ldap.initialize(os.environ["LDAP__URL"])
+    for group_dn in GROUP_DNS:
+        cn = group_dn.split(",")[0].split("=")[1]
+        connection.add_s(
+            group_dn, modlist.addModlist({"objectClass": [b"group"], "cn": cn})
+        )
+    return connection
+
+
+@pytest.fixture
+def run():
+    """Runs a coroutine in a new event loop, closing the async connections after"""
+
+    def run(coro):
+        async def main():
+            try:
+                return await coro
+            finally:
+                await async_engine.dispose()
+
+        return asyncio.run(main())
+
+    return run
+
+
+@pytest.fixture
+def make_user():
+    """Stores an SSO user, returns its id"""
+    created = []
+
+    def make_user(name: str) -> str:
+        with SessionLocal() as db:
+            user = SSOUser(
+                username=name, email=f"{name}@example.com", sso_id=name, picture=""
+            )
+            db.add(user)
+            db.commit()
+            created.append(user.id)
+            return user.id
+
+    yield make_user
+    with SessionLocal() as db:
+        for user_id in created:
+            user = db.get(SSOUser, user_id)
+            if user is not None:
+                db.delete(user)
+        db.commit()
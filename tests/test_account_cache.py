@@ -0,0 +1,69 @@
+import pickle
+
+from conftest import USERS_DN
+from models.database import SessionLocal
+from models.ldap_accounts import LDAPAccount
+from services.account_cache import (
+    AccountsHTML,
+    AccountsVersion,
+    get_fragment,
+    reveal_passwords,
+    set_fragment,
+)
+from services.account_service import reset_password
+from services.db_service import DBService
+from services.encryption import encryptor
+from services.serializers import serialize_ldap_account_row
+from web.home import columns, display_columns, templates
+
+PASSWORD = "<Secret&1>"
+
+
+def account(user_id: str, principal: str) -> LDAPAccount:
+    record = DBService.build_ldap_account_record(
+        user_id, principal, encryptor.encrypt_password(PASSWORD)
+    )
+    record.version = 1
+    return record
+
+
+def test_rendered_accounts_keep_passwords_out_of_the_cache():
+    accounts = [account("user", "cache_a"), account("user", "cache_b")]
+    html = templates.get_template("_accounts.html").render(
+        user=None,
+        ad_accounts=accounts,
+        columns=columns,
+        display_columns=display_columns,
+    )
+
+    cached = AccountsHTML(html, [record.kadmin_password for record in accounts])
+
+    assert PASSWORD.encode() not in pickle.dumps(cached)
+    shown = cached.fill()
+    assert shown.count("&lt;Secret&amp;1&gt;") == 2
+    assert "cache_a" in shown and "cache_b" in shown
+
+
+def test_cached_rows_are_decrypted_per_response():
+    rows = [serialize_ldap_account_row(account("user", "cache_c"))]
+
+    assert reveal_passwords(rows)[0]["kadmin_password"] == PASSWORD
+    # The cached rows are left encrypted
+    assert rows[0]["kadmin_password"] != PASSWORD
+
+
+def test_reset_drops_the_cached_fragments(run, directory, make_user):
+    user_id = make_user("cache_reset")
+    directory.add_s("OU=ADAM,DC=test,DC=local", [("ou", [b"ADAM"])])
+    directory.add_s(USERS_DN, [("ou", [b"Users"])])
+    directory.add_s(f"CN=cache_reset,{USERS_DN}", [("cn", [b"cache_reset"])])
+    with SessionLocal() as db:
+        DBService(db).add_ldap_account_records([account(user_id, "cache_reset")])
+    version = AccountsVersion([])
+    for kind in ("html", "json"):
+        set_fragment(kind, user_id, version, [])
+
+    run(reset_password(user_id, "cache_reset"))
+
+    assert get_fragment("html", user_id, version) is None
+    assert get_fragment("json", user_id, version) is None
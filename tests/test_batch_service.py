@@ -0,0 +1,134 @@
+import asyncio
+import time
+
+import ldap
+
+from conftest import USERS_DN
+from models.database import SessionLocal
+from models.leases import OperationLease
+from models.ldap_accounts import LDAPAccount
+from services.account_service import CREATED
+from services.ad_service import ADService
+from services.batch_service import BatchProvisioner
+from services.single_flight import SingleFlight
+
+
+def in_directory(connection, username: str) -> bool:
+    return bool(
+        connection.search_s(
+            USERS_DN, ldap.SCOPE_ONELEVEL, f"(sAMAccountName={username})"
+        )
+    )
+
+
+def stored(username: str) -> bool:
+    with SessionLocal() as db:
+        return db.get(LDAPAccount, username) is not None
+
+
+def test_results_come_once_the_chunk_is_stored(directory, make_user):
+    user_ids = [make_user("batch_a"), make_user("batch_b")]
+    with SessionLocal() as db:
+        results = BatchProvisioner(db, chunk_size=1).provision(user_ids)
+
+        first = next(results)
+        assert first["username"] == "batch_a"
+        assert first["status"] == "created"
+        assert stored("batch_a")
+        # Reported before the next chunk is done
+        assert not in_directory(directory, "batch_b")
+
+        assert [result["status"] for result in results] == ["created"]
+        assert in_directory(directory, "batch_b")
+        assert stored("batch_b")
+
+
+def test_rows_failing_to_store_are_reported_as_errors(directory, make_user):
+    other = make_user("batch_other")
+    user_ids = [make_user("batch_c"), make_user("batch_d")]
+    with SessionLocal() as db:
+        # The principal of batch_c is taken by another user's record
+        db.add(LDAPAccount(kadmin_principal="batch_c", sso_user_id=other))
+        db.commit()
+
+        results = list(BatchProvisioner(db).provision(user_ids))
+
+        assert [(result["username"], result["status"]) for result in results] == [
+            ("batch_c", "error"),
+            ("batch_d", "created"),
+        ]
+        assert results[0]["detail"].startswith("Database error")
+        assert db.get(LDAPAccount, "batch_d").sso_user_id == user_ids[1]
+
+
+def lease(user_id: str) -> OperationLease:
+    with SessionLocal() as db:
+        return db.get(OperationLease, f"create:{user_id}")
+
+
+def test_users_being_created_elsewhere_are_busy(directory, make_user):
+    user_id = make_user("batch_busy")
+    with SessionLocal() as db:
+        # A request in another worker is creating the account
+        db.add(
+            OperationLease(
+                key=f"create:{user_id}", owner="other", expires_at=time.time() + 60
+            )
+        )
+        db.commit()
+
+        results = list(BatchProvisioner(db).provision([user_id]))
+
+    assert results[0]["status"] == "busy"
+    assert not in_directory(directory, "batch_busy")
+    assert lease(user_id).owner == "other"
+
+
+def test_outcome_is_stored_for_callers_waiting_on_the_batch(directory, make_user):
+    user_ids = [make_user("batch_lease"), make_user("batch_dead")]
+    with SessionLocal() as db:
+        # Left behind by a worker that died
+        db.add(
+            OperationLease(
+                key=f"create:{user_ids[1]}", owner="dead", expires_at=time.time() - 1
+            )
+        )
+        db.commit()
+
+        results = list(BatchProvisioner(db).provision(user_ids))
+
+    assert [result["status"] for result in results] == ["created", "created"]
+    for user_id in user_ids:
+        assert lease(user_id).owner != "dead"
+        assert lease(user_id).outcome == {"status_code": 200, "detail": CREATED}
+
+
+def test_request_during_the_batch_gets_its_result(
+    run, directory, make_user, monkeypatch
+):
+    user_id = make_user("batch_wait")
+    provision_account = ADService.provision_account
+
+    def slow(self, *args, **kwargs):
+        time.sleep(0.3)
+        return provision_account(self, *args, **kwargs)
+
+    monkeypatch.setattr(ADService, "provision_account", slow)
+
+    def batch():
+        with SessionLocal() as db:
+            return list(BatchProvisioner(db).provision([user_id]))
+
+    async def create():
+        raise AssertionError("The account was created twice")
+
+    async def main():
+        results = asyncio.create_task(asyncio.to_thread(batch))
+        await asyncio.sleep(0.1)
+        message = await SingleFlight().run("create", user_id, create)
+        return message, await results
+
+    message, results = run(main())
+
+    assert message == CREATED
+    assert results[0]["status"] == "created"
@@ -0,0 +1,145 @@
+import threading
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from config import LDAPBreakerConfig
+from services.ad_service import ADService
+from services.circuit_breaker import CircuitBreaker, ldap_breaker
+
+OPEN_SECONDS = 0.1
+
+
+@pytest.fixture
+def breaker():
+    return CircuitBreaker(
+        LDAPBreakerConfig(failure_threshold=2, open_seconds=OPEN_SECONDS)
+    )
+
+
+def rejection(breaker: CircuitBreaker) -> HTTPException:
+    with pytest.raises(HTTPException) as error:
+        breaker.before_call()
+    return error.value
+
+
+def in_thread(func):
+    """Calls func from another thread, returns its exception or None"""
+    outcome = []
+
+    def call():
+        try:
+            func()
+            outcome.append(None)
+        except Exception as e:
+            outcome.append(e)
+
+    thread = threading.Thread(target=call)
+    thread.start()
+    thread.join()
+    return outcome[0]
+
+
+def test_opens_after_failures_in_a_row(breaker):
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == "closed"
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    error = rejection(breaker)
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "1"}
+
+
+def test_lets_one_trial_through_once_open_seconds_passed(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(OPEN_SECONDS)
+
+    breaker.before_call()
+
+    assert breaker.state == "half_open"
+    # The trial thread may go on, others wait for its outcome
+    breaker.before_call()
+    error = in_thread(breaker.before_call)
+    assert error.status_code == 503
+    assert error.headers == {"Retry-After": "1"}
+
+
+def test_successful_trial_closes(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(OPEN_SECONDS)
+    breaker.before_call()
+
+    breaker.record_success()
+
+    assert breaker.status() == {"state": "closed", "failures": 0}
+    assert in_thread(breaker.before_call) is None
+
+
+def test_failed_trial_opens_again(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(OPEN_SECONDS)
+    breaker.before_call()
+
+    breaker.record_failure()
+
+    assert breaker.state == "open"
+    assert rejection(breaker).status_code == 503
+
+
+def test_stuck_trial_is_replaced(breaker):
+    breaker.record_failure()
+    breaker.record_failure()
+    time.sleep(OPEN_SECONDS)
+    # The trial thread never reports back
+    assert in_thread(breaker.before_call) is None
+    assert rejection(breaker).status_code == 503
+
+    time.sleep(OPEN_SECONDS)
+
+    breaker.before_call()
+    assert breaker.state == "half_open"
+
+
+def test_disabled_breaker_lets_everything_through():
+    breaker = CircuitBreaker(LDAPBreakerConfig(enabled=False, failure_threshold=1))
+    breaker.record_failure()
+    breaker.record_failure()
+
+    breaker.before_call()
+    assert breaker.state == "closed"
+
+
+def test_unreachable_directory_opens_the_circuit(monkeypatch):
+    monkeypatch.setattr(
+        ldap_breaker,
+        "config",
+        LDAPBreakerConfig(failure_threshold=2, open_seconds=OPEN_SECONDS),
+    )
+    monkeypatch.setenv("FAKE_LDAP_DOWN", "ldap://dc1.test.local")
+
+    for _ in range(2):
+        with pytest.raises(HTTPException) as error:
+            ADService().connect()
+        assert error.value.status_code == 500
+    with pytest.raises(HTTPException) as error:
+        ADService().connect()
+    assert error.value.status_code == 503
+    assert ldap_breaker.state == "open"
+
+    monkeypatch.delenv("FAKE_LDAP_DOWN")
+    time.sleep(OPEN_SECONDS)
+    ad_service = ADService()
+    ad_service.connect()
+    ad_service.read_root_dse()
+    ad_service.disconnect()
+
+    assert ldap_breaker.state == "closed"
@@ -0,0 +1,122 @@
+import time
+from datetime import datetime, timedelta
+
+import ldap
+import orjson
+from sqlalchemy import delete
+
+from api.v1.jobs import job_events
+from conftest import USERS_DN
+from models.database import AsyncSessionLocal
+from models.jobs import ProvisioningJob
+from services.account_service import create_account
+from services.db_service import AsyncDBService
+from services.jobs import job_runner
+from services.provisioning import build_user_attributes
+
+
+class Request:
+    """The client of an event stream, still connected"""
+
+    async def is_disconnected(self) -> bool:
+        return False
+
+
+async def add_job(user_id: str, **columns) -> ProvisioningJob:
+    async with AsyncSessionLocal() as db:
+        return await AsyncDBService(db).add_job(
+            ProvisioningJob(operation="create", sso_user_id=user_id, **columns)
+        )
+
+
+async def abandoned_job(user_id: str, step: str, created_at: datetime) -> str:
+    """A job whose worker died at the step, its lease expired"""
+    job = await add_job(
+        user_id,
+        status="running",
+        step=step,
+        attempts=1,
+        owner="dead",
+        lease_expires_at=time.time() - 1,
+        created_at=created_at,
+    )
+    return job.id
+
+
+async def rerun(job_id: str) -> ProvisioningJob:
+    job = await job_runner._claim()
+    assert job.id == job_id
+    assert job.attempts == 2
+    await job_runner._run(job)
+    async with AsyncSessionLocal() as db:
+        return await AsyncDBService(db).get_job(job_id)
+
+
+async def create(user_id: str, username: str) -> None:
+    attributes = build_user_attributes(username, f"{username}@example.com")
+    await create_account(user_id, username, attributes)
+
+
+def test_event_stream_ends_with_an_error_when_the_job_is_gone(run, make_user):
+    user_id = make_user("jobs_gone")
+
+    async def main():
+        job = await add_job(user_id)
+        response = await job_events(user_id, job.id, Request())
+        events = response.body_iterator
+        first = await anext(events)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                delete(ProvisioningJob).where(ProvisioningJob.id == job.id)
+            )
+            await db.commit()
+        return first, [event async for event in events]
+
+    first, rest = run(main())
+
+    assert orjson.loads(first.removeprefix(b"data: "))["status"] == "queued"
+    assert rest == [b'event: error\ndata: {"detail":"Job not found"}\n\n']
+
+
+def test_rerun_after_the_record_was_stored_succeeds(run, make_user):
+    user_id = make_user("jobs_stored")
+
+    async def main():
+        job_id = await abandoned_job(user_id, "record", datetime.now())
+        # What the first attempt did before its worker died
+        await create(user_id, "jobs_stored")
+        return await rerun(job_id)
+
+    job = run(main())
+
+    assert job.status == "succeeded"
+    assert job.message == "AD account successfully created"
+
+
+def test_rerun_does_not_take_an_older_record_for_its_own(run, make_user):
+    user_id = make_user("jobs_older")
+
+    async def main():
+        await create(user_id, "jobs_older")
+        job_id = await abandoned_job(
+            user_id, "record", datetime.now() + timedelta(seconds=1)
+        )
+        return await rerun(job_id)
+
+    job = run(main())
+
+    assert job.status == "failed"
+    assert job.status_code == 409
+
+
+def test_rerun_before_the_record_step_creates_the_account(run, make_user, directory):
+    user_id = make_user("jobs_early")
+
+    async def main():
+        job_id = await abandoned_job(user_id, "user", datetime.now())
+        return await rerun(job_id)
+
+    job = run(main())
+
+    assert job.status == "succeeded"
+    assert directory.search_s(f"CN=jobs_early,{USERS_DN}", ldap.SCOPE_BASE)
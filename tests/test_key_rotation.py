@@ -0,0 +1,109 @@
+import pytest
+from cryptography.fernet import Fernet
+from pydantic import SecretStr
+
+from config import config
+from models.database import SessionLocal
+from models.ldap_accounts import LDAPAccount
+from services.encryption import PasswordEncryptor, encryptor
+from services.key_rotation import KeyRotation
+
+PRINCIPALS = [f"rot_{i}" for i in range(5)]
+
+
+@pytest.fixture
+def new_cipher(monkeypatch):
+    """Encryptor after a rotation, the configured key became the old one"""
+    monkeypatch.setattr(config.encryption, "old_keys", [config.encryption.secret_key])
+    monkeypatch.setattr(
+        config.encryption, "secret_key", SecretStr(Fernet.generate_key().decode())
+    )
+    return PasswordEncryptor()
+
+
+@pytest.fixture
+def accounts(make_user):
+    user_id = make_user("rotation")
+    with SessionLocal() as db:
+        for principal in PRINCIPALS:
+            password = encryptor.encrypt_password(f"{principal}-password")
+            db.add(
+                LDAPAccount(
+                    kadmin_principal=principal,
+                    kadmin_password=password,
+                    sso_user_id=user_id,
+                )
+            )
+        db.commit()
+
+
+def stored(db) -> dict:
+    return {
+        principal: db.get(LDAPAccount, principal).kadmin_password
+        for principal in PRINCIPALS
+    }
+
+
+def test_interrupted_rotation_resumes_after_the_last_batch(
+    accounts, new_cipher, tmp_path
+):
+    state_path = str(tmp_path / "rotation.json")
+    with SessionLocal() as db:
+        first = KeyRotation(db, batch_size=2, state_path=state_path, cipher=new_cipher)
+        progress = next(first.run())
+        assert progress["after"] == "rot_1"
+        assert progress["rotated"] == 2
+        # The process stops here, the state file tells the next run where
+
+        second = KeyRotation(db, batch_size=2, state_path=state_path, cipher=new_cipher)
+        batches = list(second.run())
+
+        assert batches[0]["processed"] == 4
+        assert batches[-1]["processed"] == 5
+        assert batches[-1]["rotated"] == 3
+        assert batches[-1]["current"] == 0
+        db.expire_all()
+        for principal, password in stored(db).items():
+            assert new_cipher.is_current(password)
+            assert new_cipher.decrypt_password(password) == f"{principal}-password"
+    assert not (tmp_path / "rotation.json").exists()
+
+
+def test_state_of_a_rotation_to_another_key_is_ignored(accounts, new_cipher, tmp_path):
+    state_path = str(tmp_path / "rotation.json")
+    with SessionLocal() as db:
+        next(KeyRotation(db, batch_size=2, state_path=state_path).run())
+
+        batches = list(
+            KeyRotation(
+                db, batch_size=2, state_path=state_path, cipher=new_cipher
+            ).run()
+        )
+
+        assert batches[-1]["processed"] == 5
+        assert batches[-1]["rotated"] == 5
+
+
+def test_password_reset_during_rotation_is_kept(accounts, new_cipher, tmp_path):
+    state_path = str(tmp_path / "rotation.json")
+    with SessionLocal() as db:
+        rotation = KeyRotation(
+            db, batch_size=5, state_path=state_path, cipher=new_cipher
+        )
+        read_batch = rotation._read_batch
+
+        def reset_after_read(after):
+            rows = read_batch(after)
+            # The service stores a new password between the read and the write
+            account = db.get(LDAPAccount, "rot_3")
+            account.kadmin_password = new_cipher.encrypt_password("reset")
+            db.commit()
+            return rows
+
+        rotation._read_batch = reset_after_read
+        progress = next(rotation.run())
+
+        assert progress["rotated"] == 4
+        assert progress["changed"] == 1
+        db.expire_all()
+        assert new_cipher.decrypt_password(stored(db)["rot_3"]) == "reset"
@@ -0,0 +1,134 @@
+import ldap
+import pytest
+
+from conftest import GROUP_DNS, USERS_DN
+from services.ad_service import ADService
+from services.encryption import encryptor
+from services.ldap_pipeline import LDAPPipeline
+from services.provisioning import build_user_attributes, known_dns, provisioning_plan
+
+
+@pytest.fixture
+def drop_connection(monkeypatch):
+    """
+    Fails the nth result3 call of the fake with SERVER_DOWN, as a connection
+    dropped in flight: before the server ran the pending operations, or
+    after it applied them if applied is set
+    """
+    result3 = ldap.LDAPObject.result3
+    calls = []
+
+    def drop(nth: int, applied: bool = False):
+        def flaky(self, *args, **kwargs):
+            calls.append(args)
+            if len(calls) == nth:
+                if applied:
+                    result3(self, *args, **kwargs)
+                raise ldap.SERVER_DOWN({"desc": "Connection dropped (test)"})
+            return result3(self, *args, **kwargs)
+
+        monkeypatch.setattr(ldap.LDAPObject, "result3", flaky)
+        return calls
+
+    return drop
+
+
+def entry(connection, dn: str) -> dict:
+    return connection.search_s(dn, ldap.SCOPE_BASE)[0][1]
+
+
+def test_execute_twice_sends_the_same_operations(directory):
+    pipeline = LDAPPipeline()
+    pipeline.add(f"CN=first,{GROUP_DNS[0]}", [("cn", [b"first"])])
+    pipeline.add(GROUP_DNS[0], [("cn", [b"G1"])], ignore=(ldap.ALREADY_EXISTS,))
+
+    first = [operation.error for operation in pipeline.execute(directory)]
+    second = pipeline.execute(directory)
+
+    assert [operation.dn for operation in second] == [
+        f"CN=first,{GROUP_DNS[0]}",
+        GROUP_DNS[0],
+    ]
+    assert first[0] is None
+    # Each run starts without the outcome of the previous one
+    assert isinstance(second[0].error, ldap.ALREADY_EXISTS)
+    assert not second[1].failed
+
+
+def test_pipeline_is_sent_again_after_a_dropped_connection(directory, drop_connection):
+    calls = drop_connection(2)
+    ad_service = ADService()
+    ad_service.connect()
+    try:
+        ad_service.create_ous(
+            [("ADAM", "DC=test,DC=local"), ("Users", "OU=ADAM,DC=test,DC=local")]
+        )
+    finally:
+        ad_service.disconnect()
+
+    # The second result is lost, both are read again on the new connection
+    assert len(calls) == 4
+    assert entry(directory, USERS_DN)["ou"] == [b"Users"]
+
+
+@pytest.fixture
+def parent_ous(directory):
+    for ou_dn in provisioning_plan.ou_dns():
+        known_dns.set(ou_dn, True)
+    directory.add_s("OU=ADAM,DC=test,DC=local", [("ou", [b"ADAM"])])
+    directory.add_s(USERS_DN, [("ou", [b"Users"])])
+
+
+def assert_member_once(connection, username: str) -> None:
+    for group_dn in GROUP_DNS:
+        members = entry(connection, group_dn)["member"]
+        assert members.count(f"CN={username},{USERS_DN}".encode()) == 1
+
+
+def test_account_is_created_after_a_dropped_connection(
+    directory, parent_ous, drop_connection
+):
+    # The first result of the user pipeline
+    drop_connection(1)
+    attributes = build_user_attributes("dropped", "dropped@example.com")
+
+    encrypted, was_existing = ADService().create_account("dropped", attributes)
+
+    user = entry(directory, f"CN=dropped,{USERS_DN}")
+    assert not was_existing
+    password = encryptor.decrypt_password(encrypted)
+    assert user["unicodePwd"] == [f'"{password}"'.encode("utf-16-le")]
+    assert_member_once(directory, "dropped")
+
+
+def test_retried_user_add_that_was_applied_resets_the_password(
+    directory, parent_ous, drop_connection
+):
+    # The user pipeline ran, its first result is lost
+    drop_connection(1, applied=True)
+    attributes = build_user_attributes("applied", "applied@example.com")
+
+    encrypted, was_existing = ADService().create_account("applied", attributes)
+
+    # The retry finds the user it added and takes the existing-user path
+    assert was_existing
+    password = encryptor.decrypt_password(encrypted)
+    assert password != attributes.password
+    user = entry(directory, f"CN=applied,{USERS_DN}")
+    assert user["unicodePwd"] == [f'"{password}"'.encode("utf-16-le")]
+    assert_member_once(directory, "applied")
+
+
+def test_retried_group_adds_that_were_applied_are_not_errors(
+    directory, parent_ous, drop_connection, caplog
+):
+    # The first result of the group pipeline, after the two of the user one
+    drop_connection(3, applied=True)
+    attributes = build_user_attributes("grouped", "grouped@example.com")
+
+    encrypted, was_existing = ADService().create_account("grouped", attributes)
+
+    assert not was_existing
+    assert encryptor.decrypt_password(encrypted) == attributes.password
+    assert_member_once(directory, "grouped")
+    assert not [record for record in caplog.records if record.levelname == "ERROR"]
@@ -0,0 +1,69 @@
+import ldap
+
+from config import config
+from conftest import GROUP_DNS, USERS_DN
+from services.ad_service import ADService
+from services.provisioning import (
+    ProvisioningPlan,
+    build_user_attributes,
+    provisioning_plan,
+)
+
+NESTED_DN = "OU=Users, OU=Corp,OU=Users,DC=test,DC=local"
+
+
+def plan(users_dn: str) -> ProvisioningPlan:
+    return ProvisioningPlan(
+        config.ldap.model_copy(update={"default_users_dn": users_dn})
+    )
+
+
+def test_ou_chain_follows_the_dn_with_repeated_names():
+    nested = plan(NESTED_DN)
+
+    assert nested.ou_chain == [
+        ("Users", "DC=test,DC=local"),
+        ("Corp", "OU=Users,DC=test,DC=local"),
+        ("Users", "OU=Corp,OU=Users,DC=test,DC=local"),
+    ]
+    assert nested.ou_dns() == [
+        "OU=Users,DC=test,DC=local",
+        "OU=Corp,OU=Users,DC=test,DC=local",
+        "OU=Users,OU=Corp,OU=Users,DC=test,DC=local",
+    ]
+
+
+def test_ous_with_repeated_names_are_created_parents_first(directory):
+    ad_service = ADService()
+    ad_service.connect()
+    try:
+        ad_service.create_ous(plan(NESTED_DN).ou_chain)
+    finally:
+        ad_service.disconnect()
+
+    assert directory.search_s(
+        "OU=Users,OU=Corp,OU=Users,DC=test,DC=local", ldap.SCOPE_BASE
+    )
+
+
+def test_groups_not_validated_at_startup_are_validated_with_an_account(
+    directory, monkeypatch
+):
+    missing = "CN=Missing,DC=test,DC=local"
+    monkeypatch.setattr(provisioning_plan, "group_dns", [*GROUP_DNS, missing])
+    monkeypatch.setattr(provisioning_plan, "groups_validated", False)
+    ad_service = ADService()
+    # AD is down at startup
+    monkeypatch.setenv("FAKE_LDAP_DOWN", config.ldap.url)
+    ad_service.validate_groups()
+    assert not provisioning_plan.groups_validated
+    monkeypatch.delenv("FAKE_LDAP_DOWN")
+
+    ad_service.create_account(
+        "validated", build_user_attributes("validated", "validated@example.com")
+    )
+
+    assert provisioning_plan.groups_validated
+    assert provisioning_plan.group_dns == GROUP_DNS
+    members = directory.search_s(GROUP_DNS[0], ldap.SCOPE_BASE)[0][1]["member"]
+    assert f"CN=validated,{USERS_DN}".encode() in members
@@ -0,0 +1,34 @@
+from config import config
+from services.reconciliation import classify
+
+
+def entry(username: str, control: int = 0x200) -> dict:
+    return {
+        "sAMAccountName": [username.encode()],
+        "userAccountControl": [str(control).encode()],
+    }
+
+
+def test_users_dn_is_compared_in_canonical_form(monkeypatch):
+    monkeypatch.setattr(
+        config.ldap, "default_users_dn", "OU=Users, OU=ADAM,  DC=test,DC=local"
+    )
+
+    assert classify("CN=recon,OU=Users,OU=ADAM,DC=test,DC=local", entry("recon")) == (
+        "recon",
+        None,
+    )
+    assert classify("CN=recon,OU=Other,OU=ADAM,DC=test,DC=local", entry("recon")) == (
+        "recon",
+        "moved",
+    )
+
+
+def test_escaped_characters_are_compared_unescaped(monkeypatch):
+    monkeypatch.setattr(
+        config.ldap, "default_users_dn", "OU=R\\2CD,OU=ADAM,DC=test,DC=local"
+    )
+
+    assert classify(
+        "CN=recon,OU=R\\,D,OU=ADAM,DC=test,DC=local", entry("recon", 0x202)
+    ) == ("recon", "disabled")
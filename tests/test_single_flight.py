@@ -0,0 +1,103 @@
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from sqlalchemy import update
+
+from config import config
+from models.database import AsyncSessionLocal
+from models.leases import OperationLease
+from services.single_flight import SingleFlight
+
+
+@pytest.fixture(autouse=True)
+def short_lease(monkeypatch):
+    monkeypatch.setattr(config.provisioning, "lease_ttl", 0.3)
+    monkeypatch.setattr(config.provisioning, "poll_interval", 0.02)
+
+
+def operation(calls: list, seconds: float = 0.0, result: str = "done"):
+    async def func() -> str:
+        calls.append(result)
+        await asyncio.sleep(seconds)
+        return result
+
+    return func
+
+
+async def add_lease(key: str, expires_in: float) -> None:
+    async with AsyncSessionLocal() as db:
+        db.add(
+            OperationLease(key=key, owner="other", expires_at=time.time() + expires_in)
+        )
+        await db.commit()
+
+
+async def get_lease(key: str) -> OperationLease:
+    async with AsyncSessionLocal() as db:
+        return await db.get(OperationLease, key)
+
+
+def test_leader_running_past_the_lease_ttl_is_not_replaced(run):
+    calls = []
+
+    async def main():
+        leader = asyncio.create_task(
+            SingleFlight().run("create", "sf-slow", operation(calls, 1.0, "leader"))
+        )
+        await asyncio.sleep(0.05)
+        # Another instance, as in another worker, arriving while it runs
+        follower = await SingleFlight().run(
+            "create", "sf-slow", operation(calls, 0.0, "follower")
+        )
+        return await leader, follower
+
+    assert run(main()) == ("leader", "leader")
+    assert calls == ["leader"]
+
+
+def test_expired_lease_is_taken_over(run):
+    calls = []
+
+    async def main():
+        # Left behind by a worker that died
+        await add_lease("create:sf-dead", expires_in=-1)
+        result = await SingleFlight().run("create", "sf-dead", operation(calls))
+        return result, await get_lease("create:sf-dead")
+
+    result, lease = run(main())
+
+    assert result == "done"
+    assert calls == ["done"]
+    assert lease.owner != "other"
+    assert lease.outcome == {"status_code": 200, "detail": "done"}
+
+
+def test_waiters_get_the_outcome_of_a_live_lease(run):
+    calls = []
+
+    async def main():
+        await add_lease("create:sf-live", expires_in=5)
+        waiter = asyncio.create_task(
+            SingleFlight().run("create", "sf-live", operation(calls))
+        )
+        await asyncio.sleep(0.1)
+        async with AsyncSessionLocal() as db:
+            await db.execute(
+                update(OperationLease)
+                .where(OperationLease.key == "create:sf-live")
+                .values(
+                    outcome={"status_code": 409, "detail": "Exists"},
+                    expires_at=time.time(),
+                )
+            )
+            await db.commit()
+        return await waiter
+
+    with pytest.raises(HTTPException) as error:
+        run(main())
+
+    assert error.value.status_code == 409
+    assert error.value.detail == "Exists"
+    assert calls == []